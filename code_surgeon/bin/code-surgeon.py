@@ -2,25 +2,56 @@
 from __future__ import annotations
 import argparse, json, sys
 from pathlib import Path
-from surgery.runner import Plan, execute
+from surgery.runner import Plan, SurgeonSession
 
 def parse_args():
     ap = argparse.ArgumentParser(description="Fragment-only code splicer (safe surgeon).")
-    ap.add_argument("--file", required=True, help="Target file to modify")
-    ap.add_argument("--mode", required=True, choices=["line-range", "regex-block"])
-    ap.add_argument("--start", required=True, help="Start line (int) or regex pattern")
-    ap.add_argument("--end", required=True, help="End line (int) or regex pattern")
-    ap.add_argument("--new-fragment", required=True, help="Path to file containing the new fragment")
+    ap.add_argument("--job", default=None,
+                    help="Job JSON (surgery/jobs/) instead of --file/--mode/...; supports multi-block 'blocks'")
+    ap.add_argument("--file", default=None, help="Target file to modify")
+    ap.add_argument("--mode", default=None, choices=["line-range", "regex-block", "full-file-replace"])
+    ap.add_argument("--start", default=None, help="Start line (int) or regex pattern (not used by full-file-replace)")
+    ap.add_argument("--end", default=None, help="End line (int) or regex pattern (not used by full-file-replace)")
+    ap.add_argument("--new-fragment", default=None, help="Path to file containing the new fragment")
     ap.add_argument("--post-cmd", default=None, help="Command to run after splicing (e.g., 'pytest -q')")
     ap.add_argument("--keep-indent", action="store_true", help="Preserve base indent of original block")
     ap.add_argument("--cwd", default=None, help="Working dir for post-cmd")
-    return ap.parse_args()
+    ap.add_argument("--streaming", action="store_true", default=None,
+                    help="Force byte-range streaming splice (auto for files >= 1 MiB)")
+    ap.add_argument("--shadow", action="store_true",
+                    help="Run tests and post-cmd in a copy-on-write shadow tree before touching the real file")
+    ap.add_argument("--no-test-cache", action="store_true",
+                    help="Always run tests, even if the same content already has a cached result (flaky suites)")
+    ap.add_argument("--trace", default=None,
+                    help="Append per-phase timings to this JSONL trace (default: $CODE_SURGEON_TRACE)")
+    args = ap.parse_args()
+    if args.job:
+        return args
+    if args.file is None or args.mode is None or args.new_fragment is None:
+        ap.error("--file, --mode and --new-fragment are required without --job")
+    if args.mode != "full-file-replace" and (args.start is None or args.end is None):
+        ap.error(f"--start and --end are required for --mode {args.mode}")
+    return args
 
 def main():
     args = parse_args()
-    plan = Plan(file=args.file, mode=args.mode, start=args.start, end=args.end,
-                new_fragment_path=args.new_fragment, post_cmd=args.post_cmd)
-    result = execute(plan, keep_indent=args.keep_indent, cwd=args.cwd)
+    session = SurgeonSession(keep_indent=args.keep_indent, cwd=args.cwd,
+                             trace_path=Path(args.trace) if args.trace else None)
+    if args.job:
+        job = json.loads(Path(args.job).read_text(encoding="utf-8"))
+        target = Path(job["file"])
+    else:
+        plan = Plan(file=args.file, mode=args.mode, start=args.start or "", end=args.end or "",
+                    new_fragment_path=args.new_fragment, post_cmd=args.post_cmd,
+                    streaming=args.streaming, shadow=args.shadow,
+                    cache_tests=not args.no_test_cache)
+        target = Path(args.file)
+    # Intenciones que un proceso anterior dejó abiertas (una vez por invocación)
+    recovered = session.recover(session.root_for(target))
+    result = session.execute_job(job) if args.job else session.execute(plan)
+    if recovered:
+        result["recovered"] = recovered
+    session.close()
     print(json.dumps(result, ensure_ascii=False, indent=2))
 
 if __name__ == "__main__":
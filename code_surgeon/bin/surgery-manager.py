@@ -41,6 +41,8 @@ def cmd_history(args):
     print(f"📚 Historial de cambios:\n")
     for i, record in enumerate(history, 1):
         print(f"{i}. {record.timestamp}")
+        if record.record_id:
+            print(f"   ID: {record.record_id}")
         print(f"   Archivo: {record.file_path}")
         print(f"   Modo: {record.mode} [{record.start_marker}...{record.end_marker}]")
         print(f"   Hash: {record.original_hash} → {record.new_hash}")
@@ -54,8 +56,21 @@ def cmd_history(args):
     return 0
 
 def cmd_rollback(args):
-    """Ejecuta rollback del último cambio a un archivo"""
+    """Ejecuta rollback del último cambio a un archivo, o de todos los cambios desde --since"""
     mgr = RollbackManager(Path("surgery"))
+    if args.since:
+        return cmd_rollback_since(mgr, args)
+    if args.id:
+        record = mgr.get_record(args.id)
+        if record is None:
+            print(f"❌ Registro no encontrado: {args.id}")
+            return 1
+        success, message = mgr.rollback_to_record(record)
+        print(message)
+        return 0 if success else 1
+    if not args.file:
+        print("❌ Indica un archivo, --id o --since")
+        return 1
     file_path = Path(args.file)
     
     if not file_path.exists():
@@ -86,6 +101,27 @@ def cmd_rollback(args):
     
     return 0 if success else 1
 
+def cmd_rollback_since(mgr: RollbackManager, args):
+    """Rollback en bloque de todos los cambios en la ventana [--since, --until]"""
+    window = f"desde {args.since}" + (f" hasta {args.until}" if args.until else "")
+    
+    if not args.force:
+        print(f"⚠️  Estás a punto de revertir todos los cambios {window}")
+        print()
+        
+        confirm = input("¿Continuar? [y/N]: ").strip().lower()
+        if confirm not in ['y', 'yes', 's', 'si', 'sí']:
+            print("❌ Rollback cancelado")
+            return 1
+    
+    result = mgr.rollback_since(args.since, args.until)
+    if not result.restored and not result.conflicts:
+        print(f"✅ No hay cambios {window}")
+        return 0
+    
+    print(result.summary())
+    return 0 if result.ok else 1
+
 def cmd_verify(args):
     """Verifica integridad de archivos modificados"""
     mgr = RollbackManager(Path("surgery"))
@@ -117,7 +153,7 @@ def cmd_test(args):
     
     print(f"🧪 Ejecutando tests para {file_path}...\n")
     
-    result = runner.run_tests_for_file(file_path)
+    result = runner.run_tests_for_file(file_path, use_cache=not args.no_cache)
     
     print(result.summary())
     if args.verbose:
@@ -150,12 +186,54 @@ def cmd_clean(args):
             print("❌ Operación cancelada")
             return 1
     
-    for f in old_files:
-        f.unlink()
+    mgr.delete_records(old_files)
     
     print(f"✅ {len(old_files)} registros eliminados")
     return 0
 
+def cmd_compact(args):
+    """Empaqueta registros antiguos en surgery/packs/ sin perder historial"""
+    from datetime import datetime, timedelta, timezone
+    
+    mgr = RollbackManager(Path("surgery"))
+    cutoff = datetime.now(timezone.utc) - timedelta(days=args.days)
+    stats = mgr.compact(cutoff, squash=not args.no_squash)
+    
+    if not stats["packed"]:
+        print(f"✅ No hay registros más antiguos de {args.days} días en applied/")
+        return 0
+    
+    print(f"✅ {stats['packed']} registros empaquetados en {mgr.pack.pack_path}")
+    if stats["squashed"]:
+        print(f"   {stats['squashed']} estados intermedios fusionados")
+    return 0
+
+def cmd_coverage(args):
+    """Carga mapas de cobertura por test en surgery/coverage.db"""
+    from code_surgeon.surgery.coverage import CoverageIndex
+    
+    index = CoverageIndex(Path.cwd())
+    try:
+        if args.coverage_py:
+            loaded = index.ingest_coverage_py(Path(args.coverage_py))
+            print(f"✅ Cobertura de {loaded} tests cargada desde {args.coverage_py}")
+        else:
+            if not args.test:
+                print("❌ --istanbul requiere --test (el test que produjo el reporte)")
+                return 1
+            loaded = index.ingest_istanbul(args.test, Path(args.istanbul))
+            print(f"✅ {args.test}: {loaded} archivos cubiertos")
+    finally:
+        index.close()
+    return 0
+
+def cmd_reindex(args):
+    """Reconstruye el índice SQLite del historial desde los registros JSON"""
+    mgr = RollbackManager(Path("surgery"))
+    imported = mgr.reindex()
+    print(f"✅ Índice actualizado: {imported} registros importados")
+    return 0
+
 def main():
     parser = argparse.ArgumentParser(
         description="Code Surgeon - Gestión de Rollback y Testing",
@@ -165,9 +243,14 @@ Ejemplos:
   %(prog)s list                          # Lista cambios aplicados
   %(prog)s history server/app.js         # Historial de un archivo
   %(prog)s rollback server/app.js        # Rollback del último cambio
+  %(prog)s rollback --id 0000000042       # Rollback de un registro específico
+  %(prog)s rollback --since 2025-11-02T14:00  # Revierte todos los cambios desde T
   %(prog)s verify                        # Verifica integridad
   %(prog)s test server/app.js            # Ejecuta tests para un archivo
   %(prog)s clean --days 30               # Limpia registros >30 días
+  %(prog)s compact --days 30             # Empaqueta registros >30 días (conserva historial)
+  %(prog)s reindex                       # Reconstruye el índice del historial
+  %(prog)s coverage --test tests/backend/app.test.js --istanbul coverage/coverage-final.json
         """
     )
     
@@ -181,8 +264,11 @@ Ejemplos:
     parser_history.add_argument('file', nargs='?', help='Archivo a consultar (opcional)')
     
     # rollback
-    parser_rollback = subparsers.add_parser('rollback', help='Rollback del último cambio')
-    parser_rollback.add_argument('file', help='Archivo a revertir')
+    parser_rollback = subparsers.add_parser('rollback', help='Rollback del último cambio (o desde --since)')
+    parser_rollback.add_argument('file', nargs='?', help='Archivo a revertir')
+    parser_rollback.add_argument('--id', help='Revierte el registro con este id (ver `history`)')
+    parser_rollback.add_argument('--since', help='Revierte todos los cambios desde este instante ISO (hora local si no tiene zona)')
+    parser_rollback.add_argument('--until', help='Límite superior de la ventana de --since (inclusive)')
     parser_rollback.add_argument('-f', '--force', action='store_true', help='No pedir confirmación')
     
     # verify
@@ -192,12 +278,28 @@ Ejemplos:
     parser_test = subparsers.add_parser('test', help='Ejecuta tests para un archivo')
     parser_test.add_argument('file', help='Archivo a testear')
     parser_test.add_argument('-v', '--verbose', action='store_true', help='Muestra output completo')
+    parser_test.add_argument('--no-cache', action='store_true', help='Ejecuta aunque haya un resultado cacheado')
     
     # clean
     parser_clean = subparsers.add_parser('clean', help='Limpia registros antiguos')
     parser_clean.add_argument('--days', type=int, default=30, help='Días de antigüedad (default: 30)')
     parser_clean.add_argument('-f', '--force', action='store_true', help='No pedir confirmación')
     
+    # compact
+    parser_compact = subparsers.add_parser('compact', help='Empaqueta registros antiguos en un pack')
+    parser_compact.add_argument('--days', type=int, default=30, help='Días de antigüedad (default: 30)')
+    parser_compact.add_argument('--no-squash', action='store_true', help='No fusionar estados intermedios')
+    
+    # coverage
+    parser_coverage = subparsers.add_parser('coverage', help='Carga cobertura por test para elegir tests por líneas')
+    source = parser_coverage.add_mutually_exclusive_group(required=True)
+    source.add_argument('--istanbul', help='coverage-final.json de Jest/Vitest generado corriendo solo --test')
+    source.add_argument('--coverage-py', help='JSON de coverage.py con contextos (coverage json --show-contexts)')
+    parser_coverage.add_argument('--test', help='Test que produjo el reporte istanbul')
+    
+    # reindex
+    subparsers.add_parser('reindex', help='Reconstruye el índice SQLite desde los JSON')
+    
     args = parser.parse_args()
     
     if not args.command:
@@ -211,7 +313,10 @@ Ejemplos:
         'rollback': cmd_rollback,
         'verify': cmd_verify,
         'test': cmd_test,
-        'clean': cmd_clean
+        'clean': cmd_clean,
+        'compact': cmd_compact,
+        'coverage': cmd_coverage,
+        'reindex': cmd_reindex
     }
     
     try:
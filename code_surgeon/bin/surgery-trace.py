@@ -0,0 +1,8 @@
+#!/usr/bin/env python3
+"""Convierte un trace JSONL de code-surgeon al formato Chrome trace-event (chrome://tracing, Perfetto)"""
+from __future__ import annotations
+import sys
+from surgery.tracing import main
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,246 @@
+"""
+Content-Addressed Blob Store
+Almacena versiones de archivos comprimidas con zlib y direccionadas por sha256.
+Contenidos idénticos se guardan una sola vez (deduplicación), al estilo de los objetos de Git.
+
+Un blob puede reescribirse como delta inverso contra una versión más nueva (deltify): solo
+guarda los bytes que difieren. La lectura reconstruye desde la base completa aplicando los
+deltas de la cadena y verifica el sha256, así que la dirección del blob no cambia.
+"""
+from __future__ import annotations
+import os
+import zlib
+import shutil
+import struct
+import hashlib
+import tempfile
+from pathlib import Path
+from typing import Optional
+from .diffing import common_prefix, common_suffix
+
+_CHUNK = 1 << 20
+
+# Formato delta: magic + sha256 (hex) de la base + zlib([offset, len_base, len_data, data]...)
+_DELTA_MAGIC = b"DLT1"
+_HUNK = struct.Struct("<QQQ")
+
+# Blobs más grandes que esto no se deltifican (la reconstrucción es en memoria)
+DELTA_MAX_BYTES = 64 << 20
+_DIFF_MAX_LINES = 20000
+
+Hunk = tuple[int, int, bytes]  # (offset en la base, bytes de la base a reemplazar, bytes nuevos)
+
+
+class BlobStore:
+    """Almacén de blobs inmutables: <root>/<2 hex>/<62 hex>"""
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path_for(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest[2:]
+
+    def exists(self, digest: str) -> bool:
+        return self.path_for(digest).exists()
+
+    def put(self, data: bytes) -> str:
+        """Guarda bytes y retorna su sha256 (no reescribe blobs existentes)"""
+        digest = hashlib.sha256(data).hexdigest()
+        if not self.exists(digest):
+            self._commit(zlib.compress(data, 6), digest)
+        return digest
+
+    def put_file(self, path: Path) -> str:
+        """Guarda un archivo en streaming (memoria constante) y retorna su sha256"""
+        h = hashlib.sha256()
+        comp = zlib.compressobj(6)
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as out, open(path, "rb") as src:
+                for chunk in iter(lambda: src.read(_CHUNK), b""):
+                    h.update(chunk)
+                    out.write(comp.compress(chunk))
+                out.write(comp.flush())
+                out.flush()
+                os.fsync(out.fileno())
+            digest = h.hexdigest()
+            target = self.path_for(digest)
+            if target.exists():
+                os.unlink(tmp)
+            else:
+                self._shard(target)
+                os.replace(tmp, target)
+                _fsync_dir(target.parent)
+            return digest
+        except Exception:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def get(self, digest: str) -> bytes:
+        """Recupera y verifica el contenido de un blob (reconstruyendo deltas si hace falta)"""
+        raw = self.path_for(digest).read_bytes()
+        if raw.startswith(_DELTA_MAGIC):
+            base = raw[len(_DELTA_MAGIC):len(_DELTA_MAGIC) + 64].decode("ascii")
+            data = apply_hunks(self.get(base), decode_hunks(zlib.decompress(raw[len(_DELTA_MAGIC) + 64:])))
+        else:
+            data = zlib.decompress(raw)
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Blob corrupto: {digest}")
+        return data
+    
+    def delta_base(self, digest: str) -> Optional[str]:
+        """sha256 de la base si el blob está guardado como delta"""
+        with open(self.path_for(digest), "rb") as f:
+            head = f.read(len(_DELTA_MAGIC) + 64)
+        if head.startswith(_DELTA_MAGIC):
+            return head[len(_DELTA_MAGIC):].decode("ascii")
+        return None
+    
+    def chain(self, digest: str) -> list[str]:
+        """Cadena de bases desde `digest` hasta el blob completo (sin incluir `digest`)"""
+        bases = []
+        base = self.delta_base(digest)
+        while base is not None:
+            bases.append(base)
+            base = self.delta_base(base)
+        return bases
+    
+    def deltify(self, digest: str, base: str) -> bool:
+        """
+        Reescribe `digest` como delta inverso contra `base` (normalmente la versión siguiente
+        del mismo archivo). No se deltifica si ya es delta, si crearía un ciclo, si el blob es
+        muy grande o si el delta no ahorra espacio. Retorna True si se reescribió.
+        """
+        if digest == base or not self.exists(digest) or not self.exists(base):
+            return False
+        if self.delta_base(digest) is not None or digest in self.chain(base):
+            return False
+        target = self.path_for(digest)
+        if target.stat().st_size > DELTA_MAX_BYTES:
+            return False
+        data, base_data = self.get(digest), self.get(base)
+        if len(data) > DELTA_MAX_BYTES or len(base_data) > DELTA_MAX_BYTES:
+            return False
+        delta = _DELTA_MAGIC + base.encode("ascii") + zlib.compress(encode_hunks(diff_bytes(base_data, data)), 6)
+        if len(delta) >= target.stat().st_size:
+            return False
+        self._commit(delta, digest)
+        return True
+
+    def restore_to(self, digest: str, path: Path) -> None:
+        """
+        Restaura un blob sobre `path` de forma atómica: descomprime en streaming a un
+        temporal del mismo directorio, verifica el hash, fsync y rename.
+        """
+        h = hashlib.sha256()
+        decomp = zlib.decompressobj()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".restore")
+        try:
+            with os.fdopen(fd, "wb") as out, open(self.path_for(digest), "rb") as src:
+                if src.read(len(_DELTA_MAGIC)) == _DELTA_MAGIC:
+                    # Delta: reconstrucción en memoria desde el snapshot más cercano
+                    data = self.get(digest)
+                    h.update(data)
+                    out.write(data)
+                else:
+                    src.seek(0)
+                    for chunk in iter(lambda: src.read(_CHUNK), b""):
+                        data = decomp.decompress(chunk)
+                        h.update(data)
+                        out.write(data)
+                    tail = decomp.flush()
+                    h.update(tail)
+                    out.write(tail)
+                out.flush()
+                os.fsync(out.fileno())
+            if h.hexdigest() != digest:
+                raise ValueError(f"Blob corrupto: {digest}")
+            if path.exists():
+                shutil.copymode(path, tmp)
+            os.replace(tmp, path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def _commit(self, compressed: bytes, digest: str) -> None:
+        # Los registros referencian el blob apenas put retorna: contenido y nombre van a disco
+        # antes (un corte de luz no puede dejar un registro apuntando a un blob vacío o ausente)
+        target = self.path_for(digest)
+        self._shard(target)
+        fd, tmp = tempfile.mkstemp(dir=target.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as out:
+            out.write(compressed)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp, target)
+        _fsync_dir(target.parent)
+
+    def _shard(self, target: Path) -> None:
+        """Crea el directorio <2 hex> del blob; uno nuevo se persiste en la raíz del almacén"""
+        if not target.parent.is_dir():
+            target.parent.mkdir(exist_ok=True)
+            _fsync_dir(self.root)
+
+
+def _fsync_dir(path: Path) -> None:
+    """fsync de un directorio para persistir sus entradas (sin equivalente en Windows)"""
+    if os.name == "nt":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def diff_bytes(base: bytes, data: bytes) -> list[Hunk]:
+    """
+    Hunks que transforman `base` en `data`: se recortan prefijo y sufijo comunes y el resto
+    se compara por líneas, así que ediciones separadas en el archivo dan hunks separados.
+    """
+    import difflib
+    # Comparación por bloques como file_diff: un bucle byte a byte en Python no escala
+    prefix = common_prefix(base, data)
+    prefix = base.rfind(b"\n", 0, prefix) + 1
+    suffix = common_suffix(base, data, min(len(base), len(data)) - prefix)
+    a = base[prefix:len(base) - suffix].splitlines(keepends=True)
+    b = data[prefix:len(data) - suffix].splitlines(keepends=True)
+    if len(a) + len(b) > _DIFF_MAX_LINES:
+        # Reescritura masiva: un solo hunk evita el costo cuadrático de SequenceMatcher
+        return [(prefix, len(base) - suffix - prefix, data[prefix:len(data) - suffix])]
+    hunks: list[Hunk] = []
+    pos_a = [prefix]
+    for line in a:
+        pos_a.append(pos_a[-1] + len(line))
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag != "equal":
+            hunks.append((pos_a[i1], pos_a[i2] - pos_a[i1], b"".join(b[j1:j2])))
+    return hunks
+
+
+def apply_hunks(base: bytes, hunks: list[Hunk]) -> bytes:
+    out, pos = [], 0
+    for offset, length, data in sorted(hunks, key=lambda h: h[0]):
+        out.append(base[pos:offset])
+        out.append(data)
+        pos = offset + length
+    out.append(base[pos:])
+    return b"".join(out)
+
+
+def encode_hunks(hunks: list[Hunk]) -> bytes:
+    return b"".join(_HUNK.pack(offset, length, len(data)) + data for offset, length, data in hunks)
+
+
+def decode_hunks(payload: bytes) -> list[Hunk]:
+    hunks, pos = [], 0
+    while pos < len(payload):
+        offset, length, size = _HUNK.unpack_from(payload, pos)
+        pos += _HUNK.size
+        hunks.append((offset, length, payload[pos:pos + size]))
+        pos += size
+    return hunks
@@ -0,0 +1,174 @@
+"""
+Coverage Index (selección de tests por líneas)
+Índice local (surgery/coverage.db) de qué tests ejecutan qué líneas de cada archivo, cargado
+desde mapas de cobertura por test: istanbul JSON (Jest, Vitest/c8 con reporter json) y
+coverage.py JSON con contextos dinámicos (--show-contexts) para scripts Python.
+
+Cada par (test, archivo) guarda el hash (12 caracteres, como ChangeRecord) con el que se tomó
+esa cobertura: los tests se ingieren por separado y en momentos distintos. Si algún test que
+cubre el archivo se tomó con otro hash, sus números de línea no son confiables y la consulta
+retorna None para que el registro use la selección por grafo de imports.
+"""
+from __future__ import annotations
+import json
+import sqlite3
+from pathlib import Path
+from typing import Iterable, Optional
+from .digests import text_digest
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS covered (
+    test TEXT NOT NULL,
+    path TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (test, path)
+);
+CREATE INDEX IF NOT EXISTS idx_covered_path ON covered (path);
+CREATE TABLE IF NOT EXISTS spans (
+    test TEXT NOT NULL,
+    path TEXT NOT NULL,
+    start_line INTEGER NOT NULL,
+    end_line INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_spans_path ON spans (path, start_line, end_line);
+CREATE INDEX IF NOT EXISTS idx_spans_test ON spans (test);
+"""
+
+
+class CoverageIndex:
+    """Cobertura por test de los archivos del proyecto"""
+
+    def __init__(self, project_root: Path, db_path: Optional[Path] = None):
+        self.project_root = project_root.resolve()
+        self.db_path = db_path or self.project_root / "surgery" / "coverage.db"
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # Perezoso: proyectos sin cobertura ingerida no crean la base
+        if self._conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+            _drop_legacy(self._conn)
+        return self._conn
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _relative(self, path: str) -> Optional[str]:
+        try:
+            return (self.project_root / path).resolve().relative_to(self.project_root).as_posix()
+        except ValueError:
+            return None
+
+    # --- ingesta ---------------------------------------------------------
+
+    def ingest_istanbul(self, test: str, report_path: Path) -> int:
+        """
+        Carga un coverage-final.json (istanbul) producido al correr solo `test`.
+        Reemplaza la cobertura previa de ese test; retorna cuántos archivos cubrió.
+        """
+        report = json.loads(report_path.read_text(encoding="utf-8"))
+        spans: dict[str, list[tuple[int, int]]] = {}
+        for key, data in report.items():
+            rel = self._relative(data.get("path", key))
+            if rel is None:
+                continue
+            covered = [
+                (loc["start"]["line"], loc["end"]["line"])
+                for sid, loc in data.get("statementMap", {}).items()
+                if data.get("s", {}).get(sid)
+            ]
+            if covered:
+                spans[rel] = _merge(covered)
+        self._replace(test, spans)
+        return len(spans)
+
+    def ingest_coverage_py(self, report_path: Path) -> int:
+        """
+        Carga un JSON de coverage.py con contextos ("coverage json --show-contexts").
+        El contexto "tests/scripts/test_x.py::test_y|run" se atribuye al archivo de test.
+        Retorna cuántos tests se cargaron.
+        """
+        report = json.loads(report_path.read_text(encoding="utf-8"))
+        per_test: dict[str, dict[str, list[int]]] = {}
+        for path, data in report.get("files", {}).items():
+            rel = self._relative(path)
+            if rel is None:
+                continue
+            for line, contexts in data.get("contexts", {}).items():
+                for context in contexts:
+                    test = context.split("::")[0].split("|")[0]
+                    if test:
+                        per_test.setdefault(test, {}).setdefault(rel, []).append(int(line))
+        for test, files in per_test.items():
+            self._replace(test, {rel: _merge((n, n) for n in lines) for rel, lines in files.items()})
+        return len(per_test)
+
+    def _replace(self, test: str, spans: dict[str, list[tuple[int, int]]]) -> None:
+        """Reemplaza la cobertura de `test` y registra el hash actual de cada archivo que cubre"""
+        digests = {}
+        for rel in spans:
+            try:
+                digests[rel] = text_digest(self.project_root / rel)[:12]
+            except (FileNotFoundError, UnicodeDecodeError):
+                continue
+        with self.conn:
+            self.conn.execute("DELETE FROM spans WHERE test = ?", (test,))
+            self.conn.execute("DELETE FROM covered WHERE test = ?", (test,))
+            for rel, digest in digests.items():
+                self.conn.execute("INSERT INTO covered (test, path, digest) VALUES (?, ?, ?)", (test, rel, digest))
+                self.conn.executemany(
+                    "INSERT INTO spans (test, path, start_line, end_line) VALUES (?, ?, ?, ?)",
+                    [(test, rel, start, end) for start, end in spans[rel]]
+                )
+
+    # --- consultas -------------------------------------------------------
+
+    def tests_for_lines(self, file_path: Path, start_line: int, end_line: int,
+                        file_hash: str) -> Optional[list[str]]:
+        """
+        Tests cuya cobertura toca las líneas [start_line, end_line] del archivo tal como estaba
+        con `file_hash`. None si no hay cobertura confiable (sin datos, algún test que cubre el
+        archivo se ingirió con otro hash, o ningún test ejecuta esas líneas: el cambio puede
+        afectar código que la cobertura no ve).
+        """
+        if not self.db_path.exists():
+            return None
+        rel = self._relative(str(file_path))
+        digests = {r[0] for r in self.conn.execute("SELECT DISTINCT digest FROM covered WHERE path = ?", (rel,))}
+        if digests != {file_hash[:12]}:
+            return None
+        tests = [
+            r[0] for r in self.conn.execute(
+                "SELECT DISTINCT test FROM spans WHERE path = ? AND start_line <= ? AND end_line >= ? ORDER BY test",
+                (rel, end_line, start_line)
+            )
+        ]
+        return tests or None
+
+
+def _drop_legacy(conn: sqlite3.Connection) -> None:
+    """
+    Bases anteriores guardaban un solo hash por archivo (tabla files): sus spans no dicen con
+    qué contenido se tomó cada test, así que se descartan y la cobertura debe reingerirse.
+    """
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'files'").fetchone():
+        with conn:
+            conn.execute("DELETE FROM spans")
+            conn.execute("DROP TABLE files")
+
+
+def _merge(spans: Iterable[tuple[int, int]]) -> list[tuple[int, int]]:
+    """Une rangos de líneas solapados o contiguos"""
+    merged: list[list[int]] = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
@@ -0,0 +1,325 @@
+"""
+Region-Anchored Diff
+Genera unified diffs comparando solo la región reemplazada contra el nuevo fragmento.
+El prefijo y sufijo del archivo no cambian, así que se usan únicamente como contexto
+y para numerar los hunks con el offset de línea conocido.
+"""
+from __future__ import annotations
+import difflib
+from bisect import bisect_left
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Sequence
+from .selectors import SpanSelection, open_buffer
+
+# Por encima de este producto de tamaños se usa patience diff en lugar de difflib (cuadrático)
+PATIENCE_THRESHOLD = 250_000
+
+# Huecos sin líneas únicas más pequeños que esto se resuelven con difflib
+_SMALL_GAP = 40_000
+
+# Bloque de comparación al buscar prefijo/sufijo comunes entre dos archivos
+_CMP_CHUNK = 1 << 16
+
+Opcode = tuple[str, int, int, int, int]
+
+
+class _FixedOpcodes(difflib.SequenceMatcher):
+    """SequenceMatcher con opcodes precalculados, para reutilizar get_grouped_opcodes()"""
+
+    def __init__(self, opcodes: list[Opcode]):
+        super().__init__(None, [], [])
+        self._fixed = opcodes
+
+    def get_opcodes(self):
+        return self._fixed
+
+
+@dataclass
+class RegionEdit:
+    """Una región reemplazada: offset en el archivo original, líneas viejas/nuevas y contexto"""
+    line_offset: int
+    old_lines: Sequence[str]
+    new_lines: Sequence[str]
+    before: Sequence[str] = ()
+    after: Sequence[str] = ()  # para diffs múltiples: hasta la siguiente región como máximo
+
+
+def region_diff(old_lines: Sequence[str], new_lines: Sequence[str], line_offset: int,
+                fromfile: str, tofile: str, before: Sequence[str] = (), after: Sequence[str] = (),
+                n: int = 3, algorithm: str = "auto") -> str:
+    """
+    Unified diff de una región.
+
+    - old_lines/new_lines: líneas (sin terminador) de la región original y del reemplazo
+    - line_offset: número de líneas del archivo que preceden a la región
+    - before/after: líneas de contexto inmediatamente anteriores/posteriores (sin cambios)
+    - algorithm: 'difflib', 'patience' o 'auto' (patience para reemplazos grandes)
+    """
+    edit = RegionEdit(line_offset, old_lines, new_lines, before, after)
+    return multi_region_diff([edit], fromfile, tofile, n=n, algorithm=algorithm)
+
+
+def multi_region_diff(edits: Sequence[RegionEdit], fromfile: str, tofile: str,
+                      n: int = 3, algorithm: str = "auto") -> str:
+    """
+    Unified diff de varias regiones del mismo archivo (sin solapamiento).
+    Regiones separadas por <= 2n líneas se funden en un solo hunk usando su `after`
+    como líneas intermedias; la numeración del lado nuevo acumula el delta de las anteriores.
+    """
+    edits = sorted(edits, key=lambda e: e.line_offset)
+    out: list[str] = []
+    delta = 0
+    i = 0
+    while i < len(edits):
+        # Agrupar regiones cercanas
+        cluster = [edits[i]]
+        while i + 1 < len(edits):
+            prev, nxt = cluster[-1], edits[i + 1]
+            gap = nxt.line_offset - (prev.line_offset + len(prev.old_lines))
+            if gap > 2 * n or len(prev.after) < gap:
+                break
+            cluster.append(nxt)
+            i += 1
+        i += 1
+
+        first = cluster[0]
+        before = list(first.before)[-n:] if n else []
+        a: list[str] = list(before)
+        b: list[str] = list(before)
+        opcodes: list[Opcode] = [("equal", 0, len(before), 0, len(before))]
+        for k, edit in enumerate(cluster):
+            for tag, i1, i2, j1, j2 in _inner_opcodes(edit.old_lines, edit.new_lines, algorithm):
+                opcodes.append((tag, i1 + len(a), i2 + len(a), j1 + len(b), j2 + len(b)))
+            a.extend(edit.old_lines)
+            b.extend(edit.new_lines)
+            if k + 1 < len(cluster):
+                gap = cluster[k + 1].line_offset - (edit.line_offset + len(edit.old_lines))
+                tail = list(edit.after)[:gap]
+            else:
+                tail = list(edit.after)[:n] if n else []
+            opcodes.append(("equal", len(a), len(a) + len(tail), len(b), len(b) + len(tail)))
+            a.extend(tail)
+            b.extend(tail)
+
+        base_a = first.line_offset - len(before)
+        out.append(_format_hunks(a, b, _merge_equal(opcodes), base_a, base_a + delta, n))
+        delta += sum(len(e.new_lines) - len(e.old_lines) for e in cluster)
+
+    body = "".join(out)
+    if not body:
+        return ""
+    return f"--- {fromfile}\n+++ {tofile}\n" + body
+
+
+def file_diff(old_path: Path, new_path: Path, fromfile: str, tofile: str,
+              n: int = 3, algorithm: str = "auto") -> str:
+    """
+    Unified diff entre dos archivos sin cargarlos completos como texto.
+    Prefijo y sufijo comunes se detectan comparando bloques de bytes sobre mmap (ajustados a
+    límites de línea); solo la región intermedia que cambió se decodifica y se pasa a region_diff.
+    """
+    a, b = open_buffer(old_path), open_buffer(new_path)
+    try:
+        prefix = common_prefix(a, b)
+        prefix = a.rfind(b"\n", 0, prefix) + 1
+        suffix = common_suffix(a, b, min(len(a), len(b)) - prefix)
+        a_end, b_end = len(a) - suffix, len(b) - suffix
+        # El sufijo debe empezar en inicio de línea en ambos archivos: si no, se recorta hasta
+        # su primer salto de línea (el sufijo es idéntico, así que el ajuste es el mismo en ambos)
+        if not (_at_line_start(a, a_end, prefix) and _at_line_start(b, b_end, prefix)):
+            nl = a.find(b"\n", a_end)
+            skip = len(a) - a_end if nl == -1 else nl + 1 - a_end
+            a_end, b_end = a_end + skip, b_end + skip
+        line_offset = sum(a[i:min(i + _CMP_CHUNK, prefix)].count(b"\n") for i in range(0, prefix, _CMP_CHUNK))
+        old = SpanSelection(line_offset + 1, line_offset + 1, prefix, a_end, a)
+        new = SpanSelection(line_offset + 1, line_offset + 1, prefix, b_end, b)
+        return region_diff(
+            old.mid_bytes.decode("utf-8", errors="replace").splitlines(),
+            new.mid_bytes.decode("utf-8", errors="replace").splitlines(),
+            line_offset, fromfile, tofile,
+            before=old.lines_before(n), after=old.lines_after(n), n=n, algorithm=algorithm,
+        )
+    finally:
+        for buf in (a, b):
+            if hasattr(buf, "close"):
+                buf.close()
+
+
+def _at_line_start(buf, pos: int, floor: int) -> bool:
+    return pos == floor or buf[pos - 1] == 0x0A
+
+
+def common_prefix(a, b) -> int:
+    """Longitud en bytes del prefijo común (bloques grandes primero, luego bisección)"""
+    limit = min(len(a), len(b))
+    lo = 0
+    while lo < limit:
+        hi = min(lo + _CMP_CHUNK, limit)
+        if a[lo:hi] != b[lo:hi]:
+            break
+        lo = hi
+    else:
+        return limit
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+
+def common_suffix(a, b, limit: int) -> int:
+    """Longitud en bytes del sufijo común, sin superar `limit`"""
+    la, lb = len(a), len(b)
+    lo = 0
+    while lo < limit:
+        hi = min(lo + _CMP_CHUNK, limit)
+        if a[la - hi:la - lo] != b[lb - hi:lb - lo]:
+            break
+        lo = hi
+    else:
+        return limit
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if a[la - mid:la - lo] == b[lb - mid:lb - lo]:
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+
+def _inner_opcodes(old_lines: Sequence[str], new_lines: Sequence[str], algorithm: str) -> list[Opcode]:
+    if algorithm == "auto":
+        algorithm = "patience" if len(old_lines) * len(new_lines) > PATIENCE_THRESHOLD else "difflib"
+    if algorithm == "patience":
+        return patience_opcodes(old_lines, new_lines)
+    if algorithm == "difflib":
+        return difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False).get_opcodes()
+    raise ValueError(f"Unknown diff algorithm: {algorithm}")
+
+
+def _format_hunks(a: list[str], b: list[str], opcodes: list[Opcode], base_a: int, base_b: int, n: int) -> str:
+    out = []
+    for group in _FixedOpcodes(opcodes).get_grouped_opcodes(n):
+        first, last = group[0], group[-1]
+        out.append(f"@@ -{_format_range(base_a + first[1], last[2] - first[1])} "
+                   f"+{_format_range(base_b + first[3], last[4] - first[3])} @@\n")
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                out.extend(" " + line + "\n" for line in a[i1:i2])
+                continue
+            if tag in ("replace", "delete"):
+                out.extend("-" + line + "\n" for line in a[i1:i2])
+            if tag in ("replace", "insert"):
+                out.extend("+" + line + "\n" for line in b[j1:j2])
+    return "".join(out)
+
+
+def _format_range(start: int, length: int) -> str:
+    """Rango unified diff (misma convención que difflib)"""
+    beginning = start + 1
+    if length == 1:
+        return f"{beginning}"
+    if not length:
+        beginning -= 1
+    return f"{beginning},{length}"
+
+
+def _merge_equal(opcodes: list[Opcode]) -> list[Opcode]:
+    merged: list[Opcode] = []
+    for op in opcodes:
+        if op[1] == op[2] and op[3] == op[4]:
+            continue
+        if merged and merged[-1][0] == op[0] == "equal":
+            prev = merged.pop()
+            op = ("equal", prev[1], op[2], prev[3], op[4])
+        merged.append(op)
+    return merged
+
+
+def patience_opcodes(a: Sequence[str], b: Sequence[str]) -> list[Opcode]:
+    """
+    Patience diff: ancla en líneas únicas en ambos lados (LIS en O(k log k)),
+    recorta prefijos/sufijos comunes y resuelve recursivamente los huecos.
+    Huecos pequeños sin anclas se delegan a difflib; los grandes se marcan como reemplazo.
+    """
+    matches: list[tuple[int, int]] = []
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        alo, ahi, blo, bhi = stack.pop()
+        # Prefijo común
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            matches.append((alo, blo))
+            alo += 1
+            blo += 1
+        # Sufijo común
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+            matches.append((ahi, bhi))
+        if alo == ahi or blo == bhi:
+            continue
+        anchors = _unique_lis(a, b, alo, ahi, blo, bhi)
+        if not anchors:
+            if (ahi - alo) * (bhi - blo) <= _SMALL_GAP:
+                sm = difflib.SequenceMatcher(None, a[alo:ahi], b[blo:bhi], autojunk=False)
+                for i, j, size in sm.get_matching_blocks():
+                    matches.extend((alo + i + t, blo + j + t) for t in range(size))
+            continue
+        prev_a, prev_b = alo, blo
+        for i, j in anchors:
+            matches.append((i, j))
+            stack.append((prev_a, i, prev_b, j))
+            prev_a, prev_b = i + 1, j + 1
+        stack.append((prev_a, ahi, prev_b, bhi))
+
+    matches.sort()
+    opcodes: list[Opcode] = []
+    i = j = 0
+    for mi, mj in matches + [(len(a), len(b))]:
+        if mi > i or mj > j:
+            tag = "replace" if mi > i and mj > j else ("delete" if mi > i else "insert")
+            opcodes.append((tag, i, mi, j, mj))
+        if mi < len(a):
+            opcodes.append(("equal", mi, mi + 1, mj, mj + 1))
+        i, j = mi + 1, mj + 1
+    return _merge_equal(opcodes)
+
+
+def _unique_lis(a: Sequence[str], b: Sequence[str], alo: int, ahi: int, blo: int, bhi: int) -> list[tuple[int, int]]:
+    """Pares (i, j) de líneas únicas en ambos rangos que forman la subsecuencia creciente más larga"""
+    counts: dict[str, list[int]] = {}
+    for i in range(alo, ahi):
+        entry = counts.setdefault(a[i], [0, 0, i])
+        entry[0] += 1
+    for j in range(blo, bhi):
+        entry = counts.get(b[j])
+        if entry is not None:
+            entry[1] += 1
+            entry.append(j)
+    pairs = sorted((e[2], e[3]) for e in counts.values() if e[0] == 1 and e[1] == 1)
+    if not pairs:
+        return []
+
+    # Patience sorting sobre las posiciones en b
+    tails: list[int] = []
+    tail_idx: list[int] = []
+    back: list[int] = [-1] * len(pairs)
+    for idx, (_, j) in enumerate(pairs):
+        pos = bisect_left(tails, j)
+        if pos == len(tails):
+            tails.append(j)
+            tail_idx.append(idx)
+        else:
+            tails[pos] = j
+            tail_idx[pos] = idx
+        back[idx] = tail_idx[pos - 1] if pos else -1
+    result = []
+    idx = tail_idx[-1]
+    while idx != -1:
+        result.append(pairs[idx])
+        idx = back[idx]
+    result.reverse()
+    return result
@@ -0,0 +1,81 @@
+"""
+File Digest Cache
+Cache persistente de sha256 por archivo, indexado por (path, inode, size, mtime_ns).
+Un archivo cuya firma no cambió nunca se vuelve a leer ni a hashear.
+"""
+from __future__ import annotations
+import os
+import json
+import time
+import hashlib
+from pathlib import Path
+from typing import Optional
+from .lineindex import file_signature, RACY_WINDOW_NS
+
+_CHUNK = 1 << 20
+
+
+def text_digest(path: Path) -> str:
+    """
+    sha256 del contenido tal como lo retorna read_text() (UTF-8, saltos de línea universales),
+    calculado en streaming. Coincide con los hashes históricos de ChangeRecord.
+    """
+    h = hashlib.sha256()
+    with open(path, "r", encoding="utf-8", newline=None) as f:
+        for chunk in iter(lambda: f.read(_CHUNK), ""):
+            h.update(chunk.encode("utf-8"))
+    return h.hexdigest()
+
+
+class DigestCache:
+    """Digests de archivos con invalidación por firma de stat"""
+
+    def __init__(self, cache_path: Optional[Path] = None):
+        self.cache_path = cache_path
+        self._entries: dict[str, list] = {}
+        self._dirty = False
+        if cache_path and cache_path.exists():
+            try:
+                self._entries = json.loads(cache_path.read_text(encoding="utf-8"))
+            except (ValueError, OSError):
+                self._entries = {}
+
+    def digest(self, path: Path) -> str:
+        """sha256 completo (hex) del archivo; reutiliza el cacheado si la firma coincide"""
+        key = str(Path(path).resolve())
+        signature = list(file_signature(path))
+        entry = self._entries.get(key)
+        if entry and entry[:3] == signature:
+            return entry[3]
+        hashed_at = time.time_ns()
+        digest = text_digest(path)
+        # Solo se cachean firmas estables: un mtime reciente puede repetirse tras otra escritura
+        if list(file_signature(path)) == signature and hashed_at - signature[2] > RACY_WINDOW_NS:
+            self._entries[key] = signature + [digest]
+            self._dirty = True
+        elif entry:
+            del self._entries[key]
+            self._dirty = True
+        return digest
+
+    def short(self, path: Path) -> str:
+        """Hash abreviado (12 caracteres) usado por ChangeRecord"""
+        return self.digest(path)[:12]
+
+    def flush(self) -> None:
+        """Persiste el cache si hubo cambios"""
+        if not self._dirty or not self.cache_path:
+            return
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.cache_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(self._entries), encoding="utf-8")
+        os.replace(tmp, self.cache_path)
+        self._dirty = False
+
+
+# Cache en memoria del proceso para llamadas sin cache explícito (utils.sha256 con Path)
+_process_cache = DigestCache()
+
+
+def process_cache() -> DigestCache:
+    return _process_cache
@@ -0,0 +1,314 @@
+"""
+History Index (SQLite)
+Índice de los ChangeRecord en surgery/history.db: archivo, timestamp, hashes, modo y blobs.
+Los JSON de applied/ y rollback/ siguen siendo el audit trail; el índice evita abrirlos y
+parsearlos para consultar el historial de un archivo o su último registro (B-tree, O(log n)).
+
+Si applied/ cambia por fuera del índice (versiones anteriores, reset_environment.py, borrado
+manual), su mtime deja de coincidir con el guardado y el índice se reconcilia por nombre.
+Un mtime registrado dentro de RACY_WINDOW_NS no se considera confiable por sí solo (regla
+"racy git"): mientras no pase la ventana también debe coincidir la cantidad de entradas de
+applied/ (un listado, sin leer archivos ni recorrer la tabla). Los registros solo se escriben
+con el lock del historial y cada escritura propia llama a mark_synced, así que lo que cae en
+el mismo tick sin lock son archivos ajenos (salida de jobs del watcher), que cambian la cuenta.
+Los JSON de applied/ que no son ChangeRecord se recuerdan en `skipped` y no se vuelven a leer.
+"""
+from __future__ import annotations
+import os
+import json
+import time
+import sqlite3
+from dataclasses import fields
+from pathlib import Path
+from typing import Iterable, Optional
+from .lineindex import RACY_WINDOW_NS
+
+# Campos de ChangeRecord que no se devuelven en consultas de listado (pueden ser grandes)
+_CONTENT_FIELDS = ("original_content", "new_content")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    record_name TEXT NOT NULL UNIQUE,
+    state TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    start_marker TEXT,
+    end_marker TEXT,
+    original_content TEXT,
+    new_content TEXT,
+    original_hash TEXT,
+    new_hash TEXT,
+    backup_path TEXT,
+    post_cmd TEXT,
+    post_cmd_result TEXT,
+    job_file TEXT,
+    original_blob TEXT,
+    new_blob TEXT,
+    transaction_id TEXT,
+    record_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_records_file ON records (file_path, state, timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_records_time ON records (state, timestamp DESC, id DESC);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS skipped (record_name TEXT PRIMARY KEY);
+"""
+
+# Se crea después de migrar columnas: índices de historial creados antes no tienen record_id
+_ID_INDEX = "CREATE UNIQUE INDEX IF NOT EXISTS idx_records_id ON records (record_id)"
+
+APPLIED = "applied"
+ROLLED_BACK = "rolled_back"
+
+
+class HistoryIndex:
+    """Índice SQLite de registros de cambio"""
+
+    def __init__(self, db_path: Path, record_type):
+        self.db_path = db_path
+        self.record_type = record_type
+        self._columns = [f.name for f in fields(record_type)]
+        self._meta_columns = [c for c in self._columns if c not in _CONTENT_FIELDS]
+        self.conn = sqlite3.connect(db_path, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+        self._migrate()
+        self.conn.execute(_ID_INDEX)
+
+    def _migrate(self) -> None:
+        """Agrega columnas de campos nuevos de ChangeRecord a índices creados por versiones anteriores"""
+        existing = {row["name"] for row in self.conn.execute("PRAGMA table_info(records)")}
+        with self.conn:
+            for column in self._columns:
+                if column not in existing:
+                    self.conn.execute(f"ALTER TABLE records ADD COLUMN {column} TEXT")
+
+    def close(self) -> None:
+        self.conn.close()
+
+    # --- escritura -------------------------------------------------------
+
+    def add(self, record, record_name: str, state: str = APPLIED) -> None:
+        values = {c: getattr(record, c) for c in self._columns}
+        values["post_cmd_result"] = json.dumps(values["post_cmd_result"]) if values["post_cmd_result"] is not None else None
+        values.update(record_name=record_name, state=state)
+        cols = ", ".join(values)
+        marks = ", ".join("?" for _ in values)
+        with self.conn:
+            self.conn.execute(f"INSERT OR REPLACE INTO records ({cols}) VALUES ({marks})", list(values.values()))
+
+    def next_record_id(self) -> str:
+        """
+        Siguiente id de registro: contador monótono en `meta` (el llamador tiene el lock del
+        historial). Decimal con ceros a la izquierda para que el orden de texto sea el numérico.
+        """
+        seq = int(self._meta("record_seq") or 0) + 1
+        self._set_meta("record_seq", str(seq))
+        return f"{seq:010d}"
+
+    def _bump_record_seq(self) -> None:
+        """Tras importar JSON (índice reconstruido) el contador no puede quedar por debajo de un id existente"""
+        row = self.conn.execute("SELECT MAX(record_id) FROM records").fetchone()
+        if row[0] is not None and row[0].isdigit() and int(row[0]) > int(self._meta("record_seq") or 0):
+            self._set_meta("record_seq", str(int(row[0])))
+
+    def set_state(self, record_name: str, state: str) -> None:
+        with self.conn:
+            self.conn.execute("UPDATE records SET state = ? WHERE record_name = ?", (state, record_name))
+
+    def remove(self, record_names: Iterable[str]) -> None:
+        with self.conn:
+            self.conn.executemany("DELETE FROM records WHERE record_name = ?", [(n,) for n in record_names])
+
+    # --- consultas -------------------------------------------------------
+
+    def history(self, file_path: Optional[str] = None, limit: Optional[int] = None,
+                state: str = APPLIED, with_content: bool = True) -> list:
+        """
+        Registros en `state`, más reciente primero. Con with_content=False no se leen las
+        columnas de contenido inline (listados y verificaciones solo necesitan metadatos).
+        """
+        columns = self._columns if with_content else self._meta_columns
+        sql = f"SELECT {', '.join(columns)} FROM records WHERE state = ?"
+        params: list = [state]
+        if file_path is not None:
+            sql += " AND file_path = ?"
+            params.append(file_path)
+        sql += " ORDER BY timestamp DESC, id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [self._to_record(row) for row in self.conn.execute(sql, params)]
+
+    def between(self, since: Optional[str], until: Optional[str] = None, state: str = APPLIED) -> list:
+        """
+        Registros en `state` con since <= timestamp <= until (ISO UTC, comparables como texto),
+        agrupados por archivo y más reciente primero dentro de cada archivo.
+        """
+        sql = f"SELECT {', '.join(self._columns)} FROM records WHERE state = ?"
+        params: list = [state]
+        if since is not None:
+            sql += " AND timestamp >= ?"
+            params.append(since)
+        if until is not None:
+            sql += " AND timestamp <= ?"
+            params.append(until)
+        sql += " ORDER BY file_path, timestamp DESC, id DESC"
+        return [self._to_record(row) for row in self.conn.execute(sql, params)]
+
+    def latest_per_file(self, state: str = APPLIED, with_content: bool = False) -> list:
+        """Último registro en `state` de cada archivo (uno por archivo, ordenados por archivo)"""
+        columns = ", ".join(self._columns if with_content else self._meta_columns)
+        sql = (
+            f"SELECT {columns} FROM ("
+            f"SELECT *, ROW_NUMBER() OVER (PARTITION BY file_path ORDER BY timestamp DESC, id DESC) AS rn "
+            f"FROM records WHERE state = ?) WHERE rn = 1 ORDER BY file_path"
+        )
+        return [self._to_record(row) for row in self.conn.execute(sql, (state,))]
+
+    def latest_timestamps(self, state: str = APPLIED) -> dict[str, str]:
+        """Timestamp del último registro en `state` de cada archivo"""
+        rows = self.conn.execute(
+            "SELECT file_path, MAX(timestamp) AS ts FROM records WHERE state = ? GROUP BY file_path", (state,)
+        )
+        return {row["file_path"]: row["ts"] for row in rows}
+
+    def count(self, file_path: str) -> int:
+        """Registros de un archivo en cualquier estado"""
+        row = self.conn.execute("SELECT COUNT(*) FROM records WHERE file_path = ?", (file_path,)).fetchone()
+        return row[0]
+
+    def by_id(self, record_id: str) -> Optional[tuple[str, str, object]]:
+        """(nombre, estado, registro) de un id, por búsqueda en el índice único"""
+        row = self.conn.execute(
+            f"SELECT record_name, state, {', '.join(self._columns)} FROM records WHERE record_id = ?",
+            (record_id,)
+        ).fetchone()
+        return (row["record_name"], row["state"], self._to_record(row)) if row else None
+
+    def record_name(self, record) -> Optional[str]:
+        if getattr(record, "record_id", None):
+            found = self.by_id(record.record_id)
+            return found[0] if found else None
+        row = self.conn.execute(
+            "SELECT record_name FROM records WHERE file_path = ? AND timestamp = ? AND new_hash = ? "
+            "ORDER BY id DESC LIMIT 1",
+            (record.file_path, record.timestamp, record.new_hash)
+        ).fetchone()
+        return row["record_name"] if row else None
+
+    def _to_record(self, row: sqlite3.Row):
+        data = {c: row[c] if c in row.keys() else "" for c in self._columns}
+        if data["post_cmd_result"] is not None:
+            data["post_cmd_result"] = json.loads(data["post_cmd_result"])
+        return self.record_type(**data)
+
+    # --- sincronización con los JSON ----------------------------------------
+
+    def _meta(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def _set_meta(self, key: str, value: str) -> None:
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def mark_synced(self, applied_dir: Path) -> None:
+        """Registra el mtime y la cantidad de entradas actuales de applied/ tras una escritura propia"""
+        self._set_meta(
+            "applied_mtime_ns",
+            f"{applied_dir.stat().st_mtime_ns}:{time.time_ns()}:{self._entry_count(applied_dir)}"
+        )
+
+    @staticmethod
+    def _entry_count(applied_dir: Path) -> int:
+        with os.scandir(applied_dir) as entries:
+            return sum(1 for _ in entries)
+
+    def _is_synced(self, applied_dir: Path, mtime_ns: int) -> bool:
+        stored = self._meta("applied_mtime_ns")
+        if not stored:
+            return False
+        parts = [int(x) for x in stored.split(":")]
+        if len(parts) != 3 or parts[0] != mtime_ns:
+            return False
+        _, synced_at, count = parts
+        if synced_at - mtime_ns > RACY_WINDOW_NS:
+            return True
+        # Dentro de la ventana otra escritura en el mismo tick no cambiaría el mtime, pero sí la cuenta
+        return self._entry_count(applied_dir) == count
+
+    def sync(self, applied_dir: Path, rollback_dir: Path, force: bool = False, pack=None) -> int:
+        """
+        Reconcilia el índice con los JSON si applied/ cambió por fuera (o con `force`).
+        Importa registros faltantes (importador de historial JSON existente), marca como
+        revertidos los movidos a rollback/ y elimina los borrados. Retorna cuántos importó.
+        Los registros de `pack` (RecordPack) cuentan como aplicados salvo que tengan su
+        JSON en rollback/.
+        """
+        mtime = applied_dir.stat().st_mtime_ns
+        if not force and self._is_synced(applied_dir, mtime):
+            return 0
+        on_disk = {p.name for p in applied_dir.glob("*.json")}
+        skipped = set() if force else {row["record_name"] for row in self.conn.execute("SELECT record_name FROM skipped")}
+        packed = set(pack.entries()) if pack is not None else set()
+        if packed:
+            packed -= {p.name for p in rollback_dir.glob("*.json")}
+        indexed = {
+            row["record_name"]: row["state"]
+            for row in self.conn.execute("SELECT record_name, state FROM records")
+        }
+        imported = 0
+        not_records = []
+        for name in sorted(on_disk - skipped):
+            if indexed.get(name) != APPLIED:
+                added = self._import(applied_dir / name, APPLIED)
+                if added is None:
+                    not_records.append(name)
+                else:
+                    imported += added
+        with self.conn:
+            if force:
+                self.conn.execute("DELETE FROM skipped")
+            else:
+                self.conn.executemany("DELETE FROM skipped WHERE record_name = ?", [(n,) for n in skipped - on_disk])
+            self.conn.executemany("INSERT OR IGNORE INTO skipped (record_name) VALUES (?)", [(n,) for n in not_records])
+        for name in sorted(packed - on_disk):
+            if indexed.get(name) != APPLIED:
+                imported += self._import_text(pack.read(name), name, APPLIED) or 0
+        rolled_back = {p.name for p in rollback_dir.glob("*.json")} if force else set()
+        for name in sorted(rolled_back - on_disk):
+            if name not in indexed:
+                imported += self._import(rollback_dir / name, ROLLED_BACK) or 0
+        if imported:
+            self._bump_record_seq()
+        live = on_disk | packed
+        gone = [name for name, state in indexed.items() if state == APPLIED and name not in live]
+        for name in gone:
+            if (rollback_dir / name).exists():
+                self.set_state(name, ROLLED_BACK)
+            else:
+                self.remove([name])
+        self.mark_synced(applied_dir)
+        return imported
+
+    def _import(self, json_path: Path, state: str) -> Optional[int]:
+        """1 si importó, 0 si no se pudo leer (se reintenta), None si no es un ChangeRecord"""
+        try:
+            text = json_path.read_text(encoding="utf-8")
+        except UnicodeDecodeError:
+            return None
+        except OSError:
+            return 0
+        return self._import_text(text, json_path.name, state)
+
+    def _import_text(self, text: str, record_name: str, state: str) -> Optional[int]:
+        try:
+            record = self.record_type(**json.loads(text))
+        except (ValueError, TypeError):
+            return None
+        self.add(record, record_name, state)
+        return 1
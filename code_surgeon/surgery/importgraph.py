@@ -0,0 +1,183 @@
+"""
+Import Graph (Test Impact Analysis)
+Grafo de imports de server/, client/src y de los tests (import/export ... from, import(),
+require(), jest.mock/vi.mock) con especificadores relativos resueltos a archivos del proyecto.
+Los tests afectados por un cambio son los que importan el módulo de forma transitiva.
+
+Las dependencias de cada archivo se cachean en surgery/cache/import_graph.json por
+(mtime_ns, size): en cada consulta solo se vuelven a parsear los archivos que cambiaron.
+"""
+from __future__ import annotations
+import os
+import re
+import json
+import time
+from collections import deque
+from pathlib import Path
+from typing import Optional
+from .lineindex import RACY_WINDOW_NS
+
+# Directorios de código fuente y de tests que forman el grafo (relativos a la raíz)
+SOURCE_DIRS = ("server", "client/src")
+TEST_DIRS = ("tests/backend", "tests/frontend")
+
+MODULE_SUFFIXES = (".js", ".jsx", ".mjs", ".cjs", ".ts", ".tsx")
+_SKIPPED_DIRS = {"node_modules", "dist", "build", "coverage", "__snapshots__"}
+
+_SPECIFIER = re.compile(
+    r"""(?:\bfrom\s*|\bimport\s*\(?\s*|\brequire\s*\(\s*|\.(?:mock|doMock|importActual|requireActual)\s*\(\s*)"""
+    r"""(['"])(\.{1,2}/[^'"\n]*)\1"""
+)
+_TEST_NAME = re.compile(r"\.(test|spec)\.[cm]?[jt]sx?$")
+
+
+def is_test_file(rel_path: str) -> bool:
+    return rel_path.startswith(tuple(d + "/" for d in TEST_DIRS)) and bool(_TEST_NAME.search(rel_path))
+
+
+class ImportGraph:
+    """Grafo de imports relativos del proyecto con invalidación por archivo"""
+
+    def __init__(self, project_root: Path, cache_path: Optional[Path] = None):
+        self.project_root = project_root.resolve()
+        self.cache_path = cache_path
+        self._entries: dict[str, list] = {}  # ruta relativa -> [mtime_ns, size, [dependencias]]
+        self._importers: Optional[dict[str, set[str]]] = None
+        self._dirty = False
+        if cache_path and cache_path.exists():
+            try:
+                self._entries = json.loads(cache_path.read_text(encoding="utf-8"))
+            except (ValueError, OSError):
+                self._entries = {}
+
+    def refresh(self) -> None:
+        """Recorre los directorios del grafo y reparsea solo los archivos nuevos o modificados"""
+        now = time.time_ns()
+        seen = set()
+        changed = False
+        for top in SOURCE_DIRS + TEST_DIRS:
+            for dirpath, dirnames, filenames in os.walk(self.project_root / top):
+                dirnames[:] = [d for d in dirnames if d not in _SKIPPED_DIRS and not d.startswith(".")]
+                for name in filenames:
+                    if not name.endswith(MODULE_SUFFIXES):
+                        continue
+                    path = Path(dirpath) / name
+                    rel = path.relative_to(self.project_root).as_posix()
+                    seen.add(rel)
+                    st = path.stat()
+                    entry = self._entries.get(rel)
+                    if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+                        continue
+                    deps = self._parse(path)
+                    if now - st.st_mtime_ns > RACY_WINDOW_NS:
+                        self._entries[rel] = [st.st_mtime_ns, st.st_size, deps]
+                    else:
+                        # mtime reciente: otra escritura en el mismo tick no cambiaría la firma
+                        self._entries[rel] = [None, None, deps]
+                    changed = True
+        for rel in [r for r in self._entries if r not in seen]:
+            del self._entries[rel]
+            changed = True
+        if changed or self._importers is None:
+            self._dirty = self._dirty or changed
+            self._importers = {}
+            for rel, (_, _, deps) in self._entries.items():
+                for dep in deps:
+                    self._importers.setdefault(dep, set()).add(rel)
+
+    def _parse(self, path: Path) -> list[str]:
+        try:
+            source = path.read_text(encoding="utf-8", errors="replace")
+        except OSError:
+            return []
+        deps = []
+        for match in _SPECIFIER.finditer(source):
+            resolved = self._resolve(path.parent, match.group(2).split("?")[0])
+            if resolved and resolved not in deps:
+                deps.append(resolved)
+        return deps
+
+    def _resolve(self, base_dir: Path, specifier: str) -> Optional[str]:
+        """Resolución estilo Node/Vite: ruta exacta, con extensión o index.<ext>"""
+        target = Path(os.path.normpath(base_dir / specifier))
+        candidates = [target] + [target.with_name(target.name + s) for s in MODULE_SUFFIXES]
+        candidates += [target / f"index{s}" for s in MODULE_SUFFIXES]
+        for candidate in candidates:
+            if candidate.is_file():
+                try:
+                    return candidate.relative_to(self.project_root).as_posix()
+                except ValueError:
+                    return None
+        return None
+
+    def tests_for(self, file_path: Path) -> Optional[list[str]]:
+        """
+        Tests que importan `file_path` de forma transitiva, o None si el grafo no sirve para
+        decidir: archivo fuera del grafo, proyecto sin tests, o el módulo llega a un helper de
+        tests sin importadores (setupFiles, mocks de config) que puede afectar a toda la suite.
+        """
+        self.refresh()
+        self.flush()
+        try:
+            rel = Path(file_path).resolve().relative_to(self.project_root).as_posix()
+        except ValueError:
+            return None
+        if rel not in self._entries or not any(is_test_file(r) for r in self._entries):
+            return None
+        if is_test_file(rel):
+            return [rel]
+
+        tests, queue, visited = set(), deque([rel]), {rel}
+        while queue:
+            current = queue.popleft()
+            importers = self._importers.get(current, set())
+            if not importers and current.startswith("tests/") and not is_test_file(current):
+                return None
+            for importer in importers:
+                if importer in visited:
+                    continue
+                visited.add(importer)
+                if is_test_file(importer):
+                    tests.add(importer)
+                else:
+                    queue.append(importer)
+        return sorted(tests)
+
+    def dependency_closure(self, rel_paths: list[str]) -> Optional[set[str]]:
+        """
+        Archivos que pueden cargar `rel_paths` (rutas relativas, incluidas) siguiendo sus imports.
+        Un directorio aporta todos sus archivos del grafo; None si no está dentro de los
+        directorios del grafo (p. ej. "tests" completo). Archivos fuera del grafo (tests Python)
+        se incluyen solos.
+        """
+        self.refresh()
+        self.flush()
+        closure, queue = set(), deque()
+        for rel in rel_paths:
+            rel = rel.replace("\\", "/").rstrip("/")
+            if rel in self._entries or Path(rel).suffix:
+                queue.append(rel)
+                continue
+            if not any(rel == top or rel.startswith(top + "/") for top in SOURCE_DIRS + TEST_DIRS):
+                return None
+            members = [r for r in self._entries if r.startswith(rel + "/")]
+            queue.extend(members)
+        while queue:
+            current = queue.popleft()
+            if current in closure:
+                continue
+            closure.add(current)
+            entry = self._entries.get(current)
+            if entry:
+                queue.extend(entry[2])
+        return closure
+
+    def flush(self) -> None:
+        """Persiste las dependencias cacheadas si hubo cambios"""
+        if not self._dirty or not self.cache_path:
+            return
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.cache_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(self._entries), encoding="utf-8")
+        os.replace(tmp, self.cache_path)
+        self._dirty = False
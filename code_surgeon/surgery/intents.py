@@ -0,0 +1,138 @@
+"""
+Intent Journal (write-ahead)
+Antes de renombrar el archivo empalmado sobre el original, execute() agrega una intención con
+el archivo, los hashes antes/después y los blobs de ambas versiones; después de persistir el
+ChangeRecord la marca como confirmada. Una intención sin confirmar tras un crash indica un
+archivo que pudo quedar modificado sin historial.
+
+intents.jsonl es append-only (una línea JSON por evento, escrita con una sola llamada en modo
+O_APPEND y fsync). intents.checkpoint guarda el offset antes del cual no queda ninguna intención
+abierta, así que la recuperación lee solo la cola del journal, no el historial completo.
+
+Las intenciones en curso de este proceso (entre begin y commit/abort/release) se registran en
+memoria: la recuperación nunca las toma por abandonadas aunque el pid sea el propio.
+"""
+from __future__ import annotations
+import os
+import json
+import time
+import uuid
+import threading
+from pathlib import Path
+from typing import Optional
+
+BEGIN = "begin"
+COMMIT = "commit"
+ABORT = "abort"
+
+# Intenciones abiertas por este proceso que todavía están en curso (compartido entre instancias)
+_in_flight: set[str] = set()
+_in_flight_lock = threading.Lock()
+
+
+class IntentLog:
+    """Journal de intenciones de escritura de un directorio surgery/"""
+
+    def __init__(self, journal_dir: Path):
+        journal_dir.mkdir(parents=True, exist_ok=True)
+        self.path = journal_dir / "intents.jsonl"
+        self.checkpoint_path = journal_dir / "intents.checkpoint"
+
+    def begin(self, **fields) -> str:
+        """Registra una intención (durable antes de tocar el archivo) y retorna su id"""
+        intent_id = uuid.uuid4().hex[:12]
+        with _in_flight_lock:
+            _in_flight.add(intent_id)
+        self._append({"op": BEGIN, "id": intent_id, "pid": os.getpid(), "ts": time.time(), **fields})
+        return intent_id
+
+    def commit(self, intent_id: str, record: Optional[str] = None) -> None:
+        self._append({"op": COMMIT, "id": intent_id, "record": record})
+        self.release(intent_id)
+        self.advance()
+
+    def abort(self, intent_id: str, reason: str) -> None:
+        self._append({"op": ABORT, "id": intent_id, "reason": reason})
+        self.release(intent_id)
+        self.advance()
+
+    @staticmethod
+    def release(intent_id: Optional[str]) -> None:
+        """
+        La operación que abrió la intención terminó sin confirmarla (p. ej. falló el registro):
+        queda abierta en el journal para que la recuperación la resuelva.
+        """
+        with _in_flight_lock:
+            _in_flight.discard(intent_id)
+
+    @staticmethod
+    def in_flight(intent_id: str) -> bool:
+        """True si este proceso sigue ejecutando la operación de la intención"""
+        with _in_flight_lock:
+            return intent_id in _in_flight
+
+    def pending(self) -> list[dict]:
+        """Intenciones abiertas desde el checkpoint, en orden (con su offset en `_offset`)"""
+        return list(self._scan()[0].values())
+
+    def advance(self) -> None:
+        """
+        Mueve el checkpoint a la intención abierta más antigua (o al final del journal).
+        No necesita fsync: un checkpoint atrasado solo alarga la siguiente lectura.
+        """
+        open_intents, end = self._scan()
+        offset = min((e["_offset"] for e in open_intents.values()), default=end)
+        if offset != self._checkpoint():
+            tmp = self.checkpoint_path.with_name(f".{self.checkpoint_path.name}.{os.getpid()}.tmp")
+            tmp.write_text(str(offset), encoding="utf-8")
+            os.replace(tmp, self.checkpoint_path)
+
+    def _checkpoint(self) -> int:
+        try:
+            return int(self.checkpoint_path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _scan(self) -> tuple[dict[str, dict], int]:
+        """(intenciones abiertas por id, offset final leído) desde el checkpoint"""
+        open_intents: dict[str, dict] = {}
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return open_intents, 0
+        with f:
+            offset = min(self._checkpoint(), os.fstat(f.fileno()).st_size)
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # escritura en curso o truncada: se relee en la próxima pasada
+                entry = _parse(line)
+                if entry is not None:
+                    if entry["op"] == BEGIN:
+                        entry["_offset"] = offset
+                        open_intents[entry["id"]] = entry
+                    else:
+                        open_intents.pop(entry["id"], None)
+                offset += len(line)
+        return open_intents, offset
+
+    def _append(self, entry: dict) -> None:
+        data = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND | getattr(os, "O_BINARY", 0), 0o644)
+        try:
+            os.write(fd, data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def _parse(line: bytes) -> Optional[dict]:
+    try:
+        return json.loads(line)
+    except ValueError:
+        # Una línea cortada por un crash queda pegada a la siguiente: se conserva la última entrada
+        start = line.rfind(b'{"op"')
+        try:
+            return json.loads(line[start:]) if start > 0 else None
+        except ValueError:
+            return None
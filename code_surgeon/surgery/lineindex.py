@@ -0,0 +1,258 @@
+"""
+Line Offset Index
+Índice compacto de offsets de inicio de línea (array, una entrada por línea).
+Se cachea por archivo en memoria y opcionalmente en disco, invalidado por (inode, size, mtime_ns).
+Tras un empalme propio (write_spliced) el índice del archivo nuevo se deriva del anterior
+desplazando offsets y se registra con la firma nueva, sin volver a escanear el archivo; si el
+empalme se escribió en un archivo preparado (staged), move_index lo traslada al destino final.
+"""
+from __future__ import annotations
+import os
+import re
+import time
+import struct
+import hashlib
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+_MAGIC = b"LIDX1"
+_HEADER = struct.Struct("<5sQQqBcQ")  # magic, ino, size, mtime_ns, exotic, typecode, count
+_CHUNK = 1 << 20
+_MAX_CACHED = 64
+
+# Un archivo modificado hace menos de esto puede volver a cambiar sin que cambie su firma
+# (resolución de mtime); esos índices no se consideran confiables (regla "racy git").
+RACY_WINDOW_NS = 2_000_000_000
+
+# Separadores que str.splitlines() reconoce además de "\n"
+_EXOTIC_RX = re.compile(rb"\r(?!\n)|[\x0b\x0c\x1c-\x1e]|\xc2\x85|\xe2\x80[\xa8\xa9]")
+
+
+def file_signature(path: Path) -> tuple[int, int, int]:
+    st = os.stat(path)
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class LineIndex:
+    """Offsets de inicio de cada línea de un archivo"""
+
+    __slots__ = ("signature", "offsets", "exotic")
+
+    def __init__(self, signature: tuple[int, int, int], offsets: array, exotic: bool):
+        self.signature = signature
+        self.offsets = offsets
+        self.exotic = exotic  # True si hay saltos de línea que splitlines() trataría distinto
+
+    @property
+    def size(self) -> int:
+        return self.signature[1]
+
+    @property
+    def line_count(self) -> int:
+        return len(self.offsets)
+
+    @classmethod
+    def build(cls, path: Path) -> LineIndex:
+        """Escanea el archivo por bloques registrando el inicio de cada línea"""
+        signature = file_signature(path)
+        offsets = array("Q" if signature[1] >= 1 << 32 else "I")
+        exotic = False
+        pos = 0
+        pending_cr = False
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(_CHUNK)
+                if not chunk:
+                    break
+                if pending_cr and not chunk.startswith(b"\n"):
+                    exotic = True
+                if not exotic and _EXOTIC_RX.search(chunk[:-1] if chunk.endswith(b"\r") else chunk):
+                    exotic = True
+                pending_cr = chunk.endswith(b"\r")
+                if pos == 0:
+                    offsets.append(0)
+                i = chunk.find(b"\n")
+                while i != -1:
+                    offsets.append(pos + i + 1)
+                    i = chunk.find(b"\n", i + 1)
+                pos += len(chunk)
+        if pending_cr:
+            exotic = True
+        # Un "\n" final no abre una línea nueva
+        if offsets and offsets[-1] == pos:
+            offsets.pop()
+        return cls(signature, offsets, exotic)
+
+    def span(self, start_line: int, end_line: int) -> tuple[int, int]:
+        """
+        Offsets [start, end) en bytes para las líneas start..end (1-based, inclusivas).
+        `end` incluye el terminador de end_line.
+        """
+        if start_line < 1 or end_line < start_line or start_line > self.line_count:
+            raise ValueError(f"Line range {start_line}-{end_line} out of bounds")
+        end = self.offsets[end_line] if end_line < self.line_count else self.size
+        return self.offsets[start_line - 1], end
+
+    def after_splice(self, replacements, signature: tuple[int, int, int]) -> Optional[LineIndex]:
+        """
+        Índice del archivo tras reemplazar las regiones [(start_byte, end_byte, new_bytes)]
+        (offsets de este índice). None si una región no empieza y termina en inicio de línea
+        o introduce saltos de línea no estándar: en ese caso hay que reconstruirlo.
+        """
+        if self.exotic:
+            return None
+        offsets, size = array("Q", self.offsets), self.size
+        for start_byte, end_byte, region in sorted(replacements, key=lambda r: r[0], reverse=True):
+            first, last = bisect_left(offsets, start_byte), bisect_left(offsets, end_byte)
+            aligned_start = start_byte == 0 or (first < len(offsets) and offsets[first] == start_byte)
+            aligned_end = end_byte == size or (last < len(offsets) and offsets[last] == end_byte)
+            if not (aligned_start and aligned_end) or _EXOTIC_RX.search(region) or region.endswith(b"\r"):
+                return None
+            if region and not region.endswith(b"\n") and end_byte < size:
+                return None
+            delta = len(region) - (end_byte - start_byte)
+            inner = array("Q", [start_byte] if region else [])
+            i = region.find(b"\n")
+            while i != -1 and i + 1 < len(region):
+                inner.append(start_byte + i + 1)
+                i = region.find(b"\n", i + 1)
+            tail = array("Q", (o + delta for o in offsets[last:])) if delta else offsets[last:]
+            offsets = offsets[:first] + inner + tail
+            size += delta
+        if size != signature[1]:
+            return None
+        return LineIndex(signature, array("Q" if size >= 1 << 32 else "I", offsets), False)
+
+    def to_bytes(self) -> bytes:
+        header = _HEADER.pack(_MAGIC, *self.signature, int(self.exotic),
+                              self.offsets.typecode.encode("ascii"), len(self.offsets))
+        return header + self.offsets.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> Optional[LineIndex]:
+        if len(data) < _HEADER.size:
+            return None
+        magic, ino, size, mtime_ns, exotic, typecode, count = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            return None
+        offsets = array(typecode.decode("ascii"))
+        offsets.frombytes(data[_HEADER.size:])
+        if len(offsets) != count:
+            return None
+        return cls((ino, size, mtime_ns), offsets, bool(exotic))
+
+
+def splitlines_index(path: Path) -> LineIndex:
+    """
+    Índice con la numeración de str.splitlines() (la de slice_by_lines) para archivos con
+    saltos de línea no estándar (exotic). No se cachea: esos archivos son raros.
+    """
+    with open(path, "rb") as f:
+        st = os.fstat(f.fileno())
+        data = f.read()
+    offsets = array("Q" if len(data) >= 1 << 32 else "I")
+    pos = 0
+    for line in data.decode("utf-8").splitlines(keepends=True):
+        offsets.append(pos)
+        pos += len(line.encode("utf-8"))
+    return LineIndex((st.st_ino, len(data), st.st_mtime_ns), offsets, True)
+
+
+_cache: OrderedDict[str, LineIndex] = OrderedDict()
+
+# Índices de archivos dentro de la ventana racy: no se sirven, solo sirven de base a record_splice
+_unconfirmed: OrderedDict[str, LineIndex] = OrderedDict()
+
+
+def _is_trustworthy(signature: tuple[int, int, int], built_at_ns: int) -> bool:
+    return built_at_ns - signature[2] > RACY_WINDOW_NS
+
+
+def _disk_path(cache_dir: Path, key: str) -> Path:
+    return cache_dir / "lineindex" / (hashlib.sha1(key.encode("utf-8")).hexdigest() + ".idx")
+
+
+def get_line_index(path: Path, cache_dir: Optional[Path] = None) -> LineIndex:
+    """
+    Retorna el índice de líneas de `path`, reutilizando el cacheado si la firma
+    (inode, size, mtime_ns) no ha cambiado. Con `cache_dir` el índice persiste entre procesos.
+    """
+    key = str(Path(path).resolve())
+    signature = file_signature(path)
+
+    cached = _cache.get(key)
+    if cached and cached.signature == signature:
+        _cache.move_to_end(key)
+        return cached
+
+    disk = _disk_path(cache_dir, key) if cache_dir else None
+    if disk and disk.exists():
+        index = LineIndex.from_bytes(disk.read_bytes())
+        if index and index.signature == signature and _is_trustworthy(signature, time.time_ns()):
+            _remember(key, index)
+            return index
+
+    built_at = time.time_ns()
+    index = LineIndex.build(path)
+    # Si el archivo cambió durante el escaneo, la firma inicial ya no es válida
+    if file_signature(path) != index.signature:
+        return index
+    if _is_trustworthy(index.signature, built_at):
+        _remember(key, index)
+        if disk:
+            disk.parent.mkdir(parents=True, exist_ok=True)
+            tmp = disk.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_bytes(index.to_bytes())
+            os.replace(tmp, disk)
+    else:
+        _remember(key, index, _unconfirmed)
+    return index
+
+
+def record_splice(path: Path, dest: Path, replacements, signature: tuple[int, int, int]) -> None:
+    """
+    Registra el índice de `dest` tras un empalme propio sobre `path` cuya firma previa era
+    `signature`. Se deriva del índice en memoria de `path` (aunque esté en la ventana racy: la
+    escritura es nuestra) y queda solo en memoria; en disco sigue rigiendo la regla racy.
+    """
+    key = str(Path(path).resolve())
+    base = _cache.get(key) or _unconfirmed.get(key)
+    if base is None or base.signature != signature:
+        return
+    index = base.after_splice(replacements, file_signature(dest))
+    if index is not None:
+        dest_key = str(Path(dest).resolve())
+        _unconfirmed.pop(dest_key, None)
+        _remember(dest_key, index)
+
+
+def move_index(src: Path, dst: Path) -> None:
+    """
+    Traslada a `dst` el índice registrado para `src` tras os.replace(src, dst): el rename
+    conserva inode, tamaño y mtime, así que la firma sigue valiendo. Los índices previos de
+    `dst` se descartan; el de `src` también si la firma ya no coincide.
+    """
+    src_key, dst_key = str(Path(src).resolve()), str(Path(dst).resolve())
+    index = _cache.pop(src_key, None)
+    _unconfirmed.pop(src_key, None)
+    _cache.pop(dst_key, None)
+    _unconfirmed.pop(dst_key, None)
+    if index is not None and index.signature == file_signature(dst):
+        _remember(dst_key, index)
+
+
+def forget_index(path: Path) -> None:
+    """Descarta los índices en memoria de `path` (p. ej. un temporal que ya no existe)"""
+    key = str(Path(path).resolve())
+    _cache.pop(key, None)
+    _unconfirmed.pop(key, None)
+
+
+def _remember(key: str, index: LineIndex, cache: OrderedDict = _cache) -> None:
+    cache[key] = index
+    cache.move_to_end(key)
+    while len(cache) > _MAX_CACHED:
+        cache.popitem(last=False)
@@ -0,0 +1,123 @@
+// Worker persistente de tests para code_surgeon (ver surgery/testdaemon.py)
+//
+// Uso: node test-worker.mjs <jest|vitest> <raíz del proyecto> <config>
+//
+// Protocolo por stdin/stdout, una línea JSON por mensaje:
+//   -> {"ready": true}                                  al terminar de cargar el framework
+//   <- {"id": 1, "files": ["tests/backend/x.test.js"]}   tests (o directorios) a ejecutar
+//   -> {"id": 1, "ok": true, "tests_run": 3, "tests_failed": 0, "output": "..."}
+// Cualquier otra salida (reporters, console.log de los tests) se desvía a stderr.
+// El worker termina cuando se cierra stdin.
+import { createRequire } from 'node:module';
+import { createInterface } from 'node:readline';
+import { statSync } from 'node:fs';
+import path from 'node:path';
+import { pathToFileURL } from 'node:url';
+
+const [framework, projectRoot, configPath] = process.argv.slice(2);
+const send = process.stdout.write.bind(process.stdout);
+process.stdout.write = process.stderr.write.bind(process.stderr);
+const reply = (message) => send(JSON.stringify(message) + '\n');
+
+const require = createRequire(path.join(projectRoot, 'package.json'));
+
+async function loadJest() {
+  const { runCLI } = require('jest');
+  return async (files) => {
+    const argv = { $0: 'code-surgeon', _: files, config: configPath, runInBand: true, silent: true, ci: true, watch: false, watchman: false };
+    const { results } = await runCLI(argv, [projectRoot]);
+    const output = results.testResults.map((r) => r.failureMessage).filter(Boolean).join('\n');
+    return { ok: results.success, tests_run: results.numTotalTests, tests_failed: results.numFailedTests, output };
+  };
+}
+
+async function loadVitest() {
+  // vitest/node solo se exporta para import(): se ubica desde el package.json del proyecto
+  const pkgDir = path.dirname(require.resolve('vitest/package.json'));
+  const { createVitest } = await import(pathToFileURL(path.join(pkgDir, 'dist', 'node.js')).href);
+  const vitest = await createVitest('test', { config: configPath, root: projectRoot, watch: false, run: true });
+  const moduleGraph = vitest.vite.moduleGraph;
+  const seen = new Map();
+
+  const signature = (file) => {
+    try {
+      const st = statSync(file);
+      return `${st.mtimeMs}:${st.size}`;
+    } catch {
+      return null;
+    }
+  };
+
+  // Sin watcher, el servidor Vite conserva módulos transformados: antes de cada corrida se
+  // invalidan los que cambiaron y los que no tienen firma registrada (sin base para comparar)
+  const invalidateChanged = () => {
+    for (const [file, modules] of moduleGraph.fileToModulesMap) {
+      const current = signature(file);
+      if (!seen.has(file) || seen.get(file) !== current) {
+        modules.forEach((mod) => moduleGraph.invalidateModule(mod));
+      }
+      seen.set(file, current);
+    }
+  };
+
+  // Tras la corrida se registran los módulos transformados por primera vez en ella; los ya
+  // conocidos conservan la firma previa a la corrida, así una edición durante ella se detecta
+  const recordNew = () => {
+    for (const file of moduleGraph.fileToModulesMap.keys()) {
+      if (!seen.has(file)) seen.set(file, signature(file));
+    }
+  };
+
+  return async (files) => {
+    invalidateChanged();
+    const specs = await vitest.globTestSpecifications(files);
+    let testModules;
+    try {
+      ({ testModules } = await vitest.runTestSpecifications(specs, true));
+    } finally {
+      recordNew();
+    }
+    let run = 0;
+    let failed = 0;
+    const messages = [];
+    for (const module of testModules) {
+      for (const test of module.children.allTests()) {
+        const result = test.result();
+        if (result.state === 'skipped' || result.state === 'pending') continue;
+        run += 1;
+        if (result.state === 'failed') {
+          failed += 1;
+          messages.push(`${module.moduleId} > ${test.fullName}\n${(result.errors || []).map((e) => e.message).join('\n')}`);
+        }
+      }
+      if (!module.ok() && !module.children.size) {
+        failed += 1;
+        messages.push(`${module.moduleId}: ${(module.errors() || []).map((e) => e.message).join('\n')}`);
+      }
+    }
+    return { ok: failed === 0 && specs.length > 0, tests_run: run, tests_failed: failed, output: messages.join('\n\n') };
+  };
+}
+
+let runTests;
+try {
+  runTests = framework === 'jest' ? await loadJest() : await loadVitest();
+  reply({ ready: true });
+} catch (error) {
+  reply({ ready: false, error: String(error && error.stack || error) });
+  process.exit(1);
+}
+
+// Una corrida a la vez: las solicitudes se encadenan en orden de llegada
+let queue = Promise.resolve();
+createInterface({ input: process.stdin }).on('line', (line) => {
+  queue = queue.then(async () => {
+    let request;
+    try {
+      request = JSON.parse(line);
+      reply({ id: request.id, ...(await runTests(request.files)) });
+    } catch (error) {
+      reply({ id: request && request.id, error: String(error && error.stack || error) });
+    }
+  });
+}).on('close', () => queue.then(() => process.exit(0)));
@@ -0,0 +1,84 @@
+"""
+Record Pack
+Empaqueta registros JSON antiguos de applied/ en un solo archivo append-only con un índice
+de offsets, para que el directorio no crezca a miles de archivos pequeños.
+
+records.pack: entradas consecutivas [longitud uint32][JSON comprimido con zlib]
+records.idx:  una línea por entrada "<nombre>\t<offset>\t<longitud>"
+
+El pack se escribe y sincroniza antes que el índice: una línea de índice solo existe si su
+entrada ya está en disco, así que una escritura interrumpida deja como mucho bytes sin indexar.
+"""
+from __future__ import annotations
+import os
+import zlib
+import struct
+from pathlib import Path
+from typing import Iterable
+from .utils import read_at
+
+_LENGTH = struct.Struct("<I")
+
+
+class RecordPack:
+    """Pack append-only de registros de cambio direccionados por nombre"""
+
+    def __init__(self, pack_dir: Path):
+        self.pack_path = pack_dir / "records.pack"
+        self.idx_path = pack_dir / "records.idx"
+        self._entries: dict[str, tuple[int, int]] = {}
+        self._idx_size = -1
+
+    def entries(self) -> dict[str, tuple[int, int]]:
+        """nombre -> (offset, longitud); se relee el índice solo si creció"""
+        try:
+            size = self.idx_path.stat().st_size
+        except FileNotFoundError:
+            return {}
+        if size != self._idx_size:
+            pack_size = self.pack_path.stat().st_size
+            entries = {}
+            with open(self.idx_path, encoding="utf-8") as f:
+                for line in f:
+                    parts = line.rstrip("\n").split("\t")
+                    if len(parts) != 3 or not line.endswith("\n"):
+                        continue  # línea truncada por una escritura interrumpida
+                    offset, length = int(parts[1]), int(parts[2])
+                    if offset + length <= pack_size:
+                        entries[parts[0]] = (offset, length)
+            self._entries, self._idx_size = entries, size
+        return self._entries
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.entries()
+
+    def read(self, name: str) -> str:
+        """JSON del registro empaquetado, leído en su offset (sin extraer nada)"""
+        offset, length = self.entries()[name]
+        fd = os.open(self.pack_path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        try:
+            data = read_at(fd, offset, length)
+        finally:
+            os.close(fd)
+        (size,) = _LENGTH.unpack_from(data)
+        return zlib.decompress(data[_LENGTH.size:_LENGTH.size + size]).decode("utf-8")
+
+    def append(self, records: Iterable[tuple[str, str]]) -> int:
+        """Agrega (nombre, JSON) al final del pack y luego al índice; retorna cuántos agregó"""
+        self.pack_path.parent.mkdir(parents=True, exist_ok=True)
+        lines = []
+        with open(self.pack_path, "ab") as pack:
+            offset = pack.seek(0, os.SEEK_END)
+            for name, text in records:
+                payload = zlib.compress(text.encode("utf-8"), 6)
+                entry = _LENGTH.pack(len(payload)) + payload
+                pack.write(entry)
+                lines.append(f"{name}\t{offset}\t{len(entry)}\n")
+                offset += len(entry)
+            pack.flush()
+            os.fsync(pack.fileno())
+        with open(self.idx_path, "a", encoding="utf-8") as idx:
+            idx.writelines(lines)
+            idx.flush()
+            os.fsync(idx.fileno())
+        return len(lines)
@@ -0,0 +1,112 @@
+"""
+Test Result Cache
+Resultados de tests indexados por el contenido de todo lo que pueden cargar: el archivo
+modificado, los tests seleccionados y sus dependencias transitivas (grafo de imports), más
+los archivos de entorno (ENVIRONMENT_FILES): package.json, el lockfile, la configuración de
+Jest y Vitest, los setupFiles de Vitest y los mocks que su config sustituye por alias. Reaplicar un fragmento que deja el árbol byte a byte igual
+(jobs reintentados, rollback seguido de reaplicación) retorna el resultado guardado sin
+volver a ejecutar la suite.
+
+Una entrada por clave en surgery/cache/test_results/<clave>.json. Las entradas expiran a los
+CODE_SURGEON_TEST_CACHE_TTL segundos (0 desactiva el cache) y, pasado MAX_ENTRIES, se
+descartan las usadas hace más tiempo (un acierto actualiza el mtime).
+"""
+from __future__ import annotations
+import os
+import json
+import time
+import hashlib
+from dataclasses import asdict
+from pathlib import Path
+from typing import Iterable, Optional
+
+DEFAULT_TTL_SECONDS = 24 * 3600
+MAX_ENTRIES = 500
+TTL_ENV = "CODE_SURGEON_TEST_CACHE_TTL"
+
+# Archivos que ningún test importa pero cambian lo que ejecutan: dependencias instaladas, la
+# config de cada framework, el setup que Vitest carga antes de cada test y los módulos que
+# resuelve en lugar de leaflet (config/vitest.config.ts). Sus imports entran también a la clave.
+ENVIRONMENT_FILES = (
+    "package.json",
+    "package-lock.json",
+    "config/jest.config.cjs",
+    "config/vitest.config.ts",
+    "tests/frontend/setupTests.ts",
+    "tests/frontend/mocks/leaflet.js",
+    "tests/frontend/mocks/leaflet-css.js",
+    "tests/frontend/mocks/leaflet-heat.js",
+)
+
+
+def ttl_from_env() -> float:
+    """TTL configurado en CODE_SURGEON_TEST_CACHE_TTL (segundos), o el default"""
+    try:
+        return float(os.environ[TTL_ENV])
+    except (KeyError, ValueError):
+        return DEFAULT_TTL_SECONDS
+
+
+def cache_key(tests: Iterable[str], digests: dict[str, str]) -> str:
+    """Clave estable a partir de los tests seleccionados y el digest de cada archivo relevante"""
+    payload = json.dumps({"tests": sorted(tests), "files": sorted(digests.items())})
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Cache en disco de TestResult por clave de contenido"""
+
+    def __init__(self, cache_dir: Path, ttl_seconds: Optional[float] = None, max_entries: int = MAX_ENTRIES):
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_from_env() if ttl_seconds is None else ttl_seconds
+        self.max_entries = max_entries
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    def get(self, key: str) -> Optional[dict]:
+        """Campos del TestResult guardado, o None si no existe o expiró"""
+        path = self.cache_dir / f"{key}.json"
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return None
+        if time.time() - entry.get("created", 0) > self.ttl_seconds:
+            path.unlink(missing_ok=True)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry["result"]
+
+    def put(self, key: str, result) -> None:
+        """Guarda un TestResult (dataclass) y aplica el límite de entradas"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self.cache_dir / f"{key}.json"
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps({"created": time.time(), "result": asdict(result)}, ensure_ascii=False),
+                       encoding="utf-8")
+        os.replace(tmp, path)
+        self._evict()
+
+    def _evict(self) -> None:
+        entries = []
+        for path in self.cache_dir.glob("*.json"):
+            try:
+                entries.append((path.stat().st_mtime, path))
+            except FileNotFoundError:
+                continue
+        excess = len(entries) - self.max_entries
+        if excess > 0:
+            for _, path in sorted(entries)[:excess]:
+                path.unlink(missing_ok=True)
+
+    def clear(self) -> int:
+        """Elimina todas las entradas; retorna cuántas había"""
+        removed = 0
+        for path in self.cache_dir.glob("*.json"):
+            path.unlink(missing_ok=True)
+            removed += 1
+        return removed
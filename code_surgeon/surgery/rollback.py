@@ -4,20 +4,35 @@ Mantiene un registro detallado de todas las modificaciones para permitir rollbac
 Basado en mejores prácticas de clase mundial: Git-style versioning + audit trail.
 """
 from __future__ import annotations
+import os
 import json
+import time
 import hashlib
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, field, replace
 from pathlib import Path
-from typing import Optional
-from .utils import read_text, write_text
+from typing import Optional, Union
+from .utils import write_text
+from .blobstore import BlobStore
+from .digests import DigestCache
+from .historydb import HistoryIndex, ROLLED_BACK
+from .recordpack import RecordPack
+from .intents import IntentLog
+from .locking import FileLock
+from .splicer import STREAMING_THRESHOLD_BYTES
+
+# Cada N registros de un archivo su versión original queda como blob completo (snapshot);
+# las demás se guardan como delta inverso contra la versión siguiente. Acota las cadenas.
+SNAPSHOT_INTERVAL = 16
 
 @dataclass
 class ChangeRecord:
     """Registro inmutable de un cambio de código"""
     timestamp: str
     file_path: str
-    mode: str  # 'line-range' | 'regex-block'
+    mode: str  # 'line-range' | 'regex-block' | 'multi-hunk' | 'full-file-replace' | 'squashed'
     start_marker: str
     end_marker: str
     original_content: str
@@ -28,27 +43,47 @@ class ChangeRecord:
     post_cmd: Optional[str]
     post_cmd_result: Optional[dict]
     job_file: Optional[str] = None
+    original_blob: Optional[str] = None  # sha256 en BlobStore; si existe, el contenido no va inline
+    new_blob: Optional[str] = None
+    transaction_id: Optional[str] = None  # transacción multi-archivo a la que pertenece
+    record_id: Optional[str] = None  # id monótono asignado por record_change (None en registros antiguos)
     
     @staticmethod
-    def create(file_path: Path, original: str, updated: str, mode: str, 
-               start: str, end: str, backup_path: Path, 
+    def create(file_path: Path, original: Optional[str], updated: Optional[str], mode: str, 
+               start: str, end: str, backup_path: Optional[Path], 
                post_cmd: Optional[str] = None, post_result: Optional[dict] = None,
-               job_file: Optional[str] = None) -> ChangeRecord:
-        """Factory method para crear un registro con hashes automáticos"""
+               job_file: Optional[str] = None, original_blob: Optional[str] = None,
+               new_blob: Optional[str] = None, original_hash: Optional[str] = None,
+               digests: Optional[DigestCache] = None, transaction_id: Optional[str] = None) -> ChangeRecord:
+        """
+        Factory method para crear un registro con hashes automáticos.
+        Con referencias a blobs el contenido completo no se duplica en el JSON.
+        Con `digests`, el hash nuevo se toma del archivo ya escrito vía DigestCache
+        y `updated` puede omitirse; `original_hash` evita pasar el contenido original.
+        """
+        if original_hash is None:
+            original_hash = hashlib.sha256(original.encode('utf-8')).hexdigest()[:12]
+        if digests is not None:
+            new_hash = digests.short(file_path)
+        else:
+            new_hash = hashlib.sha256(updated.encode('utf-8')).hexdigest()[:12]
         return ChangeRecord(
             timestamp=datetime.now(timezone.utc).isoformat(),
             file_path=str(file_path),
             mode=mode,
             start_marker=str(start),
             end_marker=str(end),
-            original_content=original,
-            new_content=updated,
-            original_hash=hashlib.sha256(original.encode('utf-8')).hexdigest()[:12],
-            new_hash=hashlib.sha256(updated.encode('utf-8')).hexdigest()[:12],
-            backup_path=str(backup_path),
+            original_content="" if original_blob else (original or ""),
+            new_content="" if new_blob else (updated or ""),
+            original_hash=original_hash[:12],
+            new_hash=new_hash,
+            backup_path=str(backup_path) if backup_path else "",
             post_cmd=post_cmd,
             post_cmd_result=post_result,
-            job_file=job_file
+            job_file=job_file,
+            original_blob=original_blob,
+            new_blob=new_blob,
+            transaction_id=transaction_id
         )
     
     def to_json(self) -> str:
@@ -62,55 +97,310 @@ class ChangeRecord:
         return ChangeRecord(**data)
 
 
+@dataclass
+class BulkRollbackResult:
+    """Resultado de un rollback por ventana de tiempo: archivos restaurados y conflictos por archivo"""
+    restored: dict[str, int] = field(default_factory=dict)  # archivo -> registros revertidos
+    conflicts: dict[str, str] = field(default_factory=dict)  # archivo -> motivo
+    
+    @property
+    def ok(self) -> bool:
+        return not self.conflicts
+    
+    def summary(self) -> str:
+        reverted = sum(self.restored.values())
+        lines = [f"✅ {len(self.restored)} archivos restaurados ({reverted} cambios revertidos)"]
+        if self.conflicts:
+            lines.append(f"⚠️  {len(self.conflicts)} archivos con conflictos (sin modificar):")
+            lines.extend(f"   {path}: {reason}" for path, reason in sorted(self.conflicts.items()))
+        return "\n".join(lines)
+
+
+def _utc_iso(value: Union[datetime, str]) -> str:
+    """Normaliza un instante al formato de ChangeRecord.timestamp (ISO UTC); sin zona = hora local"""
+    moment = datetime.fromisoformat(value) if isinstance(value, str) else value
+    if moment.tzinfo is None:
+        moment = moment.astimezone()
+    return moment.astimezone(timezone.utc).isoformat()
+
+
+def _squash(records: list[ChangeRecord]) -> ChangeRecord:
+    """Funde una serie consecutiva (más reciente primero) en un registro del primer original al último resultado"""
+    newest, oldest = records[0], records[-1]
+    transactions = {r.transaction_id for r in records}
+    return replace(
+        newest,
+        mode="squashed",
+        start_marker=oldest.timestamp,
+        end_marker=newest.timestamp,
+        original_content=oldest.original_content,
+        original_hash=oldest.original_hash,
+        original_blob=oldest.original_blob,
+        backup_path=oldest.backup_path,
+        job_file=newest.job_file if len({r.job_file for r in records}) == 1 else None,
+        transaction_id=transactions.pop() if len(transactions) == 1 else None
+    )
+
+
+def _intent_is_orphan(intent: dict) -> bool:
+    """
+    True si nadie sigue ejecutando la intención: el proceso que la abrió ya no existe, o es
+    este mismo proceso y la operación terminó sin confirmarla (IntentLog.release)
+    """
+    pid = intent["pid"]
+    if pid == os.getpid():
+        return not IntentLog.in_flight(intent["id"])
+    if os.name == "nt":
+        return time.time() - intent["ts"] > 600
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False
+    return False
+
+
+def _locked(method):
+    """Ejecuta el método con el lock del historial (serializa procesos que comparten surgery/)"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class RollbackManager:
     """Gestiona el historial de cambios y rollbacks"""
     
     def __init__(self, history_dir: Path):
         self.history_dir = history_dir
         self.history_dir.mkdir(parents=True, exist_ok=True)
+        self.lock = FileLock(history_dir / ".lock")
         self.applied_dir = history_dir / "applied"
         self.applied_dir.mkdir(exist_ok=True)
         self.rollback_dir = history_dir / "rollback"
         self.rollback_dir.mkdir(exist_ok=True)
+        self.blobs = BlobStore(history_dir / "blobs")
+        self.digests = DigestCache(history_dir / "cache" / "digests.json")
+        with self.lock:
+            # Crear/migrar el esquema y la primera sincronización compiten con otros procesos
+            self.index = HistoryIndex(history_dir / "history.db", ChangeRecord)
+        self.pack = RecordPack(history_dir / "packs")
+        self.intents = IntentLog(history_dir)
+        self._sync()
     
+    def _sync(self, force: bool = False) -> int:
+        """
+        Reconcilia el índice con applied/ bajo el lock: sin él, un registro escrito por otro
+        proceso entre el listado y la lectura del índice se tomaría como borrado
+        """
+        with self.lock:
+            return self.index.sync(self.applied_dir, self.rollback_dir, force=force, pack=self.pack)
+    
+    @_locked
+    def reindex(self) -> int:
+        """Reconstruye el índice desde los JSON de applied/ y rollback/; retorna registros importados"""
+        return self._sync(force=True)
+    
+    def original_content(self, record: ChangeRecord) -> str:
+        """Contenido original del registro (inline o desde el BlobStore)"""
+        if record.original_blob:
+            return self.blobs.get(record.original_blob).decode("utf-8")
+        return record.original_content
+    
+    def new_content(self, record: ChangeRecord) -> str:
+        """Contenido resultante del registro (inline o desde el BlobStore)"""
+        if record.new_blob:
+            return self.blobs.get(record.new_blob).decode("utf-8")
+        return record.new_content
+    
+    @_locked
     def record_change(self, record: ChangeRecord) -> Path:
         """
         Guarda un registro de cambio con naming scheme cronológico
-        Format: YYYYMMDD_HHMMSS_<file>_<hash>.json
+        Format: YYYYMMDD_HHMMSS_<id>_<file>_<hash>.json
+        El id es monótono y único entre procesos (se asigna con el lock del historial).
         """
+        self._sync()
+        record.record_id = self.index.next_record_id()
         timestamp = datetime.fromisoformat(record.timestamp).strftime("%Y%m%d_%H%M%S")
         safe_filename = Path(record.file_path).name.replace('.', '_')
-        filename = f"{timestamp}_{safe_filename}_{record.new_hash}.json"
+        filename = f"{timestamp}_{record.record_id}_{safe_filename}_{record.new_hash}.json"
         
         record_path = self.applied_dir / filename
+        generation = self.index.count(record.file_path)
         write_text(record_path, record.to_json())
+        self.index.add(record, filename)
+        self.index.mark_synced(self.applied_dir)
+        self._compact_original(record, generation)
         
         return record_path
     
-    def get_history(self, file_path: Optional[Path] = None) -> list[ChangeRecord]:
+    def _compact_original(self, record: ChangeRecord, generation: int) -> None:
+        """
+        Reescribe el blob original como delta inverso contra el nuevo (la versión más reciente
+        queda completa y es la base). Cada SNAPSHOT_INTERVAL registros se conserva un snapshot.
+        Corre con el lock tomado y en memoria: archivos desde STREAMING_THRESHOLD_BYTES (los que
+        el runner ya empalma en streaming) conservan el blob completo.
+        """
+        if not (record.original_blob and record.new_blob) or generation % SNAPSHOT_INTERVAL == 0:
+            return
+        try:
+            target = Path(record.file_path)
+            size = (target if target.exists() else self.blobs.path_for(record.new_blob)).stat().st_size
+            if size >= STREAMING_THRESHOLD_BYTES:
+                return
+            self.blobs.deltify(record.original_blob, record.new_blob)
+        except (OSError, ValueError):
+            # Optimización de espacio: el blob completo sigue siendo válido
+            pass
+    
+    @_locked
+    def recover_intents(self) -> list[dict]:
+        """
+        Resuelve intenciones de escritura que quedaron abiertas por un crash (solo la cola del
+        journal desde el checkpoint). Si el archivo ya tiene el contenido nuevo, se reproduce el
+        registro que faltó (replayed); si conserva el original, la escritura nunca ocurrió
+        (discarded); si no coincide con ninguno, se reporta sin tocarlo (conflict).
+        Las intenciones de procesos aún vivos se dejan abiertas.
+        """
+        report = []
+        for intent in self.intents.pending():
+            if not _intent_is_orphan(intent):
+                continue
+            target = Path(intent["target"])
+            try:
+                current = self.digests.short(target)
+            except FileNotFoundError:
+                current = None
+            if current is not None and current == intent["post_hash"]:
+                record = ChangeRecord.create(
+                    file_path=target, original=None, updated=None, mode=intent["mode"],
+                    start=intent["start"], end=intent["end"], backup_path=None,
+                    post_cmd=intent.get("post_cmd"), job_file=intent.get("job_file"),
+                    original_blob=intent["original_blob"], new_blob=intent["new_blob"],
+                    original_hash=intent["pre_hash"], digests=self.digests
+                )
+                self.intents.commit(intent["id"], str(self.record_change(record)))
+                status = "replayed"
+            elif current is not None and current == intent["pre_hash"]:
+                self.intents.abort(intent["id"], "discarded")
+                status = "discarded"
+            else:
+                self.intents.abort(intent["id"], "conflict")
+                status = "conflict"
+            report.append({"file": intent["target"], "intent": intent["id"], "status": status})
+        self.digests.flush()
+        return report
+    
+    @_locked
+    def mark_rolled_back(self, record_path: Path) -> None:
+        """
+        Mueve un registro de applied/ a rollback/ y actualiza el índice.
+        Un registro empaquetado (ya no está en applied/) se escribe en rollback/ desde el pack.
+        """
+        self._sync()
+        if record_path.exists():
+            record_path.rename(self.rollback_dir / record_path.name)
+        elif record_path.name in self.pack:
+            write_text(self.rollback_dir / record_path.name, self.pack.read(record_path.name))
+        else:
+            return
+        self.index.set_state(record_path.name, ROLLED_BACK)
+        self.index.mark_synced(self.applied_dir)
+    
+    @_locked
+    def delete_records(self, record_paths: list[Path]) -> None:
+        """Elimina registros de applied/ (limpieza de historial antiguo) y del índice"""
+        self._sync()
+        for record_path in record_paths:
+            record_path.unlink(missing_ok=True)
+        self.index.remove(p.name for p in record_paths)
+        self.index.mark_synced(self.applied_dir)
+    
+    @_locked
+    def compact(self, older_than: Union[datetime, str], squash: bool = True) -> dict[str, int]:
+        """
+        Empaqueta los registros aplicados anteriores a `older_than` en el pack append-only y
+        los quita de applied/. Siguen visibles para get_history y rollback_to_record (el índice
+        conserva el contenido y el pack se lee por offset, sin extraer nada).
+        Con `squash`, cada serie de cambios consecutivos de un archivo (la cadena de hashes no
+        se corta) se funde en un solo registro: original del primero, resultado del último.
+        """
+        self._sync()
+        cutoff = _utc_iso(older_than)
+        by_file: dict[str, list[tuple[str, ChangeRecord]]] = {}
+        for record in self.index.between(None, cutoff):
+            record_name = self.index.record_name(record)
+            if record_name and (self.applied_dir / record_name).exists():
+                by_file.setdefault(record.file_path, []).append((record_name, record))
+        
+        packed: list[tuple[str, ChangeRecord]] = []
+        superseded: list[str] = []
+        for entries in by_file.values():
+            runs = [[entries[0]]]
+            for entry in entries[1:]:
+                previous = runs[-1][-1][1]
+                if squash and previous.original_hash == entry[1].new_hash:
+                    runs[-1].append(entry)
+                else:
+                    runs.append([entry])
+            for run in runs:
+                packed.append((run[0][0], _squash([r for _, r in run]) if len(run) > 1 else run[0][1]))
+                superseded.extend(name for name, _ in run[1:])
+        
+        if not packed:
+            return {"packed": 0, "squashed": 0}
+        # Orden de escritura: pack (con fsync) -> borrar JSON -> índice
+        self.pack.append((name, record.to_json()) for name, record in packed)
+        for name, _ in packed:
+            (self.applied_dir / name).unlink(missing_ok=True)
+        for name in superseded:
+            (self.applied_dir / name).unlink(missing_ok=True)
+        for name, record in packed:
+            self.index.add(record, name)
+        self.index.remove(superseded)
+        self.index.mark_synced(self.applied_dir)
+        return {"packed": len(packed), "squashed": len(superseded)}
+    
+    def get_history(self, file_path: Optional[Path] = None, limit: Optional[int] = None) -> list[ChangeRecord]:
         """
         Retorna historial de cambios, opcionalmente filtrado por archivo
         Ordenado cronológicamente (más reciente primero)
+        Consulta el índice SQLite (por archivo: búsqueda en B-tree, sin abrir los JSON).
         """
-        records = []
-        for json_file in sorted(self.applied_dir.glob("*.json"), reverse=True):
-            record = ChangeRecord.from_json(read_text(json_file))
-            if file_path is None or record.file_path == str(file_path):
-                records.append(record)
-        return records
+        self._sync()
+        return self.index.history(str(file_path) if file_path is not None else None, limit=limit)
+    
+    def get_record(self, record_id: str) -> Optional[ChangeRecord]:
+        """Registro por id (búsqueda en el índice único, sin recorrer el historial)"""
+        self._sync()
+        found = self.index.by_id(record_id)
+        return found[2] if found else None
+    
+    def latest_record(self, file_path: Path) -> Optional[ChangeRecord]:
+        """Último registro aplicado de un archivo (lookup indexado)"""
+        history = self.get_history(file_path, limit=1)
+        return history[0] if history else None
+    
+    def _history_meta(self) -> list[ChangeRecord]:
+        """Historial completo sin contenido inline (listados y verificación)"""
+        self._sync()
+        return self.index.history(with_content=False)
     
     def rollback_last(self, file_path: Path) -> tuple[bool, str]:
         """
         Rollback del último cambio a un archivo específico
         Retorna (success, message)
         """
-        history = self.get_history(file_path)
-        if not history:
+        latest = self.latest_record(file_path)
+        if latest is None:
             return False, f"No hay historial de cambios para {file_path}"
         
-        latest = history[0]
         return self.rollback_to_record(latest)
     
+    @_locked
     def rollback_to_record(self, record: ChangeRecord) -> tuple[bool, str]:
         """
         Ejecuta rollback usando un ChangeRecord específico
@@ -119,8 +409,8 @@ class RollbackManager:
         target = Path(record.file_path)
         
         # Verificar que el archivo actual coincida con el hash esperado
-        current_content = read_text(target)
-        current_hash = hashlib.sha256(current_content.encode('utf-8')).hexdigest()[:12]
+        current_hash = self.digests.short(target)
+        self.digests.flush()
         
         if current_hash != record.new_hash:
             return False, (
@@ -130,14 +420,15 @@ class RollbackManager:
         
         # Restaurar contenido original
         try:
-            write_text(target, record.original_content)
+            if record.original_blob:
+                self.blobs.restore_to(record.original_blob, target)
+            else:
+                write_text(target, record.original_content)
             
             # Mover registro de applied/ a rollback/
-            applied_files = list(self.applied_dir.glob(f"*_{record.new_hash}.json"))
-            if applied_files:
-                original_record = applied_files[0]
-                rollback_record = self.rollback_dir / original_record.name
-                original_record.rename(rollback_record)
+            record_name = self.index.record_name(record)
+            if record_name:
+                self.mark_rolled_back(self.applied_dir / record_name)
             
             return True, (
                 f"✅ Rollback exitoso de {target.name}\n"
@@ -148,29 +439,112 @@ class RollbackManager:
         except Exception as e:
             return False, f"❌ Error durante rollback: {e}"
     
+    @_locked
+    def rollback_since(self, since: Union[datetime, str], until: Union[datetime, str, None] = None,
+                       max_workers: Optional[int] = None) -> BulkRollbackResult:
+        """
+        Revierte todos los cambios aplicados entre `since` y `until` (inclusive) en todos los archivos.
+        Una sola consulta al índice agrupa los registros por archivo; el estado objetivo de cada
+        archivo es el original de su primer cambio en la ventana y se escribe una sola vez.
+        Los hashes actuales se verifican en paralelo; un archivo en conflicto (modificado a mano,
+        con cambios posteriores a `until` o con la cadena de hashes rota) se reporta y se deja
+        intacto sin abortar el resto.
+        """
+        self._sync()
+        since_iso = _utc_iso(since)
+        until_iso = _utc_iso(until) if until is not None else None
+        
+        by_file: dict[str, list[ChangeRecord]] = {}
+        for record in self.index.between(since_iso, until_iso):
+            by_file.setdefault(record.file_path, []).append(record)
+        
+        result = BulkRollbackResult()
+        latest = self.index.latest_timestamps() if until_iso is not None else {}
+        candidates: dict[str, list[ChangeRecord]] = {}
+        for file_path, records in by_file.items():
+            if latest.get(file_path, "") > records[0].timestamp:
+                result.conflicts[file_path] = "LATER_CHANGES: hay cambios posteriores a la ventana"
+            elif any(newer.original_hash != older.new_hash for newer, older in zip(records, records[1:])):
+                result.conflicts[file_path] = "BROKEN_CHAIN: el archivo se modificó entre cambios registrados"
+            else:
+                candidates[file_path] = records
+        
+        files = sorted(candidates)
+        hashes = self._current_hashes(files, max_workers)
+        
+        for file_path in files:
+            records = candidates[file_path]
+            newest, oldest = records[0], records[-1]
+            if hashes[file_path] is None:
+                result.conflicts[file_path] = "FILE_MISSING"
+                continue
+            if hashes[file_path] != newest.new_hash:
+                result.conflicts[file_path] = (
+                    f"HASH_MISMATCH: actual {hashes[file_path]}, registrado {newest.new_hash}"
+                )
+                continue
+            try:
+                if oldest.original_blob:
+                    self.blobs.restore_to(oldest.original_blob, Path(file_path))
+                else:
+                    write_text(Path(file_path), oldest.original_content)
+            except (OSError, ValueError) as e:
+                result.conflicts[file_path] = f"RESTORE_FAILED: {e}"
+                continue
+            for record in records:
+                record_name = self.index.record_name(record)
+                if record_name:
+                    self.mark_rolled_back(self.applied_dir / record_name)
+            result.restored[file_path] = len(records)
+        
+        return result
+    
     def list_rollbackable(self) -> list[tuple[str, str, str]]:
         """
         Lista de cambios que pueden ser revertidos
         Retorna: [(timestamp, file, description)]
         """
         results = []
-        for json_file in sorted(self.applied_dir.glob("*.json"), reverse=True):
-            record = ChangeRecord.from_json(read_text(json_file))
+        for record in self._history_meta():
             timestamp = datetime.fromisoformat(record.timestamp).strftime("%Y-%m-%d %H:%M:%S")
             file_name = Path(record.file_path).name
             desc = f"{record.mode} [{record.start_marker}...{record.end_marker}]"
             results.append((timestamp, file_name, desc))
         return results
     
-    def verify_integrity(self) -> list[dict]:
+    def _current_hashes(self, files: list[str], max_workers: Optional[int] = None) -> dict[str, Optional[str]]:
+        """
+        Hash abreviado actual de cada archivo (None si no existe), calculado en un pool de hilos.
+        Vía DigestCache persistente: un archivo con la misma firma de stat que en la última
+        ejecución no se vuelve a leer, así que una verificación repetida cuesta un stat por archivo.
+        """
+        def current_hash(file_path: str) -> Optional[str]:
+            try:
+                return self.digests.short(Path(file_path))
+            except FileNotFoundError:
+                return None
+        
+        workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            hashes = dict(zip(files, pool.map(current_hash, files)))
+        self.digests.flush()
+        return hashes
+    
+    def verify_integrity(self, max_workers: Optional[int] = None) -> list[dict]:
         """
         Verifica integridad de todos los archivos con historial
         Retorna lista de discrepancias encontradas
+        Solo se compara el último registro aplicado de cada archivo (los anteriores describen
+        estados intermedios ya reemplazados), con los hashes calculados en paralelo.
         """
+        self._sync()
+        latest = self.index.latest_per_file()
+        hashes = self._current_hashes([r.file_path for r in latest], max_workers)
+        
         issues = []
-        for record in self.get_history():
-            target = Path(record.file_path)
-            if not target.exists():
+        for record in latest:
+            current_hash = hashes[record.file_path]
+            if current_hash is None:
                 issues.append({
                     "file": record.file_path,
                     "issue": "FILE_MISSING",
@@ -178,9 +552,6 @@ class RollbackManager:
                 })
                 continue
             
-            current_content = read_text(target)
-            current_hash = hashlib.sha256(current_content.encode('utf-8')).hexdigest()[:12]
-            
             if current_hash != record.new_hash:
                 issues.append({
                     "file": record.file_path,
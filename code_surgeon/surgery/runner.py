@@ -1,19 +1,33 @@
 from __future__ import annotations
+import os
 import json
+import time
+import uuid
+from contextlib import nullcontext
+from datetime import datetime, timezone
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional
-from .selectors import select_by_line_range, select_by_regex_block, Selection
-from .splicer import splice_fragment, SpliceResult
+from typing import Callable, Optional
+from .selectors import select_span_by_line_range, select_span_by_regex_block, select_spans, locate_line_range, locate_regex_block
+from .splicer import (splice_span, splice_byte_range, splice_many, render_many, write_spliced, replace_file,
+                      stream_replace, SpliceResult, STREAMING_THRESHOLD_BYTES, DIFF_CONTEXT)
+from .diffing import file_diff
+from .digests import text_digest
+from .lineindex import move_index, forget_index
 from .patchops import run_command, PostCheck
-from .utils import read_text, write_text
+from .utils import read_text, atomic_write_text
 from .rollback import RollbackManager, ChangeRecord
 from .testing import TestRunner, TestResult
+from .shadow import ShadowWorkspace
+from .tracing import PhaseTimer, trace_path_from_env
+
+# Modo que reemplaza el archivo completo por el contenido de new_fragment_path (start/end se ignoran)
+FULL_FILE_REPLACE = "full-file-replace"
 
 @dataclass
 class Plan:
     file: str
-    mode: str  # 'line-range' or 'regex-block'
+    mode: str  # 'line-range', 'regex-block' or 'full-file-replace'
     start: int | str
     end: int | str
     new_fragment_path: Optional[str] = None
@@ -21,8 +35,157 @@ class Plan:
     job_file: Optional[str] = None
     enable_rollback: bool = True
     enable_testing: bool = True
+    streaming: Optional[bool] = None  # None = automático según STREAMING_THRESHOLD_BYTES
+    shadow: bool = False  # validar en un árbol sombra antes de tocar el árbol real
+    cache_tests: bool = True  # reutilizar resultados de tests para contenido idéntico (False: suites inestables)
+
+def plans_from_job(job: dict) -> list[Plan]:
+    """
+    Planes de un job JSON (surgery/jobs/). Con `blocks` ([{"start", "end", "new_fragment_path"}],
+    modo regex-block salvo que el bloque indique `mode`) el job cambia varios bloques del mismo
+    archivo: se localizan en un solo recorrido y se aplican con una escritura (execute_many).
+    """
+    common = dict(
+        file=job["file"],
+        post_cmd=job.get("post_cmd"),
+        job_file=job.get("job_file"),
+        enable_rollback=job.get("enable_rollback", True),
+        enable_testing=job.get("enable_testing", True),
+        shadow=job.get("shadow", False),
+        cache_tests=job.get("cache_tests", True),
+    )
+    blocks = job.get("blocks")
+    if not blocks:
+        return [Plan(mode=job["mode"], start=job.get("start", ""), end=job.get("end", ""),
+                     new_fragment_path=job["new_fragment_path"], **common)]
+    if common["shadow"]:
+        raise ValueError("shadow is not supported for jobs with blocks")
+    return [
+        Plan(mode=block.get("mode", job.get("mode", "regex-block")), start=block["start"], end=block["end"],
+             new_fragment_path=block["new_fragment_path"], **common)
+        for block in blocks
+    ]
+
+class SurgeonSession:
+    """
+    Contexto de proyecto de larga vida para procesar muchos planes (watcher, herramientas batch).
+    
+    Resuelve la raíz del proyecto una vez por directorio y mantiene vivos el RollbackManager
+    (BlobStore + DigestCache) y el TestRunner de cada raíz. El mapeo de tests se recarga solo
+    cuando cambia el mtime de test_mapping.json.
+    
+    recover() resuelve una vez por raíz lo que un crash dejó a medias: transacciones multi-archivo
+    (recover_transactions) e intenciones de escritura (RollbackManager.recover_intents); el
+    reporte por archivo queda en `recovered`. Se llama al iniciar
+    el watcher o el CLI, no en cada execute().
+    
+    Con `test_daemons=True` los TestRunner mantienen Jest/Vitest cargados entre cirugías
+    (workers persistentes); close() los termina.
+    
+    Las cirugías con `shadow` reutilizan un ShadowWorkspace por raíz (se refresca, no se
+    reconstruye) y su TestRunner comparte el cache de resultados del proyecto; close() los elimina.
+    """
+    
+    def __init__(self, project_root: Optional[Path] = None, keep_indent: bool = True,
+                 cwd: Optional[str] = None, trace_path: Optional[Path] = None, test_daemons: bool = False):
+        self.project_root = project_root.resolve() if project_root else None
+        self.keep_indent = keep_indent
+        self.cwd = cwd
+        self.trace_path = trace_path
+        self.test_daemons = test_daemons
+        self._roots: dict[Path, Path] = {}
+        self._rollback: dict[Path, RollbackManager] = {}
+        self._testers: dict[Path, TestRunner] = {}
+        self._shadows: dict[Path, ShadowWorkspace] = {}
+        self._recovered_roots: set[Path] = set()
+        self.recovered: list[dict] = []
+    
+    def root_for(self, file_path: Path) -> Path:
+        """Raíz del proyecto de `file_path` (cacheada por directorio)"""
+        if self.project_root:
+            return self.project_root
+        directory = file_path.parent if file_path.is_file() else file_path
+        root = self._roots.get(directory)
+        if root is None:
+            root = self._roots[directory] = _find_project_root(file_path)
+        return root
+    
+    def rollback_manager(self, project_root: Path) -> RollbackManager:
+        mgr = self._rollback.get(project_root)
+        if mgr is None:
+            mgr = self._rollback[project_root] = RollbackManager(project_root / "surgery")
+        return mgr
+    
+    def recover(self, project_root: Path) -> list[dict]:
+        """Recuperación tras un crash de la raíz (solo la primera vez en esta sesión)"""
+        if project_root in self._recovered_roots:
+            return []
+        self._recovered_roots.add(project_root)
+        mgr = self.rollback_manager(project_root)
+        report = [
+            {**entry, "transaction": tx["transaction_id"]}
+            for tx in recover_transactions(project_root / "surgery", mgr)
+            for entry in tx["files"]
+        ]
+        report.extend(mgr.recover_intents())
+        self.recovered.extend(report)
+        return report
+    
+    def test_runner(self, project_root: Path) -> TestRunner:
+        runner = self._testers.get(project_root)
+        if runner is None:
+            runner = self._testers[project_root] = TestRunner(project_root, daemons=self.test_daemons)
+        return runner
+    
+    def shadow(self, project_root: Path) -> ShadowWorkspace:
+        """Árbol sombra de la raíz (se construye o refresca al tomar su lock)"""
+        shadow = self._shadows.get(project_root)
+        if shadow is None:
+            shadow = self._shadows[project_root] = ShadowWorkspace(project_root)
+        return shadow
+    
+    def shadow_test_runner(self, project_root: Path, shadow: ShadowWorkspace) -> TestRunner:
+        """TestRunner del árbol sombra: workers propios, cache de resultados del proyecto"""
+        runner = self._testers.get(shadow.root)
+        if runner is None:
+            runner = self._testers[shadow.root] = TestRunner(
+                shadow.root, results=self.test_runner(project_root).results, daemons=self.test_daemons
+            )
+        return runner
+    
+    def execute(self, plan: Plan) -> dict:
+        return execute(plan, keep_indent=self.keep_indent, cwd=self.cwd, trace_path=self.trace_path, session=self)
+    
+    def execute_many(self, plans: list[Plan]) -> list[dict]:
+        return execute_many(plans, keep_indent=self.keep_indent, cwd=self.cwd, session=self)
+    
+    def execute_job(self, job: dict) -> dict:
+        """Ejecuta un job JSON: un plan con execute(), varios bloques con execute_many()"""
+        plans = plans_from_job(job)
+        if len(plans) == 1:
+            return self.execute(plans[0])
+        return self.execute_many(plans)[0]
+    
+    def transaction(self) -> SurgeryTransaction:
+        return SurgeryTransaction(keep_indent=self.keep_indent, cwd=self.cwd, session=self)
+    
+    def close(self) -> None:
+        """Persiste los caches de digests pendientes, termina los workers y elimina los árboles sombra"""
+        for mgr in self._rollback.values():
+            mgr.digests.flush()
+        for runner in self._testers.values():
+            runner.close()
+        for shadow in self._shadows.values():
+            shadow.cleanup()
+    
+    def __enter__(self) -> SurgeonSession:
+        return self
+    
+    def __exit__(self, *exc) -> None:
+        self.close()
 
-def execute(plan: Plan, keep_indent: bool = True, cwd: Optional[str] = None) -> dict:
+def execute(plan: Plan, keep_indent: bool = True, cwd: Optional[str] = None,
+            trace_path: Optional[Path] = None, session: Optional[SurgeonSession] = None) -> dict:
     """
     Ejecuta plan de cirugía con rollback tracking y auto-testing integrados.
     
@@ -33,84 +196,435 @@ def execute(plan: Plan, keep_indent: bool = True, cwd: Optional[str] = None) ->
     4. Ejecutar tests automáticamente
     5. Si tests fallan, hacer rollback automático
     6. Ejecutar post_cmd si existe
+    
+    Cada fase se mide y se retorna en `timings` (ms). Con `trace_path` (o la variable de
+    entorno CODE_SURGEON_TRACE) la medición se agrega además a un trace JSONL.
+    Con `session` se reutiliza el contexto de proyecto ya resuelto (ver SurgeonSession).
     """
+    timer = PhaseTimer()
+    out = None
+    own_session = session is None
+    try:
+        out = _execute(plan, keep_indent, cwd, timer, session or (session := SurgeonSession()))
+        out["timings"] = timer.as_dict()
+        return out
+    finally:
+        if own_session:
+            session.close()
+        trace_path = trace_path or trace_path_from_env()
+        if trace_path:
+            timer.append_trace(trace_path, file=str(plan.file), mode=plan.mode,
+                               ok=bool(out and out["ok"]), shadow=plan.shadow)
+
+def _execute(plan: Plan, keep_indent: bool, cwd: Optional[str], timer: PhaseTimer,
+             session: SurgeonSession) -> dict:
     p = Path(plan.file)
-    project_root = _find_project_root(p)
+    project_root = session.root_for(p)
+    streaming = plan.streaming if plan.streaming is not None else p.stat().st_size >= STREAMING_THRESHOLD_BYTES
+    index_cache = project_root / "surgery" / "cache"
+    rollback_mgr = session.rollback_manager(project_root)
+    store = rollback_mgr.blobs
+    if plan.mode == FULL_FILE_REPLACE and not plan.new_fragment_path:
+        raise ValueError("full-file-replace requires new_fragment_path")
+    if plan.shadow:
+        return _execute_in_shadow(plan, p, project_root, rollback_mgr, keep_indent, cwd, timer, session)
+    
+    # 1. Seleccionar región (el reemplazo completo no necesita selección)
+    with timer.phase("select"):
+        if plan.mode == FULL_FILE_REPLACE:
+            pass
+        elif streaming:
+            if plan.mode == "line-range":
+                span = locate_line_range(p, int(plan.start), int(plan.end), cache_dir=index_cache)
+            elif plan.mode == "regex-block":
+                span = locate_regex_block(p, str(plan.start), str(plan.end), include_markers=True)
+            else:
+                raise ValueError("Unknown mode")
+        elif plan.mode == "line-range":
+            sel = select_span_by_line_range(p, int(plan.start), int(plan.end), cache_dir=index_cache)
+        elif plan.mode == "regex-block":
+            sel = select_span_by_regex_block(p, str(plan.start), str(plan.end), include_markers=True)
+        else:
+            raise ValueError("Unknown mode")
+    
+    # 2-3. Aplicar y registrar bajo el lock del historial: hash previo, intención, rename,
+    # registro y confirmación son atómicos frente a otras cirugías y a la recuperación
+    with rollback_mgr.lock if plan.enable_rollback else nullcontext():
+        # Hash original para el registro (DigestCache: sin releer si el archivo no cambió)
+        with timer.phase("hash"):
+            original_hash = rollback_mgr.digests.short(p)
+        
+        # 2. Aplicar cambio (con intención write-ahead si se registra historial)
+        with timer.phase("splice"):
+            if plan.mode == FULL_FILE_REPLACE:
+                write = lambda dest: replace_file(p, Path(plan.new_fragment_path), store=store, dest=dest)
+            elif streaming:
+                new_fragment = Path(plan.new_fragment_path).read_text(encoding="utf-8") if plan.new_fragment_path else ""
+                write = lambda dest: splice_byte_range(p, span.start_byte, span.end_byte, new_fragment,
+                                                       keep_indent=keep_indent, start_line=span.start_line,
+                                                       store=store, dest=dest)
+            else:
+                new_fragment = Path(plan.new_fragment_path).read_text(encoding="utf-8") if plan.new_fragment_path else ""
+                write = lambda dest: splice_span(p, sel, new_fragment, keep_indent=keep_indent, store=store, dest=dest)
+            if plan.enable_rollback:
+                res, intent_id, new_blob = _write_with_intent(
+                    p, rollback_mgr, original_hash, write, mode=plan.mode, start=str(plan.start),
+                    end=str(plan.end), post_cmd=plan.post_cmd, job_file=plan.job_file
+                )
+            else:
+                res: SpliceResult = write(None)
+        
+        out = {
+            "ok": res.ok, 
+            "message": res.message, 
+            "diff": res.diff,
+            "rollback_record": None,
+            "test_result": None,
+            "auto_rollback": False
+        }
+        
+        if not res.ok:
+            return out
+        
+        # 3. Registrar cambio para rollback (si está habilitado)
+        if plan.enable_rollback:
+            with timer.phase("record"):
+                try:
+                    record = ChangeRecord.create(
+                        file_path=p,
+                        original=None,
+                        updated=None,
+                        mode=plan.mode,
+                        start=str(plan.start),
+                        end=str(plan.end),
+                        backup_path=res.backup_path,
+                        post_cmd=plan.post_cmd,
+                        post_result=None,  # Se actualiza después
+                        job_file=plan.job_file,
+                        original_blob=res.backup_blob,
+                        new_blob=new_blob,
+                        original_hash=original_hash,
+                        digests=rollback_mgr.digests
+                    )
+                    
+                    record_path = rollback_mgr.record_change(record)
+                    rollback_mgr.intents.commit(intent_id, str(record_path))
+                    rollback_mgr.digests.flush()
+                    out["rollback_record"] = str(record_path)
+                    
+                except Exception as e:
+                    out["rollback_warning"] = f"⚠️  No se pudo crear registro de rollback: {e}"
+                    rollback_mgr.intents.release(intent_id)
     
-    # 1. Seleccionar región
-    if plan.mode == "line-range":
-        sel = select_by_line_range(p, int(plan.start), int(plan.end))
-    elif plan.mode == "regex-block":
-        sel = select_by_regex_block(p, str(plan.start), str(plan.end), include_markers=True)
+    if plan.mode == FULL_FILE_REPLACE:
+        regions = None
     else:
-        raise ValueError("Unknown mode")
+        region = span if streaming else sel
+        regions = [(region.start_line, region.end_line)]
+    return _verify_or_rollback(out, p, session.test_runner(project_root), rollback_mgr, res.message,
+                               enable_rollback=plan.enable_rollback, enable_testing=plan.enable_testing,
+                               post_cmds=[plan.post_cmd] if plan.post_cmd else [], cwd=cwd, timer=timer,
+                               regions=regions, original_hash=original_hash, use_cache=plan.cache_tests)
+
+def _execute_in_shadow(plan: Plan, p: Path, project_root: Path, rollback_mgr: RollbackManager,
+                       keep_indent: bool, cwd: Optional[str], timer: PhaseTimer,
+                       session: SurgeonSession) -> dict:
+    """
+    Variante de execute() que no toca el árbol real hasta que todo pasa:
+    
+    1. Seleccionar y renderizar la región sobre el archivo real (sin escribir)
+    2. Refrescar el ShadowWorkspace de la sesión y escribir el empalme solo en la copia sombra
+    3. Tests (TestRunner de la sesión para la sombra) y post_cmd dentro del árbol sombra
+       (cwd mapeado al equivalente sombra)
+    4. Si pasan, promover el archivo al árbol real con un rename atómico y registrar el cambio
+    
+    Un fallo no requiere rollback: el árbol real nunca se modificó (sin reinicios de nodemon/HMR).
+    """
+    out = {
+        "ok": False,
+        "message": "",
+        "diff": "",
+        "rollback_record": None,
+        "test_result": None,
+        "auto_rollback": False,
+        "shadow": True
+    }
+    full_replace = plan.mode == FULL_FILE_REPLACE
+    if not full_replace:
+        with timer.phase("select"):
+            new_fragment = Path(plan.new_fragment_path).read_text(encoding="utf-8") if plan.new_fragment_path else ""
+            sels = select_spans(p, [(plan.mode, plan.start, plan.end)], include_markers=True,
+                                cache_dir=project_root / "surgery" / "cache")
+    with timer.phase("hash"):
+        original_hash = rollback_mgr.digests.short(p)
+    with timer.phase("render"):
+        if full_replace:
+            out["diff"] = file_diff(p, Path(plan.new_fragment_path), fromfile=str(p), tofile=str(p), n=DIFF_CONTEXT)
+        else:
+            replacements, out["diff"] = render_many(p, sels, [new_fragment], keep_indent=keep_indent)
+    
+    failure = None
+    shadow = session.shadow(project_root)
+    with shadow.lock:
+        with timer.phase("shadow_build"):
+            shadow.refresh()
+        with timer.phase("splice"):
+            shadow_file = shadow.path_for(p)
+            if full_replace:
+                stream_replace(Path(plan.new_fragment_path), shadow_file)
+            else:
+                write_spliced(p, replacements, dest=shadow_file)
+        
+        if plan.enable_testing:
+            with timer.phase("tests"):
+                try:
+                    regions = None if full_replace else [(sel.start_line, sel.end_line) for sel in sels]
+                    runner = session.shadow_test_runner(project_root, shadow)
+                    test_result = runner.run_tests_for_file(shadow_file, regions, original_hash, plan.cache_tests)
+                    out["test_result"] = _test_result_dict(test_result)
+                    if not test_result.ok:
+                        failure = f"❌ Tests fallaron en el árbol sombra: {test_result.summary()}"
+                except Exception as e:
+                    out["test_warning"] = f"⚠️  No se pudieron ejecutar tests: {e}"
+        
+        if failure is None and plan.post_cmd:
+            with timer.phase("post_cmd"):
+                check: PostCheck = run_command(plan.post_cmd, cwd=shadow.map_cwd(cwd))
+            out["post_check_ok"] = check.ok
+            out["post_check_output"] = check.output
+            if not check.ok:
+                failure = f"❌ Post-comando falló en el árbol sombra: {plan.post_cmd}"
+        
+        if failure is None:
+            with timer.phase("promote"):
+                new_blob = rollback_mgr.blobs.put_file(shadow_file)
+                new_hash = text_digest(shadow_file)[:12]
+    
+    if failure:
+        out["message"] = f"{failure}\n   El archivo real no se modificó."
+        return out
+    
+    with rollback_mgr.lock if plan.enable_rollback else nullcontext():
+        # Promover al árbol real, salvo que el archivo haya cambiado mientras se validaba
+        with timer.phase("promote"):
+            if rollback_mgr.digests.short(p) != original_hash:
+                out["message"] = f"❌ {p} cambió durante la validación en el árbol sombra; no se aplicó el cambio."
+                return out
+            original_blob = rollback_mgr.blobs.put_file(p)
+            intent_id = None
+            if plan.enable_rollback:
+                intent_id = rollback_mgr.intents.begin(
+                    target=str(p), pre_hash=original_hash, post_hash=new_hash, original_blob=original_blob,
+                    new_blob=new_blob, mode=plan.mode, start=str(plan.start), end=str(plan.end),
+                    post_cmd=plan.post_cmd, job_file=plan.job_file
+                )
+            try:
+                rollback_mgr.blobs.restore_to(new_blob, p)
+            except BaseException:
+                rollback_mgr.intents.release(intent_id)
+                raise
+        out["ok"] = True
+        
+        if plan.enable_rollback:
+            with timer.phase("record"):
+                try:
+                    record = ChangeRecord.create(
+                        file_path=p,
+                        original=None,
+                        updated=None,
+                        mode=plan.mode,
+                        start=str(plan.start),
+                        end=str(plan.end),
+                        backup_path=None,
+                        post_cmd=plan.post_cmd,
+                        post_result=None,
+                        job_file=plan.job_file,
+                        original_blob=original_blob,
+                        new_blob=new_blob,
+                        original_hash=original_hash,
+                        digests=rollback_mgr.digests
+                    )
+                    out["rollback_record"] = str(rollback_mgr.record_change(record))
+                    rollback_mgr.intents.commit(intent_id, out["rollback_record"])
+                    rollback_mgr.digests.flush()
+                except Exception as e:
+                    out["rollback_warning"] = f"⚠️  No se pudo crear registro de rollback: {e}"
+                    rollback_mgr.intents.release(intent_id)
     
-    # Guardar contenido original para el registro
-    original_content = read_text(p)
+    success_parts = ["✅ Splice applied (validado en árbol sombra)"]
+    if out.get("test_result"):
+        success_parts.append(f"   Tests: {out['test_result']['summary']}")
+    if out.get("rollback_record"):
+        success_parts.append(f"   Rollback disponible: {Path(out['rollback_record']).name}")
+    out["message"] = "\n".join(success_parts)
+    return out
+
+def execute_many(plans: list[Plan], keep_indent: bool = True, cwd: Optional[str] = None,
+                 session: Optional[SurgeonSession] = None) -> list[dict]:
+    """
+    Ejecuta varios planes agrupados por archivo, de forma transaccional por archivo:
     
-    # 2. Aplicar cambio
-    new_fragment = Path(plan.new_fragment_path).read_text(encoding="utf-8") if plan.new_fragment_path else ""
-    res: SpliceResult = splice_fragment(p, sel.pre, sel.mid, sel.post, new_fragment, keep_indent=keep_indent)
+    1. Todas las regiones del archivo se localizan sobre una sola lectura (bloques regex en un recorrido)
+    2. Se aplican con una sola escritura atómica; si un hunk falla no se escribe ninguno
+    3. Un único ChangeRecord compuesto ('multi-hunk') cubre todos los hunks
+    4. Tests (y post_cmds únicos) una sola vez; si fallan, rollback de todos los hunks
     
+    Retorna un resultado por archivo, en el orden de primera aparición.
+    """
+    groups: dict[Path, list[Plan]] = {}
+    for plan in plans:
+        groups.setdefault(Path(plan.file).resolve(), []).append(plan)
+    session = session or SurgeonSession()
+    return [_execute_group(path, group, keep_indent, cwd, session) for path, group in groups.items()]
+
+def _execute_group(p: Path, plans: list[Plan], keep_indent: bool, cwd: Optional[str],
+                   session: SurgeonSession) -> dict:
+    project_root = session.root_for(p)
+    rollback_mgr = session.rollback_manager(project_root)
     out = {
-        "ok": res.ok, 
-        "message": res.message, 
-        "diff": res.diff,
+        "ok": False,
+        "file": str(p),
+        "hunks": len(plans),
+        "message": "",
+        "diff": "",
         "rollback_record": None,
         "test_result": None,
         "auto_rollback": False
     }
     
-    if not res.ok:
+    # 1. Localizar todas las regiones sobre el archivo original
+    try:
+        fragments = [
+            Path(plan.new_fragment_path).read_text(encoding="utf-8") if plan.new_fragment_path else ""
+            for plan in plans
+        ]
+        sels = select_spans(p, [(plan.mode, plan.start, plan.end) for plan in plans],
+                            include_markers=True, cache_dir=project_root / "surgery" / "cache")
+    except Exception as e:
+        out["message"] = f"❌ No se aplicó ningún hunk: {e}"
         return out
     
-    # 3. Registrar cambio para rollback (si está habilitado)
-    if plan.enable_rollback:
-        try:
-            rollback_mgr = RollbackManager(project_root / "surgery")
-            updated_content = read_text(p)
-            
-            record = ChangeRecord.create(
-                file_path=p,
-                original=original_content,
-                updated=updated_content,
-                mode=plan.mode,
-                start=str(plan.start),
-                end=str(plan.end),
-                backup_path=res.backup_path,
-                post_cmd=plan.post_cmd,
-                post_result=None,  # Se actualiza después
-                job_file=plan.job_file
-            )
-            
-            record_path = rollback_mgr.record_change(record)
-            out["rollback_record"] = str(record_path)
-            
-        except Exception as e:
-            out["rollback_warning"] = f"⚠️  No se pudo crear registro de rollback: {e}"
+    # 2. Aplicar todos los hunks en una sola escritura (bajo el lock del historial, ver _execute)
+    write = lambda dest: splice_many(p, sels, fragments, keep_indent=keep_indent, store=rollback_mgr.blobs, dest=dest)
+    enable_rollback = all(plan.enable_rollback for plan in plans)
+    start = json.dumps([str(plan.start) for plan in plans], ensure_ascii=False)
+    end = json.dumps([str(plan.end) for plan in plans], ensure_ascii=False)
+    post_cmd = " && ".join(_unique(plan.post_cmd for plan in plans)) or None
+    job_file = ", ".join(_unique(plan.job_file for plan in plans)) or None
+    with rollback_mgr.lock if enable_rollback else nullcontext():
+        original_hash = rollback_mgr.digests.short(p)
+        if enable_rollback:
+            res, intent_id, new_blob = _write_with_intent(p, rollback_mgr, original_hash, write, mode="multi-hunk",
+                                                          start=start, end=end, post_cmd=post_cmd, job_file=job_file)
+        else:
+            res: SpliceResult = write(None)
+        out.update(ok=res.ok, message=res.message, diff=res.diff)
+        if not res.ok:
+            return out
+        
+        if enable_rollback:
+            try:
+                record = ChangeRecord.create(
+                    file_path=p,
+                    original=None,
+                    updated=None,
+                    mode="multi-hunk",
+                    start=start,
+                    end=end,
+                    backup_path=None,
+                    post_cmd=post_cmd,
+                    job_file=job_file,
+                    original_blob=res.backup_blob,
+                    new_blob=new_blob,
+                    original_hash=original_hash,
+                    digests=rollback_mgr.digests
+                )
+                out["rollback_record"] = str(rollback_mgr.record_change(record))
+                rollback_mgr.intents.commit(intent_id, out["rollback_record"])
+                rollback_mgr.digests.flush()
+            except Exception as e:
+                out["rollback_warning"] = f"⚠️  No se pudo crear registro de rollback: {e}"
+                rollback_mgr.intents.release(intent_id)
     
+    return _verify_or_rollback(out, p, session.test_runner(project_root), rollback_mgr, res.message,
+                               enable_rollback=enable_rollback,
+                               enable_testing=any(plan.enable_testing for plan in plans),
+                               post_cmds=_unique(plan.post_cmd for plan in plans), cwd=cwd,
+                               regions=[(sel.start_line, sel.end_line) for sel in sels], original_hash=original_hash,
+                               use_cache=all(plan.cache_tests for plan in plans))
+
+def _write_with_intent(p: Path, rollback_mgr: RollbackManager, original_hash: str,
+                       write: Callable[[Optional[Path]], SpliceResult],
+                       **fields) -> tuple[SpliceResult, Optional[str], Optional[str]]:
+    """
+    Escritura write-ahead: el empalme se prepara en un archivo hermano de `p`, se registra la
+    intención (hashes antes/después y blobs de ambas versiones) y recién entonces se renombra
+    sobre `p`. Retorna (resultado, id de la intención, blob nuevo); el llamador confirma la
+    intención tras persistir el ChangeRecord.
+    """
+    staged = p.with_name(f".{p.name}.{uuid.uuid4().hex[:8]}.staged")
+    try:
+        res = write(staged)
+        if not res.ok:
+            return res, None, None
+        new_blob = rollback_mgr.blobs.put_file(staged)
+        intent_id = rollback_mgr.intents.begin(
+            target=str(p), pre_hash=original_hash, post_hash=text_digest(staged)[:12],
+            original_blob=res.backup_blob, new_blob=new_blob, **fields
+        )
+        try:
+            os.replace(staged, p)
+        except OSError as e:
+            rollback_mgr.intents.abort(intent_id, "discarded")
+            return SpliceResult(False, "", f"Failed to write file: {e}", None, res.backup_blob), None, None
+        move_index(staged, p)
+        return res, intent_id, new_blob
+    finally:
+        staged.unlink(missing_ok=True)
+        forget_index(staged)
+
+def _test_result_dict(test_result: TestResult) -> dict:
+    return {
+        "ok": test_result.ok,
+        "summary": test_result.summary(),
+        "tests_run": test_result.tests_run,
+        "tests_failed": test_result.tests_failed,
+        "duration": test_result.duration_seconds,
+        "cached": test_result.cached,
+        "breakdown": test_result.breakdown,
+        "output": test_result.output
+    }
+
+def _unique(values) -> list[str]:
+    """Valores no vacíos sin duplicados, conservando el orden"""
+    return list(dict.fromkeys(v for v in values if v))
+
+def _verify_or_rollback(out: dict, p: Path, test_runner: TestRunner, rollback_mgr: RollbackManager,
+                        splice_message: str, enable_rollback: bool, enable_testing: bool,
+                        post_cmds: list[str], cwd: Optional[str], timer: Optional[PhaseTimer] = None,
+                        regions: Optional[list[tuple[int, int]]] = None,
+                        original_hash: Optional[str] = None, use_cache: bool = True) -> dict:
+    """
+    Pasos 4-6 comunes: tests automáticos, post_cmd y rollback automático si algo falla.
+    `regions` (líneas empalmadas del original con `original_hash`) permite elegir tests por cobertura.
+    Completa `out` y lo retorna.
+    """
+    timer = timer or PhaseTimer()
     # 4. Ejecutar tests automáticamente (si está habilitado)
     test_passed = True
-    if plan.enable_testing:
+    if enable_testing:
         try:
-            test_runner = TestRunner(project_root)
-            test_result: TestResult = test_runner.run_tests_for_file(p)
+            with timer.phase("tests"):
+                test_result: TestResult = test_runner.run_tests_for_file(p, regions, original_hash, use_cache)
             
-            out["test_result"] = {
-                "ok": test_result.ok,
-                "summary": test_result.summary(),
-                "tests_run": test_result.tests_run,
-                "tests_failed": test_result.tests_failed,
-                "duration": test_result.duration_seconds,
-                "output": test_result.output
-            }
+            out["test_result"] = _test_result_dict(test_result)
             
             test_passed = test_result.ok
             
             # 5. Rollback automático si los tests fallan
-            if not test_passed and plan.enable_rollback:
-                rollback_mgr = RollbackManager(project_root / "surgery")
-                success, rollback_msg = rollback_mgr.rollback_last(p)
+            if not test_passed and enable_rollback:
+                with timer.phase("rollback"):
+                    success, rollback_msg = rollback_mgr.rollback_last(p)
                 
                 out["auto_rollback"] = True
                 out["rollback_message"] = rollback_msg
@@ -127,15 +641,19 @@ def execute(plan: Plan, keep_indent: bool = True, cwd: Optional[str] = None) ->
             out["test_warning"] = f"⚠️  No se pudieron ejecutar tests: {e}"
     
     # 6. Ejecutar post_cmd (solo si tests pasaron)
-    if plan.post_cmd and test_passed:
-        check: PostCheck = run_command(plan.post_cmd, cwd=Path(cwd) if cwd else None)
-        out["post_check_ok"] = check.ok
-        out["post_check_output"] = check.output
+    if post_cmds and test_passed:
+        for post_cmd in post_cmds:
+            with timer.phase("post_cmd"):
+                check: PostCheck = run_command(post_cmd, cwd=Path(cwd) if cwd else None)
+            out["post_check_ok"] = check.ok
+            out["post_check_output"] = check.output
+            if not check.ok:
+                break
         
         # Si post_cmd falla, también hacer rollback
-        if not check.ok and plan.enable_rollback:
-            rollback_mgr = RollbackManager(project_root / "surgery")
-            success, rollback_msg = rollback_mgr.rollback_last(p)
+        if not check.ok and enable_rollback:
+            with timer.phase("rollback"):
+                success, rollback_msg = rollback_mgr.rollback_last(p)
             
             out["auto_rollback"] = True
             out["rollback_message"] = rollback_msg
@@ -144,7 +662,7 @@ def execute(plan: Plan, keep_indent: bool = True, cwd: Optional[str] = None) ->
     
     # Mensaje de éxito completo
     if out["ok"] and test_passed:
-        success_parts = [f"✅ {res.message}"]
+        success_parts = [f"✅ {splice_message}"]
         if out.get("test_result"):
             success_parts.append(f"   Tests: {out['test_result']['summary']}")
         if out.get("rollback_record"):
@@ -154,6 +672,226 @@ def execute(plan: Plan, keep_indent: bool = True, cwd: Optional[str] = None) ->
     
     return out
 
+class SurgeryTransaction:
+    """
+    Transacción de cirugía multi-archivo: todos los archivos se confirman o ninguno.
+    
+    Flujo de commit():
+    1. Preparar: localizar y renderizar todas las regiones de todos los archivos sin escribir
+    2. Journal: respaldar originales en el BlobStore y persistir surgery/transactions/<id>.json
+    3. Aplicar: escritura atómica por archivo, registrando cada hash nuevo en el journal
+    4. Verificar: una sola corrida con la unión de tests de TestRegistry y post_cmds únicos
+    5. Confirmar (se borra el journal) o restaurar todos los archivos
+    
+    Un journal que sobrevive a un crash se revierte con recover_transactions().
+    """
+    
+    def __init__(self, project_root: Optional[Path] = None, keep_indent: bool = True,
+                 cwd: Optional[str] = None, enable_testing: bool = True,
+                 session: Optional[SurgeonSession] = None):
+        self.session = session or SurgeonSession(project_root)
+        self.keep_indent = keep_indent
+        self.cwd = cwd
+        self.enable_testing = enable_testing
+        self.plans: list[Plan] = []
+    
+    def stage(self, plan: Plan) -> SurgeryTransaction:
+        """Agrega un plan a la transacción (no toca ningún archivo)"""
+        self.plans.append(plan)
+        return self
+    
+    def commit(self) -> dict:
+        if not self.plans:
+            return {"ok": True, "message": "Nada que aplicar", "files": []}
+        groups: dict[Path, list[Plan]] = {}
+        for plan in self.plans:
+            groups.setdefault(Path(plan.file).resolve(), []).append(plan)
+        project_root = self.session.root_for(next(iter(groups)))
+        rollback_mgr = self.session.rollback_manager(project_root)
+        tx_id = f"{datetime.now(timezone.utc):%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:8]}"
+        out = {
+            "ok": False,
+            "transaction_id": tx_id,
+            "files": [str(p) for p in groups],
+            "message": "",
+            "diff": "",
+            "test_result": None,
+            "auto_rollback": False
+        }
+        
+        # 1. Preparar todas las regiones (ningún archivo se toca si algo falla)
+        prepared = []
+        try:
+            for p, plans in groups.items():
+                fragments = [
+                    Path(plan.new_fragment_path).read_text(encoding="utf-8") if plan.new_fragment_path else ""
+                    for plan in plans
+                ]
+                sels = select_spans(p, [(plan.mode, plan.start, plan.end) for plan in plans],
+                                    include_markers=True, cache_dir=project_root / "surgery" / "cache")
+                replacements, diff = render_many(p, sels, fragments, keep_indent=self.keep_indent)
+                prepared.append((p, plans, replacements, diff))
+        except Exception as e:
+            out["message"] = f"❌ Transacción abortada antes de escribir: {e}"
+            return out
+        out["diff"] = "".join(diff for _, _, _, diff in prepared)
+        
+        # 2. Journal con respaldo de los originales
+        journal_path = rollback_mgr.history_dir / "transactions" / f"{tx_id}.json"
+        journal = {
+            "id": tx_id,
+            "pid": os.getpid(),
+            "state": "prepared",
+            "files": [
+                {
+                    "path": str(p),
+                    "original_hash": rollback_mgr.digests.short(p),
+                    "original_blob": rollback_mgr.blobs.put_file(p),
+                    "new_hash": None,
+                    "record": None
+                }
+                for p, _, _, _ in prepared
+            ]
+        }
+        atomic_write_text(journal_path, json.dumps(journal, indent=2))
+        
+        # 3. Aplicar y registrar
+        try:
+            journal["state"] = "applying"
+            for (p, plans, replacements, _), entry in zip(prepared, journal["files"]):
+                write_spliced(p, replacements)
+                entry["new_hash"] = rollback_mgr.digests.short(p)
+                atomic_write_text(journal_path, json.dumps(journal, indent=2))
+            for (p, plans, _, _), entry in zip(prepared, journal["files"]):
+                single = len(plans) == 1
+                record = ChangeRecord.create(
+                    file_path=p,
+                    original=None,
+                    updated=None,
+                    mode=plans[0].mode if single else "multi-hunk",
+                    start=str(plans[0].start) if single else json.dumps([str(x.start) for x in plans]),
+                    end=str(plans[0].end) if single else json.dumps([str(x.end) for x in plans]),
+                    backup_path=None,
+                    post_cmd=" && ".join(_unique(x.post_cmd for x in plans)) or None,
+                    job_file=", ".join(_unique(x.job_file for x in plans)) or None,
+                    original_blob=entry["original_blob"],
+                    new_blob=rollback_mgr.blobs.put_file(p),
+                    original_hash=entry["original_hash"],
+                    digests=rollback_mgr.digests,
+                    transaction_id=tx_id
+                )
+                entry["record"] = str(rollback_mgr.record_change(record))
+            journal["state"] = "verifying"
+            atomic_write_text(journal_path, json.dumps(journal, indent=2))
+            rollback_mgr.digests.flush()
+        except Exception as e:
+            report = _undo_journal(journal, rollback_mgr)
+            journal_path.unlink(missing_ok=True)
+            out["auto_rollback"] = True
+            out["rollback_report"] = report
+            out["message"] = f"❌ Error aplicando la transacción, archivos restaurados: {e}"
+            return out
+        
+        # 4. Una sola corrida de tests para la unión de archivos
+        failure = None
+        if self.enable_testing and any(plan.enable_testing for plan in self.plans):
+            try:
+                test_result = self.session.test_runner(project_root).run_tests_for_files(
+                    list(groups), all(plan.cache_tests for plan in self.plans))
+                out["test_result"] = _test_result_dict(test_result)
+                if not test_result.ok:
+                    failure = f"❌ Tests fallaron: {test_result.summary()}"
+            except Exception as e:
+                out["test_warning"] = f"⚠️  No se pudieron ejecutar tests: {e}"
+        if failure is None:
+            for post_cmd in _unique(plan.post_cmd for plan in self.plans):
+                check: PostCheck = run_command(post_cmd, cwd=Path(self.cwd) if self.cwd else None)
+                out["post_check_ok"] = check.ok
+                out["post_check_output"] = check.output
+                if not check.ok:
+                    failure = f"❌ Post-comando falló: {post_cmd}"
+                    break
+        
+        # 5. Confirmar o restaurar todo
+        if failure:
+            out["rollback_report"] = _undo_journal(journal, rollback_mgr)
+            out["auto_rollback"] = True
+            out["message"] = f"{failure}\n   Rollback de {len(prepared)} archivos ejecutado."
+        else:
+            out["ok"] = True
+            out["records"] = [entry["record"] for entry in journal["files"]]
+            out["message"] = f"✅ Transacción {tx_id} confirmada ({len(prepared)} archivos)"
+            if out.get("test_result"):
+                out["message"] += f"\n   Tests: {out['test_result']['summary']}"
+        journal_path.unlink(missing_ok=True)
+        return out
+
+def _undo_journal(journal: dict, rollback_mgr: RollbackManager) -> list[dict]:
+    """
+    Restaura los archivos de un journal a su contenido original.
+    Solo se restauran archivos cuyo contenido actual es el que escribió la transacción;
+    cualquier otra diferencia se reporta como conflicto sin tocar el archivo.
+    """
+    report = []
+    pending_write_seen = False
+    for entry in journal["files"]:
+        target = Path(entry["path"])
+        current = rollback_mgr.digests.short(target) if target.exists() else None
+        if current == entry["original_hash"]:
+            status = "untouched"
+        elif entry["new_hash"] is not None and current == entry["new_hash"]:
+            rollback_mgr.blobs.restore_to(entry["original_blob"], target)
+            status = "restored"
+        elif entry["new_hash"] is None and not pending_write_seen and journal["state"] == "applying":
+            # Crash entre el rename atómico y la actualización del journal
+            rollback_mgr.blobs.restore_to(entry["original_blob"], target)
+            status = "restored"
+        else:
+            status = "conflict"
+        if entry["new_hash"] is None:
+            pending_write_seen = True
+        if entry.get("record"):
+            record_path = Path(entry["record"])
+            if record_path.exists():
+                rollback_mgr.mark_rolled_back(record_path)
+        report.append({"file": entry["path"], "status": status})
+    rollback_mgr.digests.flush()
+    return report
+
+def _journal_is_orphan(journal: dict, journal_path: Path) -> bool:
+    """
+    Un journal es huérfano si su proceso ya no existe (o es antiguo, donde no se puede verificar).
+    Los de este mismo proceso pertenecen a una transacción en curso y nunca lo son.
+    """
+    if os.name == "nt":
+        return time.time() - journal_path.stat().st_mtime > 600
+    try:
+        os.kill(int(journal["pid"]), 0)
+    except ProcessLookupError:
+        return True
+    except (PermissionError, ValueError, KeyError):
+        return False
+    return False
+
+def recover_transactions(surgery_dir: Path, rollback_mgr: Optional[RollbackManager] = None) -> list[dict]:
+    """
+    Revierte transacciones interrumpidas (crash durante commit) usando sus journals.
+    Retorna un reporte por transacción recuperada.
+    """
+    tx_dir = surgery_dir / "transactions"
+    if not tx_dir.exists():
+        return []
+    rollback_mgr = rollback_mgr or RollbackManager(surgery_dir)
+    recovered = []
+    for journal_path in sorted(tx_dir.glob("*.json")):
+        journal = json.loads(read_text(journal_path))
+        if not _journal_is_orphan(journal, journal_path):
+            continue
+        report = _undo_journal(journal, rollback_mgr)
+        journal_path.unlink()
+        recovered.append({"transaction_id": journal["id"], "state": journal["state"], "files": report})
+    return recovered
+
 def _find_project_root(file_path: Path) -> Path:
     """Encuentra la raíz del proyecto buscando package.json o .git"""
     current = file_path.parent if file_path.is_file() else file_path
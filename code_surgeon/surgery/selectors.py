@@ -1,9 +1,10 @@
 from __future__ import annotations
-import re
-from dataclasses import dataclass
-from typing import Optional, Tuple
+import os, re, mmap
+from dataclasses import dataclass, field
+from typing import Optional, Tuple, Sequence, Union
 from pathlib import Path
 from .utils import read_text, slice_by_lines
+from .lineindex import LineIndex, get_line_index, splitlines_index
 
 @dataclass
 class Selection:
@@ -13,10 +14,25 @@ class Selection:
     start_line: int
     end_line: int
 
-def select_by_line_range(path: Path, start_line: int, end_line: int) -> Selection:
-    text = read_text(path)
-    pre, mid, post = slice_by_lines(text, start_line, end_line)
-    return Selection(pre, mid, post, start_line, end_line)
+def _strip_eol(chunk: bytes) -> str:
+    """Decodifica un trozo de líneas completas con la misma forma que "\\n".join(splitlines())"""
+    text = chunk.decode("utf-8").replace("\r\n", "\n")
+    return text[:-1] if text.endswith("\n") else text
+
+def select_by_line_range(path: Path, start_line: int, end_line: int,
+                         cache_dir: Optional[Path] = None) -> Union[Selection, SpanSelection]:
+    """
+    Selección por rango de líneas. Con el índice de líneas, pre/mid/post se leen bajo demanda
+    con un seek a su tramo (dos lookups de offsets): leer `mid` no lee el resto del archivo.
+    """
+    index = get_line_index(path, cache_dir)
+    if index.exotic or start_line < 1 or end_line < start_line or start_line > index.line_count:
+        # Saltos de línea no estándar o rango fuera del archivo: semántica original de splitlines()
+        text = read_text(path)
+        pre, mid, post = slice_by_lines(text, start_line, end_line)
+        return Selection(pre, mid, post, start_line, end_line)
+    start_byte, end_byte = index.span(start_line, end_line)
+    return SpanSelection(start_line, end_line, start_byte, end_byte, FileSlices(path, index.signature))
 
 def select_by_regex_block(path: Path, start_pattern: str, end_pattern: str, include_markers: bool = True) -> Selection:
     text = read_text(path)
@@ -33,3 +49,248 @@ def select_by_regex_block(path: Path, start_pattern: str, end_pattern: str, incl
     e = end_idx+1 if include_markers else end_idx
     pre, mid, post = slice_by_lines(text, s, e)
     return Selection(pre, mid, post, s, e)
+
+def _combined(patterns: Sequence[str]) -> Optional[re.Pattern]:
+    """Alternación de todos los patrones como prefiltro; None si no se pueden combinar"""
+    try:
+        return re.compile("|".join(f"(?:{p})" for p in patterns))
+    except re.error:
+        return None
+
+def _scan_regex_blocks(lines, pairs: Sequence[Tuple[str, str]], include_markers: bool) -> list[Tuple[int, int]]:
+    """
+    Resuelve N pares (start_pattern, end_pattern) en un solo recorrido de `lines`.
+    Retorna (start_line, end_line) por par; patrones ausentes o bloques solapados son error.
+    """
+    starts = [re.compile(sp) for sp, _ in pairs]
+    ends = [re.compile(ep) for _, ep in pairs]
+    any_start = _combined([sp for sp, _ in pairs])
+    any_end = _combined([ep for _, ep in pairs])
+    
+    start_idx: list[Optional[int]] = [None] * len(pairs)
+    end_idx: list[Optional[int]] = [None] * len(pairs)
+    waiting_start = set(range(len(pairs)))
+    waiting_end: set[int] = set()
+    for i, line in enumerate(lines):
+        if not waiting_start and not waiting_end:
+            break
+        if waiting_end and (any_end is None or any_end.search(line)):
+            for k in [k for k in waiting_end if ends[k].search(line)]:
+                end_idx[k] = i
+                waiting_end.discard(k)
+        if waiting_start and (any_start is None or any_start.search(line)):
+            for k in [k for k in waiting_start if starts[k].search(line)]:
+                start_idx[k] = i
+                waiting_start.discard(k)
+                waiting_end.add(k)
+    
+    errors = []
+    for k, (sp, ep) in enumerate(pairs):
+        if start_idx[k] is None:
+            errors.append(f"[{k}] Start pattern not found: {sp}")
+        elif end_idx[k] is None:
+            errors.append(f"[{k}] End pattern not found: {ep}")
+    if errors:
+        raise ValueError("\n".join(errors))
+    
+    spans = [
+        (start_idx[k] + 1, end_idx[k] + 1 if include_markers else end_idx[k])
+        for k in range(len(pairs))
+    ]
+    check_overlaps(spans)
+    return spans
+
+def check_overlaps(spans: Sequence[Tuple[int, int]]) -> None:
+    """Valida que los rangos de líneas (start, end) no se solapen; reporta todos los conflictos"""
+    ordered = sorted((s, e, k) for k, (s, e) in enumerate(spans))
+    overlaps = [
+        f"[{a[2]}] lines {a[0]}-{a[1]} overlaps [{b[2]}] lines {b[0]}-{b[1]}"
+        for a, b in zip(ordered, ordered[1:]) if b[0] <= a[1]
+    ]
+    if overlaps:
+        raise ValueError("Overlapping blocks:\n" + "\n".join(overlaps))
+
+@dataclass
+class ByteSpan:
+    """Región seleccionada expresada en offsets de bytes (modo streaming)"""
+    start_line: int
+    end_line: int
+    start_byte: int
+    end_byte: int  # exclusivo, incluye el terminador de end_line
+
+def _iter_lines_with_offsets(path: Path):
+    """Itera (line_no, offset, raw_line) sin cargar el archivo completo en memoria"""
+    offset = 0
+    with open(path, "rb") as f:
+        for line_no, raw in enumerate(f, 1):
+            yield line_no, offset, raw
+            offset += len(raw)
+
+def _decode_line(raw: bytes) -> str:
+    return raw.rstrip(b"\r\n").decode("utf-8", errors="replace")
+
+def _numbering_index(path: Path, cache_dir: Optional[Path] = None) -> LineIndex:
+    """
+    Índice de líneas con la numeración de select_by_line_range: por "\n" normalmente, y la de
+    splitlines() si el archivo tiene saltos no estándar (FF, VT, U+2028/2029, CR suelto...).
+    """
+    index = get_line_index(path, cache_dir)
+    return splitlines_index(path) if index.exotic else index
+
+def locate_line_range(path: Path, start_line: int, end_line: int, cache_dir: Optional[Path] = None) -> ByteSpan:
+    index = _numbering_index(path, cache_dir)
+    if end_line > index.line_count:
+        raise ValueError(f"Line range {start_line}-{end_line} out of bounds")
+    start_byte, end_byte = index.span(start_line, end_line)
+    return ByteSpan(start_line, end_line, start_byte, end_byte)
+
+def locate_regex_block(path: Path, start_pattern: str, end_pattern: str, include_markers: bool = True) -> ByteSpan:
+    start_rx = re.compile(start_pattern)
+    end_rx = re.compile(end_pattern)
+    start = None
+    for line_no, offset, raw in _iter_lines_with_offsets(path):
+        if start is None:
+            if start_rx.search(_decode_line(raw)):
+                start = (line_no, offset)
+        elif end_rx.search(_decode_line(raw)):
+            if include_markers:
+                return ByteSpan(start[0], line_no, start[1], offset + len(raw))
+            return ByteSpan(start[0], line_no - 1, start[1], offset)
+    if start is None:
+        raise ValueError("Start pattern not found")
+    raise ValueError("End pattern not found")
+
+@dataclass(eq=False)
+class SpanSelection(ByteSpan):
+    """
+    Selection basada en spans: guarda solo offsets de bytes/líneas y una referencia
+    a un buffer compartido (mmap). pre/mid/post se decodifican bajo demanda, así que
+    los consumidores que solo necesitan la región no copian el archivo completo.
+    """
+    buffer: object = field(default=b"", repr=False)
+    
+    @property
+    def mid_bytes(self) -> bytes:
+        return self.buffer[self.start_byte:self.end_byte]
+    
+    @property
+    def pre(self) -> str:
+        return _strip_eol(self.buffer[:self.start_byte])
+    
+    @property
+    def mid(self) -> str:
+        return _strip_eol(self.mid_bytes)
+    
+    @property
+    def post(self) -> str:
+        return _strip_eol(self.buffer[self.end_byte:])
+    
+    def lines_before(self, n: int) -> list[str]:
+        """Hasta n líneas inmediatamente anteriores a la región"""
+        pos, lines = self.start_byte, []
+        while pos > 0 and len(lines) < n:
+            begin = self.buffer.rfind(b"\n", 0, pos - 1) + 1
+            lines.append(_decode_line(self.buffer[begin:pos]))
+            pos = begin
+        return lines[::-1]
+    
+    def lines_after(self, n: int) -> list[str]:
+        """Hasta n líneas inmediatamente posteriores a la región"""
+        pos, lines, size = self.end_byte, [], len(self.buffer)
+        while pos < size and len(lines) < n:
+            nl = self.buffer.find(b"\n", pos)
+            stop = size if nl == -1 else nl + 1
+            lines.append(_decode_line(self.buffer[pos:stop]))
+            pos = stop
+        return lines
+    
+    def close(self) -> None:
+        """Libera el mmap (necesario antes de reemplazar el archivo en Windows)"""
+        if isinstance(self.buffer, mmap.mmap) and not self.buffer.closed:
+            self.buffer.close()
+
+class FileSlices:
+    """
+    Buffer de solo lectura que lee cada tramo con seek + read al pedirlo (buffer[a:b]), sin
+    mantener el archivo abierto. Falla si el archivo cambió desde que se tomó `signature`.
+    """
+    
+    def __init__(self, path: Path, signature: tuple[int, int, int]):
+        self.path = path
+        self.signature = signature
+    
+    def __len__(self) -> int:
+        return self.signature[1]
+    
+    def __getitem__(self, key: slice) -> bytes:
+        start, stop, _ = key.indices(len(self))
+        with open(self.path, "rb") as f:
+            st = os.fstat(f.fileno())
+            if (st.st_ino, st.st_size, st.st_mtime_ns) != self.signature:
+                raise ValueError(f"{self.path} changed after selection")
+            f.seek(start)
+            return f.read(max(0, stop - start))
+
+def open_buffer(path: Path):
+    """Buffer de solo lectura del archivo (mmap; bytes vacíos para archivos vacíos)"""
+    with open(path, "rb") as f:
+        if f.seek(0, 2) == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def select_span_by_line_range(path: Path, start_line: int, end_line: int, cache_dir: Optional[Path] = None) -> SpanSelection:
+    """Selección por rango de líneas: dos lookups en LineIndex y un mmap, sin copiar el archivo"""
+    span = locate_line_range(path, start_line, end_line, cache_dir)
+    return SpanSelection(span.start_line, span.end_line, span.start_byte, span.end_byte, open_buffer(path))
+
+def select_span_by_regex_block(path: Path, start_pattern: str, end_pattern: str, include_markers: bool = True) -> SpanSelection:
+    span = locate_regex_block(path, start_pattern, end_pattern, include_markers)
+    return SpanSelection(span.start_line, span.end_line, span.start_byte, span.end_byte, open_buffer(path))
+
+def select_spans(path: Path, requests: Sequence[Tuple[str, object, object]], include_markers: bool = True,
+                 cache_dir: Optional[Path] = None) -> list[SpanSelection]:
+    """
+    Resuelve varias regiones de un mismo archivo sobre un único buffer compartido.
+    `requests` son tuplas (mode, start, end) con mode 'line-range' o 'regex-block';
+    todos los bloques regex se localizan en un solo recorrido. Solapamientos son error.
+    """
+    index = _numbering_index(path, cache_dir)
+    buffer = open_buffer(path)
+    try:
+        line_spans: list[Optional[Tuple[int, int]]] = [None] * len(requests)
+        regex_keys = []
+        for k, (mode, start, end) in enumerate(requests):
+            if mode == "line-range":
+                line_spans[k] = (int(start), int(end))
+            elif mode == "regex-block":
+                regex_keys.append(k)
+            else:
+                raise ValueError(f"Unknown mode: {mode}")
+        if regex_keys:
+            if index.exotic:
+                lines = read_text(path).splitlines()
+            else:
+                lines = (_decode_line(raw) for raw in _iter_buffer_lines(buffer))
+            pairs = [(str(requests[k][1]), str(requests[k][2])) for k in regex_keys]
+            for k, span in zip(regex_keys, _scan_regex_blocks(lines, pairs, include_markers)):
+                line_spans[k] = span
+        check_overlaps(line_spans)
+        selections = []
+        for s, e in line_spans:
+            if e > index.line_count:
+                raise ValueError(f"Line range {s}-{e} out of bounds")
+            start_byte, end_byte = index.span(s, e)
+            selections.append(SpanSelection(s, e, start_byte, end_byte, buffer))
+        return selections
+    except Exception:
+        if isinstance(buffer, mmap.mmap):
+            buffer.close()
+        raise
+
+def _iter_buffer_lines(buffer):
+    pos, size = 0, len(buffer)
+    while pos < size:
+        nl = buffer.find(b"\n", pos)
+        stop = size if nl == -1 else nl + 1
+        yield buffer[pos:stop]
+        pos = stop
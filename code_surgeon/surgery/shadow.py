@@ -0,0 +1,167 @@
+"""
+Shadow Workspace
+Árbol sombra copy-on-write del proyecto para validar una cirugía antes de tocar el árbol real.
+Cada archivo sin cambios es un reflink (clon copy-on-write del sistema de archivos, p. ej.
+btrfs o XFS) y, donde no hay reflinks, un hardlink; los archivos que los tests escriben en
+sitio (COPIED_SUFFIXES) se copian, porque por un hardlink la escritura llegaría al archivo real.
+Los directorios pesados, con estado o que ningún test carga (LINKED_DIRS) son symlinks y no se
+recorren. Solo los archivos empalmados son copias propias: el empalme escribe con rename atómico.
+
+El árbol se reutiliza entre cirugías (SurgeonSession): refresh() solo rehace las entradas que
+difieren del árbol real (otro inodo, o tamaño/mtime distinto en copias y reflinks) y borra las
+que ya no existen, así la ruta es estable y los workers de tests de la sombra siguen calientes.
+"""
+from __future__ import annotations
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Directorios que se enlazan completos con un symlink (a cualquier profundidad)
+LINKED_DIRS = ("node_modules", ".git", "surgery", "backups", "Garbage")
+
+# Archivos que los tests pueden modificar en sitio: un hardlink escribiría el archivo real
+COPIED_SUFFIXES = (".db", ".sqlite", ".sqlite3", ".db-wal", ".db-shm", ".db-journal", ".log")
+
+# ioctl FICLONE de Linux (linux/fs.h): el destino comparte los extents del origen hasta que se escribe
+_FICLONE = 0x40049409
+
+
+class ShadowWorkspace:
+    """Árbol sombra de `project_root`; como context manager se construye y se elimina al salir"""
+
+    def __init__(self, project_root: Path, base_dir: Optional[Path] = None):
+        self.project_root = project_root.resolve()
+        self.base_dir = base_dir
+        self.root: Optional[Path] = None
+        self.lock = threading.Lock()  # una validación a la vez sobre el mismo árbol
+        self._can_reflink = fcntl is not None and hasattr(os, "uname") and os.uname().sysname == "Linux"
+        self._can_link = True
+
+    def __enter__(self) -> ShadowWorkspace:
+        self.build()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.cleanup()
+
+    def build(self) -> Path:
+        """
+        Crea el árbol sombra. Por defecto junto al proyecto (mismo sistema de archivos, para
+        poder usar reflinks y hardlinks); si no se puede, en el directorio temporal del sistema.
+        """
+        prefix = f".{self.project_root.name}.shadow-"
+        try:
+            self.root = Path(tempfile.mkdtemp(prefix=prefix, dir=self.base_dir or self.project_root.parent))
+        except OSError:
+            self.root = Path(tempfile.mkdtemp(prefix=prefix))
+        self._mirror()
+        return self.root
+
+    def refresh(self) -> Path:
+        """Pone al día un árbol ya construido con el árbol real (o lo construye)"""
+        if self.root is None or not self.root.exists():
+            return self.build()
+        self._mirror()
+        return self.root
+
+    def _mirror(self) -> None:
+        for dirpath, dirnames, filenames in os.walk(self.project_root):
+            src_dir = Path(dirpath)
+            dst_dir = self.root / src_dir.relative_to(self.project_root)
+            stale = set(os.listdir(dst_dir)) - set(dirnames) - set(filenames)
+            for name in list(dirnames):
+                src, dst = src_dir / name, dst_dir / name
+                if name in LINKED_DIRS or src.is_symlink():
+                    dirnames.remove(name)
+                    target = os.readlink(src) if src.is_symlink() else str(src)
+                    if not (dst.is_symlink() and os.readlink(dst) == target):
+                        _remove(dst)
+                        os.symlink(target, dst, target_is_directory=True)
+                elif dst.is_symlink() or not dst.is_dir():
+                    _remove(dst)
+                    dst.mkdir()
+            for name in filenames:
+                src, dst = src_dir / name, dst_dir / name
+                if not _is_current(src, dst):
+                    _remove(dst)
+                    self._link_file(src, dst)
+            for name in stale:
+                _remove(dst_dir / name)
+
+    def _link_file(self, src: Path, dst: Path) -> None:
+        if src.is_symlink():
+            os.symlink(os.readlink(src), dst)
+            return
+        if self._can_reflink and self._reflink(src, dst):
+            return
+        if self._can_link and not src.name.endswith(COPIED_SUFFIXES):
+            try:
+                os.link(src, dst)
+                return
+            except OSError:
+                # Otro sistema de archivos o sin soporte de hardlinks: copias reales desde aquí
+                self._can_link = False
+        shutil.copy2(src, dst)
+
+    def _reflink(self, src: Path, dst: Path) -> bool:
+        try:
+            with open(src, "rb") as s, open(dst, "wb") as d:
+                fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+        except OSError:
+            # Sistema de archivos sin reflinks (ext4, tmpfs) u otro dispositivo: no se reintenta
+            dst.unlink(missing_ok=True)
+            self._can_reflink = False
+            return False
+        shutil.copystat(src, dst)
+        return True
+
+    def path_for(self, real_path: Path) -> Path:
+        """Ruta equivalente dentro del árbol sombra"""
+        return self.root / Path(real_path).resolve().relative_to(self.project_root)
+
+    def map_cwd(self, cwd: Optional[str]) -> Path:
+        """Directorio de trabajo para post_cmd: el equivalente sombra, o la raíz sombra"""
+        if cwd:
+            try:
+                return self.path_for(Path(cwd))
+            except ValueError:
+                return Path(cwd)
+        return self.root
+
+    def cleanup(self) -> None:
+        """Elimina el árbol sombra (los symlinks se borran sin seguirlos)"""
+        if self.root and self.root.exists():
+            shutil.rmtree(self.root)
+        self.root = None
+
+
+def _is_current(src: Path, dst: Path) -> bool:
+    """True si la entrada sombra sigue reflejando el archivo real"""
+    try:
+        d = dst.lstat()
+    except FileNotFoundError:
+        return False
+    if src.is_symlink():
+        return dst.is_symlink() and os.readlink(src) == os.readlink(dst)
+    if dst.is_symlink():
+        return False
+    s = src.stat()
+    if (s.st_ino, s.st_dev) == (d.st_ino, d.st_dev):
+        return True
+    # Copia o reflink: copystat conserva el mtime, cualquier escritura lo cambia
+    return s.st_size == d.st_size and s.st_mtime_ns == d.st_mtime_ns
+
+
+def _remove(path: Path) -> None:
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path)
+    else:
+        path.unlink(missing_ok=True)
@@ -1,16 +1,27 @@
 from __future__ import annotations
-import re
+import os, shutil, tempfile
 from dataclasses import dataclass
 from typing import Optional
 from pathlib import Path
-from .utils import read_text, write_text, unified_diff, backup_file, restore_file, normalize_indent
+from .utils import backup_file, restore_file, normalize_indent, copy_range
+from .blobstore import BlobStore
+from .diffing import region_diff, multi_region_diff, file_diff, RegionEdit
+from .selectors import SpanSelection
+from .lineindex import record_splice
+
+# Líneas de contexto alrededor de la región en los diffs
+DIFF_CONTEXT = 3
+
+# Archivos a partir de este tamaño se empalman por offsets de bytes (memoria constante)
+STREAMING_THRESHOLD_BYTES = 1 << 20
 
 @dataclass
 class SpliceResult:
     ok: bool
     diff: str
     message: str
-    backup_path: Path
+    backup_path: Optional[Path]
+    backup_blob: Optional[str] = None
 
 def detect_base_indent(mid: str) -> str:
     for line in mid.splitlines():
@@ -18,17 +29,228 @@ def detect_base_indent(mid: str) -> str:
             return line[:len(line)-len(line.lstrip(' '))]
     return ""
 
-def splice_fragment(path: Path, pre: str, mid: str, post: str, new_fragment: str, keep_indent: bool = True) -> SpliceResult:
-    original = read_text(path)
-    backup = backup_file(path)
-    base_indent = detect_base_indent(mid) if keep_indent else ""
+def _backup(path: Path, store: Optional[BlobStore]) -> tuple[Optional[Path], Optional[str]]:
+    """Respaldo previo al empalme: blob direccionado por contenido o copia .bak (sin store)"""
+    if store is not None:
+        return None, store.put_file(path)
+    return backup_file(path), None
+
+def _restore(path: Path, backup: Optional[Path], blob: Optional[str], store: Optional[BlobStore]) -> None:
+    if blob is not None:
+        store.restore_to(blob, path)
+    else:
+        restore_file(backup, path)
+
+def _context_lines(f, start_byte: int, end_byte: int, n: int) -> tuple[list[str], list[str]]:
+    """Lee hasta n líneas completas antes de start_byte y después de end_byte"""
+    before: list[str] = []
+    if start_byte > 0:
+        pos, buf = start_byte, b""
+        while pos > 0 and buf.count(b"\n") <= n:
+            step = min(pos, 4096)
+            pos -= step
+            f.seek(pos)
+            buf = f.read(step) + buf
+        lines = buf.split(b"\n")[:-1]
+        if pos > 0:
+            lines = lines[1:]  # primera línea posiblemente incompleta
+        before = [l.rstrip(b"\r").decode("utf-8", errors="replace") for l in lines[-n:]]
+    f.seek(end_byte)
+    after = []
+    for _ in range(n):
+        raw = f.readline()
+        if not raw:
+            break
+        after.append(raw.rstrip(b"\r\n").decode("utf-8", errors="replace"))
+    return before, after
+
+def render_region(mid: bytes, new_fragment: str, keep_indent: bool = True) -> bytes:
+    """
+    Construye los bytes que sustituyen a la región `mid`.
+    Conserva el estilo de fin de línea de la región y su terminador final (también uno no
+    estándar, p. ej. FF o CR suelto, para no unir la región con la línea siguiente).
+    """
+    newline = b"\r\n" if b"\r\n" in mid else b"\n"
+    mid_text = mid.decode("utf-8")
+    if mid.endswith(b"\n"):
+        terminator = newline
+    else:
+        last = mid_text.splitlines(keepends=True)[-1] if mid_text else ""
+        terminator = last[len(last.splitlines()[0]):].encode("utf-8") if last else b""
     if keep_indent:
-        new_fragment = normalize_indent(new_fragment, base_indent)
-    updated = "\n".join(x for x in [pre, new_fragment, post] if x is not None)
-    diff = unified_diff(original, updated, fromfile=str(path), tofile=str(path))
+        new_fragment = normalize_indent(new_fragment, detect_base_indent(mid_text))
+    body = newline.join(line.encode("utf-8") for line in new_fragment.splitlines())
+    return body + terminator
+
+def write_spliced(path: Path, replacements: list[tuple[int, int, bytes]], dest: Optional[Path] = None) -> None:
+    """
+    Escribe el archivo con las regiones [(start_byte, end_byte, new_bytes)] reemplazadas en un
+    temporal del mismo directorio y lo renombra sobre `path` (o sobre `dest`, dejando `path`
+    intacto). Los tramos sin cambios se copian en kernel (copy_file_range/sendfile) desde los
+    offsets originales, así que las regiones posteriores no necesitan reajustar offsets por
+    los cambios de tamaño de las anteriores. El índice de líneas del resultado se registra
+    derivado del previo (record_splice), así el archivo recién escrito no se reescanea.
+    """
+    dest = dest or path
+    tmp_name = None
+    try:
+        with open(path, "rb") as src:
+            st = os.fstat(src.fileno())
+            size = st.st_size
+            fd, tmp_name = tempfile.mkstemp(dir=dest.parent, prefix=f".{dest.name}.", suffix=".splice")
+            with os.fdopen(fd, "wb") as dst:
+                src_fd = src.fileno()
+                pos = 0
+                for start_byte, end_byte, region in sorted(replacements, key=lambda r: r[0]):
+                    copy_range(src_fd, dst.fileno(), pos, start_byte - pos)
+                    dst.write(region)
+                    dst.flush()
+                    pos = end_byte
+                copy_range(src_fd, dst.fileno(), pos, size - pos)
+                os.fsync(dst.fileno())
+        shutil.copymode(path, tmp_name)
+        os.replace(tmp_name, dest)
+        tmp_name = None
+        record_splice(path, dest, replacements, (st.st_ino, st.st_size, st.st_mtime_ns))
+    finally:
+        if tmp_name and os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+
+def _diff_region(path: Path, mid: bytes, region: bytes, start_line: int,
+                 before: list[str], after: list[str]) -> str:
+    return region_diff(
+        mid.decode("utf-8", errors="replace").splitlines(),
+        region.decode("utf-8", errors="replace").splitlines(),
+        start_line - 1, fromfile=str(path), tofile=str(path),
+        before=before, after=after, n=DIFF_CONTEXT,
+    )
+
+def splice_byte_range(path: Path, start_byte: int, end_byte: int, new_fragment: str,
+                      keep_indent: bool = True, start_line: int = 1,
+                      store: Optional[BlobStore] = None, dest: Optional[Path] = None) -> SpliceResult:
+    """
+    Empalme por offsets de bytes para archivos grandes.
+    Prefijo y sufijo se copian en kernel (copy_file_range/sendfile) hacia un temporal
+    en el mismo directorio, que luego reemplaza al original con un rename atómico.
+    Solo la región reemplazada se mantiene en memoria.
+    Con `dest` el resultado se escribe ahí y `path` queda intacto (empalme preparado).
+    """
+    backup, blob = _backup(path, store)
     try:
-        write_text(path, updated)
-        return SpliceResult(True, diff, "Splice applied", backup)
+        with open(path, "rb") as src:
+            src.seek(start_byte)
+            mid = src.read(end_byte - start_byte)
+            before, after = _context_lines(src, start_byte, end_byte, DIFF_CONTEXT)
+        region = render_region(mid, new_fragment, keep_indent)
+        write_spliced(path, [(start_byte, end_byte, region)], dest=dest)
+        diff = _diff_region(path, mid, region, start_line, before, after)
+        return SpliceResult(True, diff, "Splice applied (streaming)", backup, blob)
     except Exception as e:
-        restore_file(backup, path)
-        return SpliceResult(False, "", f"Failed to write file: {e}", backup)
+        if dest is None:
+            _restore(path, backup, blob, store)
+        return SpliceResult(False, "", f"Failed to write file: {e}", backup, blob)
+
+def splice_span(path: Path, sel: SpanSelection, new_fragment: str, keep_indent: bool = True,
+                store: Optional[BlobStore] = None, dest: Optional[Path] = None) -> SpliceResult:
+    """
+    Empalme sobre una SpanSelection: indentación, diff y escritura leen solo la región
+    y sus líneas de contexto desde el buffer compartido; no se construyen pre/mid/post.
+    Con `dest` el resultado se escribe ahí y `path` queda intacto (empalme preparado).
+    """
+    backup, blob = _backup(path, store)
+    try:
+        mid = sel.mid_bytes
+        before, after = sel.lines_before(DIFF_CONTEXT), sel.lines_after(DIFF_CONTEXT)
+        sel.close()
+        region = render_region(mid, new_fragment, keep_indent)
+        write_spliced(path, [(sel.start_byte, sel.end_byte, region)], dest=dest)
+        diff = _diff_region(path, mid, region, sel.start_line, before, after)
+        return SpliceResult(True, diff, "Splice applied", backup, blob)
+    except Exception as e:
+        sel.close()
+        if dest is None:
+            _restore(path, backup, blob, store)
+        return SpliceResult(False, "", f"Failed to write file: {e}", backup, blob)
+
+def render_many(path: Path, sels: list[SpanSelection], fragments: list[str],
+                keep_indent: bool = True) -> tuple[list[tuple[int, int, bytes]], str]:
+    """
+    Fase de preparación de un empalme múltiple: renderiza cada región y el diff compuesto
+    sin tocar el archivo. Retorna (replacements, diff) y libera los buffers.
+    """
+    try:
+        replacements, edits = [], []
+        for sel, fragment in zip(sels, fragments):
+            mid = sel.mid_bytes
+            region = render_region(mid, fragment, keep_indent)
+            replacements.append((sel.start_byte, sel.end_byte, region))
+            edits.append(RegionEdit(
+                sel.start_line - 1,
+                mid.decode("utf-8", errors="replace").splitlines(),
+                region.decode("utf-8", errors="replace").splitlines(),
+                before=sel.lines_before(DIFF_CONTEXT),
+                after=sel.lines_after(2 * DIFF_CONTEXT),
+            ))
+    finally:
+        for sel in sels:
+            sel.close()
+    return replacements, multi_region_diff(edits, fromfile=str(path), tofile=str(path), n=DIFF_CONTEXT)
+
+def splice_many(path: Path, sels: list[SpanSelection], fragments: list[str], keep_indent: bool = True,
+                store: Optional[BlobStore] = None, dest: Optional[Path] = None) -> SpliceResult:
+    """
+    Aplica varios fragmentos sobre regiones no solapadas del mismo archivo con una sola
+    lectura y una sola escritura atómica. Si alguna región falla al renderizarse no se
+    escribe nada; el diff es compuesto y numerado con el delta acumulado de cada hunk.
+    """
+    backup, blob = _backup(path, store)
+    try:
+        replacements, diff = render_many(path, sels, fragments, keep_indent)
+        write_spliced(path, replacements, dest=dest)
+        return SpliceResult(True, diff, f"Splice applied ({len(sels)} hunks)", backup, blob)
+    except Exception as e:
+        if dest is None:
+            _restore(path, backup, blob, store)
+        return SpliceResult(False, "", f"Failed to write file: {e}", backup, blob)
+
+def stream_replace(src: Path, dest: Path) -> None:
+    """
+    Reemplaza `dest` con el contenido de `src`: copia en kernel hacia un temporal del mismo
+    directorio que `dest`, fsync y rename atómico (conserva los permisos de `dest`).
+    """
+    tmp_name = None
+    try:
+        with open(src, "rb") as source:
+            size = os.fstat(source.fileno()).st_size
+            fd, tmp_name = tempfile.mkstemp(dir=dest.parent, prefix=f".{dest.name}.", suffix=".replace")
+            with os.fdopen(fd, "wb") as out:
+                copy_range(source.fileno(), out.fileno(), 0, size)
+                os.fsync(out.fileno())
+        if dest.exists():
+            shutil.copymode(dest, tmp_name)
+        os.replace(tmp_name, dest)
+        tmp_name = None
+    finally:
+        if tmp_name and os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+
+def replace_file(path: Path, new_content_path: Path, store: Optional[BlobStore] = None,
+                 dest: Optional[Path] = None) -> SpliceResult:
+    """
+    Reemplazo completo del archivo (modo 'full-file-replace') en streaming: el diff se calcula
+    sobre las regiones que difieren (file_diff) y el contenido nuevo se copia en kernel.
+    Ninguna de las dos versiones se carga completa en memoria.
+    """
+    backup, blob = _backup(path, store)
+    try:
+        diff = file_diff(path, new_content_path, fromfile=str(path), tofile=str(path), n=DIFF_CONTEXT)
+        if dest is not None:
+            stream_replace(new_content_path, dest)
+            shutil.copymode(path, dest)
+        else:
+            stream_replace(new_content_path, path)
+        return SpliceResult(True, diff, "Full file replaced", backup, blob)
+    except Exception as e:
+        if dest is None:
+            _restore(path, backup, blob, store)
+        return SpliceResult(False, "", f"Failed to write file: {e}", backup, blob)
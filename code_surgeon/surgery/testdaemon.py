@@ -0,0 +1,148 @@
+"""
+Test Daemons (workers calientes de Jest/Vitest)
+Un proceso Node de larga vida por framework (surgery/node/test-worker.mjs) que carga Jest o
+Vitest una sola vez y recibe selecciones de tests por stdin. Cada cirugía paga solo la
+ejecución de sus tests, no npm + Node + carga del framework y su config.
+
+El worker se lanza en la primera corrida y vive hasta close(). Si no se puede usar (sin node,
+framework no instalado, crash o respuesta inválida) run() retorna None y TestRunner lanza el
+comando npm en frío; tras MAX_FAILURES fallos seguidos el daemon queda desactivado.
+"""
+from __future__ import annotations
+import os
+import json
+import queue
+import shutil
+import threading
+import subprocess
+from pathlib import Path
+from typing import Optional
+
+WORKER_SCRIPT = Path(__file__).parent / "node" / "test-worker.mjs"
+
+# Configuración de cada framework relativa a la raíz del proyecto
+FRAMEWORK_CONFIGS = {
+    "jest": "config/jest.config.cjs",
+    "vitest": "config/vitest.config.ts",
+}
+
+STARTUP_TIMEOUT = 120
+MAX_FAILURES = 2
+
+
+class DaemonTimeout(Exception):
+    """La corrida excedió el timeout; el worker se terminó"""
+
+
+class TestDaemon:
+    """Worker persistente de un framework de tests JavaScript"""
+
+    def __init__(self, framework: str, project_root: Path, log_dir: Optional[Path] = None):
+        self.framework = framework
+        self.project_root = project_root
+        self.log_path = (log_dir or project_root / "surgery" / "cache" / "workers") / f"{framework}.log"
+        self.failures = 0
+        self._proc: Optional[subprocess.Popen] = None
+        self._lines: queue.Queue = queue.Queue()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        """node en PATH, framework instalado en el proyecto y menos de MAX_FAILURES fallos"""
+        return (
+            self.failures < MAX_FAILURES
+            and shutil.which("node") is not None
+            and (self.project_root / "node_modules" / self.framework / "package.json").exists()
+            and (self.project_root / FRAMEWORK_CONFIGS[self.framework]).exists()
+        )
+
+    def run(self, test_paths: list[str], timeout: float) -> Optional[dict]:
+        """
+        Ejecuta `test_paths` en el worker y retorna {"ok", "tests_run", "tests_failed", "output"},
+        o None si el worker no está disponible (el llamador usa el spawn en frío).
+        Lanza DaemonTimeout si la corrida excede `timeout`.
+        """
+        with self._lock:
+            if not self.available:
+                return None
+            try:
+                self._ensure_started()
+                self._next_id += 1
+                self._send({"id": self._next_id, "files": test_paths})
+                response = self._receive(timeout)
+                while response.get("id") != self._next_id:  # respuesta tardía de una corrida anterior
+                    response = self._receive(timeout)
+            except DaemonTimeout:
+                self._stop()
+                raise
+            except (OSError, ValueError, RuntimeError):
+                self.failures += 1
+                self._stop()
+                return None
+            if "error" in response:
+                self.failures += 1
+                self._stop()
+                return None
+            self.failures = 0
+            return response
+
+    def _ensure_started(self) -> None:
+        if self._proc is not None and self._proc.poll() is None:
+            return
+        self.log_path.parent.mkdir(parents=True, exist_ok=True)
+        env = dict(os.environ)
+        if self.framework == "jest":
+            # Igual que test:unit: Jest con módulos ESM
+            env["NODE_OPTIONS"] = f"{env.get('NODE_OPTIONS', '')} --experimental-vm-modules".strip()
+        with open(self.log_path, "ab") as log:
+            self._proc = subprocess.Popen(
+                ["node", str(WORKER_SCRIPT), self.framework, str(self.project_root),
+                 str(self.project_root / FRAMEWORK_CONFIGS[self.framework])],
+                cwd=self.project_root, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=log, text=True, encoding="utf-8", bufsize=1
+            )
+        self._lines = queue.Queue()
+        threading.Thread(target=self._pump, args=(self._proc, self._lines), daemon=True).start()
+        try:
+            ready = self._receive(STARTUP_TIMEOUT)
+        except DaemonTimeout:
+            raise RuntimeError(f"{self.framework} worker no respondió al iniciar")
+        if not ready.get("ready"):
+            raise RuntimeError(ready.get("error", "worker no disponible"))
+
+    @staticmethod
+    def _pump(proc: subprocess.Popen, lines: queue.Queue) -> None:
+        """Hilo lector de stdout del worker; None marca el fin del proceso"""
+        for line in proc.stdout:
+            lines.put(line)
+        lines.put(None)
+
+    def _send(self, message: dict) -> None:
+        self._proc.stdin.write(json.dumps(message) + "\n")
+        self._proc.stdin.flush()
+
+    def _receive(self, timeout: float) -> dict:
+        try:
+            line = self._lines.get(timeout=timeout)
+        except queue.Empty:
+            raise DaemonTimeout(f"{self.framework} worker excedió {timeout:.0f}s")
+        if line is None:
+            raise RuntimeError(f"{self.framework} worker terminó (ver {self.log_path})")
+        return json.loads(line)
+
+    def _stop(self) -> None:
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        try:
+            proc.stdin.close()
+            proc.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            proc.kill()
+            proc.wait()
+
+    def close(self) -> None:
+        """Termina el worker (cerrando stdin; kill si no sale)"""
+        with self._lock:
+            self._stop()
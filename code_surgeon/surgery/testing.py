@@ -4,12 +4,20 @@ Garantiza que después de cada modificación se ejecuten los tests correspondien
 Basado en mejores prácticas: Continuous Testing + Fail-Fast + Test Impact Analysis.
 """
 from __future__ import annotations
+import os
 import json
+import time
 import subprocess
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Optional
 from .utils import read_text
+from .importgraph import ImportGraph
+from .coverage import CoverageIndex
+from .digests import process_cache
+from .resultcache import ResultCache, ENVIRONMENT_FILES, cache_key
+from .testdaemon import TestDaemon, DaemonTimeout
 
 @dataclass
 class TestResult:
@@ -20,15 +28,48 @@ class TestResult:
     tests_run: int
     tests_failed: int
     duration_seconds: float
+    cached: bool = False  # resultado reutilizado de ResultCache (sin ejecutar)
+    # framework -> {ok, exit_code, tests_run, tests_failed, duration_seconds} si hubo más de uno
+    breakdown: dict[str, dict] = field(default_factory=dict)
     
     def summary(self) -> str:
         status = "✅ PASS" if self.ok else "❌ FAIL"
+        parts = ", ".join(
+            f"{'✅' if item['ok'] else '❌'} {name}: {item['tests_run']} tests, {item['tests_failed']} failed"
+            for name, item in self.breakdown.items()
+        )
         return (
             f"{status} - {self.tests_run} tests, {self.tests_failed} failed "
-            f"({self.duration_seconds:.2f}s)"
+            f"({self.duration_seconds:.2f}s{', cache' if self.cached else ''})"
+            + (f" | {parts}" if parts else "")
         )
 
 
+def framework_for(test_path: str) -> str:
+    """Framework que ejecuta un test o directorio de tests; 'npm' = npm run test:all"""
+    path = test_path.replace("\\", "/")
+    if "backend" in path:
+        return "jest"
+    if "frontend" in path:
+        return "vitest"
+    if path.endswith(".py"):
+        return "pytest"
+    if "e2e" in path or path.endswith(".spec.ts"):
+        return "playwright"
+    return "npm"
+
+
+def default_concurrency() -> int:
+    """
+    Frameworks ejecutados a la vez: la mitad de los CPUs, porque cada framework lanza a su vez
+    sus propios workers (CODE_SURGEON_TEST_CONCURRENCY lo fija)
+    """
+    try:
+        return max(1, int(os.environ["CODE_SURGEON_TEST_CONCURRENCY"]))
+    except (KeyError, ValueError):
+        return max(1, (os.cpu_count() or 2) // 2)
+
+
 class TestRegistry:
     """
     Mapea archivos de código a sus tests correspondientes
@@ -38,7 +79,17 @@ class TestRegistry:
     def __init__(self, project_root: Path):
         self.project_root = project_root
         self.test_config_path = project_root / "code_surgeon" / "test_mapping.json"
+        self._mapping_signature = self._config_signature()
         self.mapping = self._load_mapping()
+        self.graph = ImportGraph(project_root, project_root / "surgery" / "cache" / "import_graph.json")
+        self.coverage = CoverageIndex(project_root)
+    
+    def _config_signature(self) -> Optional[tuple[int, int]]:
+        try:
+            st = self.test_config_path.stat()
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
     
     def _load_mapping(self) -> dict:
         """Carga mapeo de archivos -> tests desde JSON"""
@@ -46,29 +97,63 @@ class TestRegistry:
             return json.loads(read_text(self.test_config_path))
         return {}
     
+    def refresh(self) -> None:
+        """Recarga el mapeo si test_mapping.json cambió (registros de larga vida, SurgeonSession)"""
+        signature = self._config_signature()
+        if signature != self._mapping_signature:
+            self._mapping_signature = signature
+            self.mapping = self._load_mapping()
+    
     def get_tests_for_file(self, file_path: Path) -> list[str]:
         """
         Retorna lista de archivos de test que deben ejecutarse para un archivo dado
         
         Estrategia multi-nivel:
         1. Mapping explícito (test_mapping.json)
-        2. Convenciones estándar (server/app.js -> tests/backend/app.test.js)
-        3. Test de integración por defecto si no se encuentra nada
+        2. Grafo de imports: tests que importan el archivo de forma transitiva (más los de
+           convención); si el grafo conoce el archivo, el resultado es exacto aunque sea vacío
+        3. Convenciones estándar (server/app.js -> tests/backend/app.test.js)
+        4. Test de integración por defecto si no se encuentra nada
         """
+        self.refresh()
         relative_path = str(file_path.relative_to(self.project_root))
         
         # 1. Buscar en mapping explícito
         if relative_path in self.mapping:
             return self.mapping[relative_path]
         
-        # 2. Aplicar convenciones estándar
+        # 2-3. Grafo de imports y convenciones estándar
         tests = self._infer_tests_by_convention(file_path)
+        impacted = self.graph.tests_for(file_path)
+        if impacted is not None:
+            return list(dict.fromkeys(impacted + [t.replace("\\", "/") for t in tests]))
         if tests:
             return tests
         
-        # 3. Fallback a test suite completo por categoría
+        # 4. Fallback a test suite completo por categoría
         return self._get_category_tests(file_path)
     
+    def get_tests_for_region(self, file_path: Path, regions: list[tuple[int, int]],
+                             file_hash: str) -> list[str]:
+        """
+        Tests para un empalme de las líneas `regions` ([(inicio, fin)] sobre el archivo original
+        con hash `file_hash`). El mapping explícito manda; luego la cobertura por línea
+        (surgery/coverage.db) si todas las regiones tienen tests que las ejecutan y la cobertura
+        se tomó sobre este mismo contenido. Si no, la selección por archivo.
+        """
+        self.refresh()
+        relative_path = str(file_path.relative_to(self.project_root))
+        if relative_path in self.mapping:
+            return self.mapping[relative_path]
+        
+        tests = []
+        for start_line, end_line in regions:
+            covering = self.coverage.tests_for_lines(file_path, start_line, end_line, file_hash)
+            if covering is None:
+                return self.get_tests_for_file(file_path)
+            tests.extend(covering)
+        return list(dict.fromkeys(tests))
+    
     def _infer_tests_by_convention(self, file_path: Path) -> list[str]:
         """
         Infiere tests basado en convenciones del proyecto
@@ -132,21 +217,42 @@ class TestRegistry:
         self.test_config_path.parent.mkdir(parents=True, exist_ok=True)
         with open(self.test_config_path, 'w', encoding='utf-8') as f:
             json.dump(self.mapping, f, indent=2, ensure_ascii=False)
+        self._mapping_signature = self._config_signature()
 
 
 class TestRunner:
     """Ejecutor de tests con soporte para múltiples frameworks"""
     
-    def __init__(self, project_root: Path):
+    def __init__(self, project_root: Path, results: Optional[ResultCache] = None, daemons: bool = False):
+        """
+        `daemons=True` ejecuta Jest/Vitest en workers persistentes (ver testdaemon.py); solo
+        conviene en procesos de larga vida como el watcher, que deben llamar a close().
+        """
         self.project_root = project_root
         self.registry = TestRegistry(project_root)
+        self.results = results or ResultCache(project_root / "surgery" / "cache" / "test_results")
+        self.use_daemons = daemons
+        self._daemons: dict[str, TestDaemon] = {}
+        self.max_parallel = default_concurrency()
+    
+    def close(self) -> None:
+        """Termina los workers de tests persistentes"""
+        for daemon in self._daemons.values():
+            daemon.close()
+        self._daemons.clear()
     
-    def run_tests_for_file(self, file_path: Path) -> TestResult:
+    def run_tests_for_file(self, file_path: Path, regions: Optional[list[tuple[int, int]]] = None,
+                           file_hash: Optional[str] = None, use_cache: bool = True) -> TestResult:
         """
         Ejecuta los tests correspondientes a un archivo modificado
+        Con `regions` y `file_hash` (líneas empalmadas y hash previo) selecciona por cobertura.
+        `use_cache=False` ejecuta siempre (suites inestables).
         Retorna resultado agregado de todos los tests
         """
-        test_paths = self.registry.get_tests_for_file(file_path)
+        if regions and file_hash:
+            test_paths = self.registry.get_tests_for_region(file_path, regions, file_hash)
+        else:
+            test_paths = self.registry.get_tests_for_file(file_path)
         
         if not test_paths:
             return TestResult(
@@ -159,35 +265,144 @@ class TestRunner:
             )
         
         # Ejecutar tests según el tipo de archivo
-        return self._run_test_suite(test_paths)
+        return self._run_cached(test_paths, [file_path], use_cache)
+    
+    def get_tests_for_files(self, file_paths: list[Path]) -> list[str]:
+        """
+        Unión (sin duplicados) de los tests de varios archivos.
+        Tests ya cubiertos por un directorio completo de la unión se omiten.
+        """
+        tests = list(dict.fromkeys(
+            test for file_path in file_paths for test in self.registry.get_tests_for_file(file_path)
+        ))
+        dirs = [t for t in tests if not Path(t).suffix]
+        return [
+            t for t in tests
+            if not any(t != d and Path(t).is_relative_to(d) for d in dirs)
+        ]
+    
+    def run_tests_for_files(self, file_paths: list[Path], use_cache: bool = True) -> TestResult:
+        """
+        Ejecuta una sola vez la unión de tests de varios archivos modificados
+        (transacciones multi-archivo)
+        """
+        test_paths = self.get_tests_for_files(file_paths)
+        
+        if not test_paths:
+            return TestResult(
+                ok=True,
+                output="⚠️  No se encontraron tests específicos. Considera agregar tests.",
+                exit_code=0,
+                tests_run=0,
+                tests_failed=0,
+                duration_seconds=0.0
+            )
+        
+        return self._run_cached(test_paths, file_paths, use_cache)
+    
+    def _run_cached(self, test_paths: list[str], changed: list[Path], use_cache: bool) -> TestResult:
+        """
+        Retorna el resultado guardado si los tests y todo lo que cargan tienen el mismo contenido
+        que en una corrida anterior; si no, ejecuta y guarda (salvo timeouts y errores del runner).
+        """
+        key = self._result_key(test_paths, changed) if use_cache and self.results.enabled else None
+        if key:
+            hit = self.results.get(key)
+            if hit is not None:
+                return TestResult(**{**hit, "cached": True})
+        
+        result = self._run_test_suite(test_paths)
+        if key and result.exit_code != -1:
+            self.results.put(key, result)
+        return result
+    
+    def _result_key(self, test_paths: list[str], changed: list[Path]) -> Optional[str]:
+        """Clave de contenido de una corrida, o None si sus dependencias no se pueden determinar"""
+        try:
+            rels = [Path(f).resolve().relative_to(self.project_root.resolve()).as_posix() for f in changed]
+        except ValueError:
+            return None
+        environment = [name for name in ENVIRONMENT_FILES if (self.project_root / name).exists()]
+        closure = self.registry.graph.dependency_closure(list(test_paths) + rels + environment)
+        if closure is None:
+            return None
+        digests = process_cache()
+        try:
+            return cache_key(test_paths, {rel: digests.digest(self.project_root / rel) for rel in closure})
+        except (OSError, UnicodeDecodeError):
+            return None
     
     def _run_test_suite(self, test_paths: list[str]) -> TestResult:
         """
         Ejecuta suite de tests usando el runner apropiado
-        Detecta automáticamente: Jest (backend), Vitest (frontend), pytest (Python)
+        Detecta automáticamente: Jest (backend), Vitest (frontend), pytest (Python), Playwright (e2e).
+        Una selección mixta se agrupa por framework y los grupos corren en paralelo (hasta
+        `max_parallel`); el resultado agrega todos con el detalle por framework en `breakdown`.
         """
-        import time
-        
         start_time = time.time()
         
-        # Determinar runner basado en la ubicación de los tests
-        if any("backend" in path for path in test_paths):
+        groups: dict[str, list[str]] = {}
+        for path in test_paths:
+            groups.setdefault(framework_for(path), []).append(path)
+        if "npm" in groups:
+            # Tests sin framework reconocible: npm run test:all ya cubre todos los demás
+            groups = {"npm": groups["npm"]}
+        
+        if len(groups) == 1:
+            framework, paths = next(iter(groups.items()))
+            result = self._run_framework(framework, paths)
+        else:
+            with ThreadPoolExecutor(max_workers=min(len(groups), self.max_parallel)) as pool:
+                futures = {name: pool.submit(self._run_framework, name, paths) for name, paths in groups.items()}
+                result = _merge_results({name: future.result() for name, future in futures.items()})
+        
+        result.duration_seconds = time.time() - start_time
+        
+        return result
+    
+    def _run_framework(self, framework: str, test_paths: list[str]) -> TestResult:
+        start_time = time.time()
+        if framework == "jest":
             result = self._run_jest(test_paths)
-        elif any("frontend" in path for path in test_paths):
+        elif framework == "vitest":
             result = self._run_vitest(test_paths)
-        elif any(path.endswith(".py") for path in test_paths):
+        elif framework == "pytest":
             result = self._run_pytest(test_paths)
+        elif framework == "playwright":
+            result = self._run_playwright(test_paths)
         else:
             # Ejecutar npm run test:all como fallback
             result = self._run_npm_script("test:all")
-        
-        duration = time.time() - start_time
-        result.duration_seconds = duration
-        
+        result.duration_seconds = time.time() - start_time
         return result
     
+    def _run_in_daemon(self, framework: str, test_paths: list[str]) -> Optional[TestResult]:
+        """Ejecuta en el worker persistente del framework; None si hay que lanzar en frío"""
+        if not self.use_daemons:
+            return None
+        daemon = self._daemons.get(framework)
+        if daemon is None:
+            daemon = self._daemons[framework] = TestDaemon(framework, self.project_root)
+        try:
+            response = daemon.run(test_paths, timeout=60)
+        except DaemonTimeout:
+            return TestResult(False, "❌ Timeout ejecutando tests (>60s)", -1, 0, 0, 60.0)
+        if response is None:
+            return None
+        return TestResult(
+            ok=response["ok"],
+            output=response["output"],
+            exit_code=0 if response["ok"] else 1,
+            tests_run=response["tests_run"],
+            tests_failed=response["tests_failed"],
+            duration_seconds=0.0
+        )
+    
     def _run_jest(self, test_paths: list[str]) -> TestResult:
-        """Ejecuta tests backend con Jest"""
+        """Ejecuta tests backend con Jest (worker persistente si está habilitado)"""
+        warm = self._run_in_daemon("jest", test_paths)
+        if warm is not None:
+            return warm
         try:
             cmd = ["npm", "run", "test:backend", "--", "--silent"]
             
@@ -210,7 +425,10 @@ class TestRunner:
             return TestResult(False, f"❌ Error ejecutando Jest: {e}", -1, 0, 0, 0.0)
     
     def _run_vitest(self, test_paths: list[str]) -> TestResult:
-        """Ejecuta tests frontend con Vitest"""
+        """Ejecuta tests frontend con Vitest (worker persistente si está habilitado)"""
+        warm = self._run_in_daemon("vitest", test_paths)
+        if warm is not None:
+            return warm
         try:
             cmd = ["npm", "run", "test:frontend", "--", "--run"]
             
@@ -250,6 +468,28 @@ class TestRunner:
         except Exception as e:
             return TestResult(False, f"❌ Error ejecutando pytest: {e}", -1, 0, 0, 0.0)
     
+    def _run_playwright(self, test_paths: list[str]) -> TestResult:
+        """Ejecuta tests e2e con Playwright (npm run test:e2e incluye el build previo)"""
+        try:
+            cmd = ["npm", "run", "test:e2e", "--", "--reporter=line"]
+            
+            if not any(path == "tests/e2e" for path in test_paths):
+                cmd.extend(test_paths)
+            
+            result = subprocess.run(
+                cmd,
+                cwd=self.project_root,
+                capture_output=True,
+                text=True,
+                timeout=300
+            )
+            
+            return self._parse_playwright_output(result)
+        except subprocess.TimeoutExpired:
+            return TestResult(False, "❌ Timeout ejecutando tests (>300s)", -1, 0, 0, 300.0)
+        except Exception as e:
+            return TestResult(False, f"❌ Error ejecutando Playwright: {e}", -1, 0, 0, 0.0)
+    
     def _run_npm_script(self, script: str) -> TestResult:
         """Ejecuta script de npm genérico"""
         try:
@@ -363,3 +603,56 @@ class TestRunner:
             tests_failed=0 if result.returncode == 0 else 1,
             duration_seconds=0.0
         )
+    
+    def _parse_playwright_output(self, result: subprocess.CompletedProcess) -> TestResult:
+        """Parser de output de Playwright"""
+        output = result.stdout + result.stderr
+        
+        # Playwright format: "  1 failed" / "  5 passed (12.3s)"
+        import re
+        passed = re.search(r"^\s*(\d+)\s+passed", output, re.MULTILINE)
+        failed = re.search(r"^\s*(\d+)\s+failed", output, re.MULTILINE)
+        
+        if passed or failed:
+            failed_count = int(failed.group(1)) if failed else 0
+            
+            return TestResult(
+                ok=(result.returncode == 0),
+                output=output,
+                exit_code=result.returncode,
+                tests_run=(int(passed.group(1)) if passed else 0) + failed_count,
+                tests_failed=failed_count,
+                duration_seconds=0.0
+            )
+        
+        return TestResult(
+            ok=(result.returncode == 0),
+            output=output,
+            exit_code=result.returncode,
+            tests_run=0,
+            tests_failed=0 if result.returncode == 0 else 1,
+            duration_seconds=0.0
+        )
+
+
+def _merge_results(results: dict[str, TestResult]) -> TestResult:
+    """Agrega los resultados de varios frameworks en uno solo con `breakdown` por framework"""
+    exit_codes = [r.exit_code for r in results.values()]
+    return TestResult(
+        ok=all(r.ok for r in results.values()),
+        output="\n".join(f"── {name} ──\n{r.output}" for name, r in results.items()),
+        exit_code=-1 if -1 in exit_codes else next((c for c in exit_codes if c != 0), 0),
+        tests_run=sum(r.tests_run for r in results.values()),
+        tests_failed=sum(r.tests_failed for r in results.values()),
+        duration_seconds=0.0,
+        breakdown={
+            name: {
+                "ok": r.ok,
+                "exit_code": r.exit_code,
+                "tests_run": r.tests_run,
+                "tests_failed": r.tests_failed,
+                "duration_seconds": r.duration_seconds
+            }
+            for name, r in results.items()
+        }
+    )
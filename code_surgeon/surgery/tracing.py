@@ -0,0 +1,112 @@
+"""
+Phase Tracing
+Mide cada fase de una cirugía (selección, empalme, registro, tests, post_cmd) con
+perf_counter_ns y opcionalmente las agrega a un trace JSONL (una línea por cirugía).
+El trace se convierte al formato Chrome trace-event para verlo como flame chart
+(chrome://tracing, Perfetto o speedscope).
+"""
+from __future__ import annotations
+import os
+import sys
+import json
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+# Si está definida, cada cirugía se agrega a este archivo JSONL
+TRACE_ENV = "CODE_SURGEON_TRACE"
+
+
+class PhaseTimer:
+    """Cronómetro de fases de una cirugía"""
+
+    def __init__(self):
+        self.wall_start_us = time.time_ns() // 1000
+        self._origin = time.perf_counter_ns()
+        self.phases: list[tuple[str, int, int]] = []  # (nombre, inicio relativo ns, duración ns)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.phases.append((name, start - self._origin, time.perf_counter_ns() - start))
+
+    def elapsed_ns(self) -> int:
+        return time.perf_counter_ns() - self._origin
+
+    def as_dict(self) -> dict:
+        """Bloque `timings` del resultado: milisegundos por fase (acumulados si se repite) y total"""
+        timings: dict[str, float] = {}
+        for name, _, duration in self.phases:
+            timings[name] = timings.get(name, 0.0) + duration / 1e6
+        timings = {name: round(ms, 3) for name, ms in timings.items()}
+        timings["total"] = round(self.elapsed_ns() / 1e6, 3)
+        return timings
+
+    def append_trace(self, trace_path: Path, **meta) -> None:
+        """Agrega una línea JSON al trace (append atómico por línea en POSIX)"""
+        entry = {
+            "ts_us": self.wall_start_us,
+            "pid": os.getpid(),
+            "total_ns": self.elapsed_ns(),
+            "phases": [list(p) for p in self.phases],
+            **meta
+        }
+        trace_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(trace_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def trace_path_from_env() -> Optional[Path]:
+    value = os.environ.get(TRACE_ENV)
+    return Path(value) if value else None
+
+
+def to_chrome_trace(trace_path: Path) -> dict:
+    """
+    Convierte un trace JSONL a Chrome trace-event: un evento "X" por cirugía y uno por fase
+    anidado debajo. Cada proceso (una ejecución del watcher = un pid) es una pista propia.
+    """
+    events = []
+    with open(trace_path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            base = entry["ts_us"]
+            args = {k: v for k, v in entry.items() if k not in ("ts_us", "pid", "total_ns", "phases")}
+            events.append({
+                "name": Path(entry.get("file", "execute")).name,
+                "cat": "surgery",
+                "ph": "X",
+                "ts": base,
+                "dur": entry["total_ns"] / 1000,
+                "pid": entry["pid"],
+                "tid": 0,
+                "args": args
+            })
+            for name, start_ns, duration_ns in entry["phases"]:
+                events.append({
+                    "name": name,
+                    "cat": "phase",
+                    "ph": "X",
+                    "ts": base + start_ns / 1000,
+                    "dur": duration_ns / 1000,
+                    "pid": entry["pid"],
+                    "tid": 0
+                })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        print("Uso: surgery-trace.py <trace.jsonl> <salida.json>", file=sys.stderr)
+        return 2
+    chrome = to_chrome_trace(Path(argv[0]))
+    Path(argv[1]).write_text(json.dumps(chrome), encoding="utf-8")
+    print(f"✅ {len(chrome['traceEvents'])} eventos escritos en {argv[1]}")
+    return 0
@@ -10,7 +10,21 @@ def write_text(p: Path, content: str) -> None:
     p.parent.mkdir(parents=True, exist_ok=True)
     p.write_text(content, encoding="utf-8")
 
-def sha256(s: str) -> str:
+def atomic_write_text(p: Path, content: str) -> None:
+    """Escritura durable: temporal en el mismo directorio + fsync + rename atómico"""
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_name(f".{p.name}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, p)
+
+def sha256(s: str | Path, cache=None) -> str:
+    """sha256 de un texto, o de un archivo vía DigestCache (sin releer archivos sin cambios)"""
+    if isinstance(s, Path):
+        from .digests import process_cache
+        return (cache or process_cache()).digest(s)
     return hashlib.sha256(s.encode("utf-8")).hexdigest()
 
 def unified_diff(a: str, b: str, fromfile: str, tofile: str) -> str:
@@ -24,6 +38,47 @@ def backup_file(p: Path) -> Path:
 def restore_file(src: Path, dst: Path) -> None:
     shutil.copy2(src, dst)
 
+def copy_range(src_fd: int, dst_fd: int, offset: int, count: int) -> None:
+    """
+    Copia `count` bytes de src_fd (desde `offset`) a la posición actual de dst_fd.
+    Usa copy_file_range/sendfile (copia en kernel) y cae a pread/write por bloques
+    cuando el sistema de archivos o la plataforma no los soportan.
+    """
+    remaining = count
+    pos = offset
+    for copier in (_copy_file_range, _sendfile):
+        try:
+            while remaining > 0:
+                n = copier(src_fd, dst_fd, pos, remaining)
+                if n <= 0:
+                    break
+                pos += n
+                remaining -= n
+            if remaining <= 0:
+                return
+        except (AttributeError, OSError):
+            continue
+    while remaining > 0:
+        chunk = read_at(src_fd, pos, min(remaining, 1 << 20))
+        if not chunk:
+            raise OSError(f"Unexpected EOF copying range at offset {pos}")
+        os.write(dst_fd, chunk)
+        pos += len(chunk)
+        remaining -= len(chunk)
+
+def _copy_file_range(src_fd: int, dst_fd: int, pos: int, count: int) -> int:
+    return os.copy_file_range(src_fd, dst_fd, count, pos)
+
+def _sendfile(src_fd: int, dst_fd: int, pos: int, count: int) -> int:
+    return os.sendfile(dst_fd, src_fd, pos, count)
+
+def read_at(fd: int, pos: int, count: int) -> bytes:
+    """Hasta `count` bytes de fd desde `pos`: pread, o lseek+read donde no existe (Windows)"""
+    if hasattr(os, "pread"):
+        return os.pread(fd, count, pos)
+    os.lseek(fd, pos, os.SEEK_SET)
+    return os.read(fd, count)
+
 def find_line_numbers(text: str, pattern: str) -> List[int]:
     rx = re.compile(pattern)
     return [i for i, line in enumerate(text.splitlines(), 1) if rx.search(line)]
@@ -2,17 +2,26 @@
 Test Suite para Code Surgeon - Rollback y Testing System
 Valida que los nuevos componentes funcionen correctamente
 """
+import os
+import json
+import time
 import unittest
 import tempfile
 import shutil
+import subprocess
+import threading
 import sys
+from unittest import mock
 from pathlib import Path
 
 # Añadir code_surgeon al path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from surgery.rollback import RollbackManager, ChangeRecord
-from surgery.testing import TestRegistry, TestRunner
+from surgery.blobstore import BlobStore
+from surgery.digests import DigestCache, text_digest
+from surgery.testing import TestRegistry, TestRunner, TestResult
+from surgery.testdaemon import FRAMEWORK_CONFIGS, MAX_FAILURES
 
 class TestRollbackSystem(unittest.TestCase):
     """Tests para el sistema de rollback"""
@@ -179,6 +188,460 @@ class TestRollbackSystem(unittest.TestCase):
         self.assertEqual(len(issues), 1)
         self.assertEqual(issues[0]["issue"], "HASH_MISMATCH")
 
+    def test_rollback_from_blob_store(self):
+        """Verifica rollback restaurando bytes exactos desde el BlobStore"""
+        original_bytes = b"def foo():\r\n    return 'original'\r\n"
+        self.test_file.write_bytes(original_bytes)
+        original_blob = self.mgr.blobs.put_file(self.test_file)
+        updated_content = "def foo():\n    return 'updated'\n"
+        self.test_file.write_text(updated_content)
+        
+        record = ChangeRecord.create(
+            file_path=self.test_file,
+            original=original_bytes.decode().replace("\r\n", "\n"),
+            updated=updated_content,
+            mode="line-range",
+            start="1",
+            end="2",
+            backup_path=None,
+            original_blob=original_blob,
+            new_blob=self.mgr.blobs.put_file(self.test_file)
+        )
+        self.mgr.record_change(record)
+        
+        # El contenido no se duplica en el JSON
+        self.assertEqual(record.original_content, "")
+        self.assertEqual(self.mgr.new_content(record), updated_content)
+        
+        success, _ = self.mgr.rollback_last(self.test_file)
+        
+        self.assertTrue(success)
+        self.assertEqual(self.test_file.read_bytes(), original_bytes)
+
+
+class TestBlobStore(unittest.TestCase):
+    """Tests para el almacén de blobs direccionado por contenido"""
+    
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.store = BlobStore(self.test_dir / "blobs")
+    
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+    
+    def test_put_deduplicates(self):
+        """Verifica que contenidos idénticos se guarden una sola vez"""
+        source = self.test_dir / "a.js"
+        source.write_bytes(b"console.log('x');\n" * 100)
+        
+        d1 = self.store.put_file(source)
+        d2 = self.store.put(source.read_bytes())
+        
+        self.assertEqual(d1, d2)
+        blobs = [f for f in (self.test_dir / "blobs").rglob("*") if f.is_file()]
+        self.assertEqual(len(blobs), 1)
+        self.assertLess(blobs[0].stat().st_size, source.stat().st_size)
+    
+    def test_blobs_are_durable_before_publish(self):
+        """Verifica fsync del temporal antes del rename y del directorio del blob después"""
+        import stat
+        source = self.test_dir / "a.js"
+        source.write_bytes(b"console.log('y');\n" * 100)
+        events = []
+        real_fsync, real_replace = os.fsync, os.replace
+        
+        def fsync(fd):
+            events.append("dir" if stat.S_ISDIR(os.fstat(fd).st_mode) else "file")
+            real_fsync(fd)
+        
+        def replace(src, dst):
+            events.append("replace")
+            real_replace(src, dst)
+        
+        for put in (lambda: self.store.put_file(source), lambda: self.store.put(b"otro contenido\n")):
+            events.clear()
+            with mock.patch("surgery.blobstore.os.fsync", side_effect=fsync), \
+                 mock.patch("surgery.blobstore.os.replace", side_effect=replace):
+                put()
+            self.assertIn("file", events[:events.index("replace")])
+            if os.name != "nt":
+                self.assertEqual(events[events.index("replace"):], ["replace", "dir"])
+    
+    def test_restore_roundtrip(self):
+        """Verifica restauración atómica del contenido exacto"""
+        data = bytes(range(256)) * 50
+        digest = self.store.put(data)
+        target = self.test_dir / "restored.bin"
+        
+        self.store.restore_to(digest, target)
+        
+        self.assertEqual(target.read_bytes(), data)
+        self.assertEqual(self.store.get(digest), data)
+    
+    def test_deltify_reconstructs_exact_content(self):
+        """Verifica que un blob deltificado se reconstruya byte a byte desde su base"""
+        lines = [f"line {i}: {'x' * (i % 40)}\n".encode() for i in range(2000)]
+        newer = b"".join(lines)
+        lines[10] = b"edited near the top\n"
+        lines[1500:1502] = [b"replaced block\n"]
+        older = b"".join(lines)
+        old_digest, new_digest = self.store.put(older), self.store.put(newer)
+        full_size = self.store.path_for(old_digest).stat().st_size
+        
+        self.assertTrue(self.store.deltify(old_digest, new_digest))
+        
+        self.assertLess(self.store.path_for(old_digest).stat().st_size, full_size)
+        self.assertEqual(self.store.chain(old_digest), [new_digest])
+        self.assertEqual(self.store.get(old_digest), older)
+        target = self.test_dir / "restored.txt"
+        self.store.restore_to(old_digest, target)
+        self.assertEqual(target.read_bytes(), older)
+        # Sin ciclos: la base no puede volverse delta de su propio delta
+        self.assertFalse(self.store.deltify(new_digest, old_digest))
+    
+    def test_large_files_are_not_deltified_on_record(self):
+        """Verifica que record_change no deltifique en memoria archivos del tamaño de streaming"""
+        from surgery.splicer import STREAMING_THRESHOLD_BYTES
+        mgr = RollbackManager(self.test_dir / "surgery")
+        target = self.test_dir / "big.js"
+        line = b"const value = 'abcdefghijklmnopqrstuvwxyz';\n"
+        older = line * (STREAMING_THRESHOLD_BYTES // len(line) + 1)
+        newer = b"// header\n" + older
+        target.write_bytes(newer)
+        for i in range(2):
+            record = ChangeRecord.create(
+                target, None, None, "line-range", "1", "1", None,
+                original_blob=mgr.blobs.put(older), new_blob=mgr.blobs.put(newer),
+                original_hash=f"{i}", digests=mgr.digests
+            )
+            with mock.patch.object(mgr.blobs, "deltify", side_effect=AssertionError("deltify en record_change")):
+                mgr.record_change(record)
+        self.assertIsNone(mgr.blobs.delta_base(record.original_blob))
+        mgr.index.close()
+    
+    def test_history_chains_are_bounded_by_snapshots(self):
+        """Verifica reverse deltas en el historial con snapshots periódicos y rollback exacto"""
+        from surgery.rollback import SNAPSHOT_INTERVAL
+        mgr = RollbackManager(self.test_dir / "surgery")
+        target = self.test_dir / "app.js"
+        versions = [
+            "".join(f"const v{i} = {i if i != n % 50 else -n};\n" for i in range(500))
+            for n in range(SNAPSHOT_INTERVAL * 2 + 3)
+        ]
+        for older, newer in zip(versions, versions[1:]):
+            record = ChangeRecord.create(
+                target, older, newer, "line-range", "1", "1", None,
+                original_blob=mgr.blobs.put(older.encode()), new_blob=mgr.blobs.put(newer.encode())
+            )
+            mgr.record_change(record)
+        
+        history = mgr.get_history(target)
+        self.assertTrue(all(len(mgr.blobs.chain(r.original_blob)) <= SNAPSHOT_INTERVAL for r in history))
+        self.assertTrue(any(mgr.blobs.delta_base(r.original_blob) for r in history))
+        self.assertEqual([mgr.original_content(r) for r in reversed(history)], versions[:-1])
+        
+        # La versión más antigua se reconstruye recorriendo toda su cadena de deltas
+        target.write_text(versions[1])
+        ok, _ = mgr.rollback_to_record(history[-1])
+        self.assertTrue(ok)
+        self.assertEqual(target.read_text(), versions[0])
+        mgr.index.close()
+
+
+class TestDigestCache(unittest.TestCase):
+    """Tests para el cache de digests por firma de stat"""
+    
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.cache_path = self.test_dir / "cache" / "digests.json"
+        self.target = self.test_dir / "app.js"
+        self.target.write_text("const a = 1;\n")
+        past = __import__("time").time() - 60
+        __import__("os").utime(self.target, (past, past))
+    
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+    
+    def test_matches_text_hash(self):
+        """Verifica compatibilidad con los hashes de ChangeRecord"""
+        import hashlib
+        cache = DigestCache(self.cache_path)
+        
+        self.assertEqual(cache.digest(self.target), hashlib.sha256(b"const a = 1;\n").hexdigest())
+    
+    def test_unchanged_file_not_rehashed(self):
+        """Verifica que un archivo sin cambios no se vuelva a leer entre procesos"""
+        from unittest import mock
+        cache = DigestCache(self.cache_path)
+        expected = cache.digest(self.target)
+        cache.flush()
+        
+        reloaded = DigestCache(self.cache_path)
+        with mock.patch("surgery.digests.text_digest") as rehash:
+            self.assertEqual(reloaded.digest(self.target), expected)
+            rehash.assert_not_called()
+    
+    def test_modified_file_rehashed(self):
+        """Verifica invalidación cuando cambia la firma"""
+        cache = DigestCache(self.cache_path)
+        first = cache.digest(self.target)
+        self.target.write_text("const a = 2;\n")
+        
+        self.assertNotEqual(cache.digest(self.target), first)
+
+
+class TestHistoryIndex(unittest.TestCase):
+    """Tests para el índice SQLite del historial"""
+    
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.history_dir = self.test_dir / "surgery"
+        self.files = [self.test_dir / f"f{i}.py" for i in range(3)]
+        for f in self.files:
+            f.write_text("x = 1\n")
+    
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+    
+    def legacy_record(self, target: Path, i: int) -> ChangeRecord:
+        record = ChangeRecord.create(target, "x = 1\n", f"x = {i}\n", "line-range", "1", "1", None)
+        record.timestamp = f"2025-01-01T00:00:{i:02d}+00:00"
+        return record
+    
+    def test_imports_existing_json_records(self):
+        """Verifica el importador de registros JSON creados sin índice"""
+        applied = self.history_dir / "applied"
+        applied.mkdir(parents=True)
+        for i in range(6):
+            record = self.legacy_record(self.files[i % 3], i)
+            (applied / f"20250101_0000{i:02d}_f_{record.new_hash}.json").write_text(record.to_json())
+        
+        mgr = RollbackManager(self.history_dir)
+        
+        history = mgr.get_history(self.files[0])
+        self.assertEqual([r.new_content for r in history], ["x = 3\n", "x = 0\n"])
+        self.assertEqual(mgr.latest_record(self.files[1]).new_content, "x = 4\n")
+        self.assertEqual(len(mgr.list_rollbackable()), 6)
+        self.assertTrue((self.history_dir / "history.db").exists())
+    
+    def test_external_changes_reconciled(self):
+        """Verifica que borrados y movimientos externos de JSON se reflejen en el índice"""
+        mgr = RollbackManager(self.history_dir)
+        paths = [mgr.record_change(self.legacy_record(self.files[0], i)) for i in range(3)]
+        
+        paths[2].unlink()
+        paths[1].rename(mgr.rollback_dir / paths[1].name)
+        
+        history = RollbackManager(self.history_dir).get_history(self.files[0])
+        self.assertEqual([r.new_content for r in history], ["x = 0\n"])
+    
+    def test_own_writes_skip_rescan(self):
+        """Verifica que tras una escritura propia la siguiente sincronización no reescanee applied/"""
+        mgr = RollbackManager(self.history_dir)
+        mgr.record_change(self.legacy_record(self.files[0], 1))
+        
+        with mock.patch.object(Path, "glob", side_effect=AssertionError("applied/ reescaneado")):
+            mgr.record_change(self.legacy_record(self.files[0], 2))
+            self.assertEqual(len(mgr.get_history(self.files[0])), 2)
+        
+        # Un JSON ajeno en el mismo tick cambia la cuenta de entradas y se detecta
+        record = self.legacy_record(self.files[1], 3)
+        (mgr.applied_dir / f"20250101_000003_f_{record.new_hash}.json").write_text(record.to_json())
+        self.assertEqual(mgr.latest_record(self.files[1]).new_content, "x = 3\n")
+        mgr.index.close()
+    
+    def test_non_record_json_read_once(self):
+        """Verifica que los JSON de applied/ que no son registros no se relean en cada sincronización"""
+        mgr = RollbackManager(self.history_dir)
+        (mgr.applied_dir / "job_output.json").write_text('{"status": "ok"}')
+        (mgr.applied_dir / "broken.json").write_text("{")
+        self.assertEqual(mgr.reindex(), 0)
+        
+        mgr.record_change(self.legacy_record(self.files[0], 1))
+        os.utime(mgr.applied_dir, ns=(time.time_ns(), time.time_ns() - 10**10))
+        with mock.patch.object(mgr.index, "_import", side_effect=AssertionError("JSON ajeno releído")):
+            self.assertEqual(len(mgr.get_history(self.files[0])), 1)
+        mgr.index.close()
+    
+    def test_rollback_updates_index(self):
+        """Verifica que el rollback marque el registro como revertido"""
+        mgr = RollbackManager(self.history_dir)
+        self.files[0].write_text("x = 5\n")
+        mgr.record_change(self.legacy_record(self.files[0], 5))
+        
+        success, _ = mgr.rollback_last(self.files[0])
+        
+        self.assertTrue(success)
+        self.assertEqual(self.files[0].read_text(), "x = 1\n")
+        self.assertIsNone(mgr.latest_record(self.files[0]))
+        self.assertEqual(len(list(mgr.rollback_dir.glob("*.json"))), 1)
+
+    def test_verify_checks_latest_record_only(self):
+        """Verifica que solo cuente el último registro de cada archivo"""
+        mgr = RollbackManager(self.history_dir)
+        mgr.record_change(self.legacy_record(self.files[0], 2))
+        mgr.record_change(self.legacy_record(self.files[0], 3))
+        self.files[0].write_text("x = 3\n")
+        
+        self.assertEqual(mgr.verify_integrity(), [])
+        
+        self.files[1].unlink()
+        mgr.record_change(self.legacy_record(self.files[1], 4))
+        issues = mgr.verify_integrity()
+        self.assertEqual([(i["file"], i["issue"]) for i in issues], [(str(self.files[1]), "FILE_MISSING")])
+    
+    def test_repeated_verify_skips_unchanged_files(self):
+        """Verifica que una segunda verificación no relea archivos con la misma firma de stat"""
+        self.files[0].write_text("x = 3\n")
+        old = time.time() - 60
+        os.utime(self.files[0], (old, old))
+        mgr = RollbackManager(self.history_dir)
+        mgr.record_change(self.legacy_record(self.files[0], 3))
+        self.assertEqual(mgr.verify_integrity(), [])
+        
+        fresh = RollbackManager(self.history_dir)
+        with mock.patch("surgery.digests.text_digest", side_effect=AssertionError("archivo releído")):
+            self.assertEqual(fresh.verify_integrity(), [])
+        fresh.index.close()
+        mgr.index.close()
+
+    def test_compact_packs_and_squashes_records(self):
+        """Verifica que los registros empaquetados sigan legibles y revertibles"""
+        mgr = RollbackManager(self.history_dir)
+        for i in range(1, 4):
+            record = ChangeRecord.create(self.files[0], f"x = {i}\n", f"x = {i + 1}\n", "line-range", "1", "1", None)
+            record.timestamp = f"2025-01-01T00:00:{i:02d}+00:00"
+            mgr.record_change(record)
+        mgr.record_change(self.legacy_record(self.files[1], 7))
+        
+        stats = mgr.compact("2025-06-01T00:00:00+00:00")
+        
+        self.assertEqual(stats, {"packed": 2, "squashed": 2})
+        self.assertEqual(list(mgr.applied_dir.glob("*.json")), [])
+        mgr.index.close()
+        (self.history_dir / "history.db").unlink()
+        mgr = RollbackManager(self.history_dir)
+        history = mgr.get_history(self.files[0])
+        self.assertEqual(len(history), 1)
+        self.assertEqual((history[0].mode, history[0].original_content, history[0].new_content),
+                         ("squashed", "x = 1\n", "x = 4\n"))
+        
+        self.files[0].write_text("x = 4\n")
+        success, _ = mgr.rollback_to_record(history[0])
+        self.assertTrue(success)
+        self.assertEqual(self.files[0].read_text(), "x = 1\n")
+        self.assertIsNone(mgr.latest_record(self.files[0]))
+        self.assertEqual(mgr.latest_record(self.files[1]).new_content, "x = 7\n")
+        self.assertEqual(len(list(mgr.rollback_dir.glob("*.json"))), 1)
+        mgr.index.close()
+
+    def test_record_pack_reads_without_pread(self):
+        """Verifica la lectura del pack con lseek+read donde os.pread no existe (Windows)"""
+        from surgery.recordpack import RecordPack
+        pack = RecordPack(self.history_dir)
+        pack.append([("a.json", '{"n": 1}'), ("b.json", '{"n": 2}')])
+        
+        pread = os.pread
+        del os.pread
+        try:
+            self.assertEqual(pack.read("b.json"), '{"n": 2}')
+            self.assertEqual(pack.read("a.json"), '{"n": 1}')
+        finally:
+            os.pread = pread
+
+    def test_record_ids_unique_within_same_second(self):
+        """Verifica ids monótonos y búsqueda por id aunque nombre, segundo y hash coincidan"""
+        mgr = RollbackManager(self.history_dir)
+        records = [self.legacy_record(self.files[0], 2) for _ in range(3)]
+        paths = [mgr.record_change(record) for record in records]
+        
+        self.assertEqual(len(set(paths)), 3)
+        ids = [r.record_id for r in records]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(set(ids)), 3)
+        self.assertEqual(mgr.get_record(ids[1]).record_id, ids[1])
+        
+        self.files[0].write_text("x = 2\n")
+        success, _ = mgr.rollback_to_record(mgr.get_record(ids[1]))
+        self.assertTrue(success)
+        self.assertTrue((mgr.rollback_dir / paths[1].name).exists())
+        self.assertTrue(paths[0].exists() and paths[2].exists())
+        mgr.index.close()
+    
+    def test_concurrent_processes_do_not_clobber_records(self):
+        """Verifica que varios procesos registrando a la vez no pierdan ni repitan registros"""
+        import subprocess
+        script = (
+            "import sys; sys.path.insert(0, sys.argv[1])\n"
+            "from pathlib import Path\n"
+            "from surgery.rollback import RollbackManager, ChangeRecord\n"
+            "mgr = RollbackManager(Path(sys.argv[2]))\n"
+            "for i in range(10):\n"
+            "    mgr.record_change(ChangeRecord.create(Path(sys.argv[3]), 'a', 'b', 'line-range', '1', '1', None))\n"
+        )
+        code_dir = str(Path(__file__).parent.parent)
+        procs = [
+            subprocess.Popen([sys.executable, "-c", script, code_dir, str(self.history_dir), str(self.files[0])])
+            for _ in range(4)
+        ]
+        self.assertEqual([proc.wait() for proc in procs], [0] * 4)
+        
+        mgr = RollbackManager(self.history_dir)
+        history = mgr.get_history(self.files[0])
+        self.assertEqual(len(list(mgr.applied_dir.glob("*.json"))), 40)
+        self.assertEqual(len({r.record_id for r in history}), 40)
+        mgr.index.close()
+
+
+class TestBulkRollback(unittest.TestCase):
+    """Tests para el rollback por ventana de tiempo en varios archivos"""
+    
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.mgr = RollbackManager(self.test_dir / "surgery")
+        self.files = [self.test_dir / f"f{i}.py" for i in range(3)]
+    
+    def tearDown(self):
+        self.mgr.index.close()
+        shutil.rmtree(self.test_dir)
+    
+    def apply(self, target: Path, original: str, updated: str, second: int) -> None:
+        target.write_text(updated)
+        record = ChangeRecord.create(target, original, updated, "line-range", "1", "1", None)
+        record.timestamp = f"2025-01-01T00:00:{second:02d}+00:00"
+        self.mgr.record_change(record)
+    
+    def test_rollback_since_restores_each_file_once(self):
+        """Verifica el estado objetivo por archivo y los conflictos sin abortar el resto"""
+        self.apply(self.files[1], "x = 1\n", "x = 7\n", 5)
+        self.apply(self.files[0], "x = 1\n", "x = 2\n", 10)
+        self.apply(self.files[2], "x = 1\n", "x = 9\n", 12)
+        self.apply(self.files[1], "x = 7\n", "x = 8\n", 15)
+        self.apply(self.files[0], "x = 2\n", "x = 3\n", 20)
+        self.files[2].write_text("x = manual\n")
+        
+        result = self.mgr.rollback_since("2025-01-01T00:00:10+00:00")
+        
+        self.assertEqual(result.restored, {str(self.files[0]): 2, str(self.files[1]): 1})
+        self.assertEqual(list(result.conflicts), [str(self.files[2])])
+        self.assertIn("HASH_MISMATCH", result.conflicts[str(self.files[2])])
+        self.assertEqual(self.files[0].read_text(), "x = 1\n")
+        self.assertEqual(self.files[1].read_text(), "x = 7\n")
+        self.assertEqual(self.files[2].read_text(), "x = manual\n")
+        self.assertEqual([r.new_content for r in self.mgr.get_history()], ["x = 9\n", "x = 7\n"])
+    
+    def test_rollback_until_skips_files_with_later_changes(self):
+        """Verifica que un archivo con cambios posteriores a --until se reporte como conflicto"""
+        self.apply(self.files[0], "x = 1\n", "x = 2\n", 10)
+        self.apply(self.files[0], "x = 2\n", "x = 3\n", 30)
+        self.apply(self.files[1], "x = 1\n", "x = 4\n", 15)
+        
+        result = self.mgr.rollback_since("2025-01-01T00:00:00+00:00", "2025-01-01T00:00:20+00:00")
+        
+        self.assertEqual(list(result.restored), [str(self.files[1])])
+        self.assertIn("LATER_CHANGES", result.conflicts[str(self.files[0])])
+        self.assertEqual(self.files[0].read_text(), "x = 3\n")
+
 
 class TestTestingSystem(unittest.TestCase):
     """Tests para el sistema de testing automático"""
@@ -250,6 +713,207 @@ class TestTestingSystem(unittest.TestCase):
         
         # Debe caer a suite completa de backend
         self.assertEqual(tests, ["tests/backend"])
+    
+    def test_import_graph_selects_transitive_importers(self):
+        """Verifica la selección de tests por grafo de imports y su cache por archivo"""
+        (self.test_dir / "server").mkdir()
+        (self.test_dir / "tests" / "backend").mkdir(parents=True)
+        (self.test_dir / "server" / "db.js").write_text("export const getDb = () => null;\n")
+        (self.test_dir / "server" / "routes.js").write_text("import { getDb } from './db.js';\n")
+        (self.test_dir / "server" / "lonely.js").write_text("const x = require('./missing');\n")
+        (self.test_dir / "tests" / "backend" / "routes.test.js").write_text(
+            "import request from 'supertest';\nimport routes from '../../server/routes';\n"
+        )
+        (self.test_dir / "tests" / "backend" / "other.test.js").write_text("jest.mock('../../server/lonely.js');\n")
+        old = time.time() - 60
+        for path in self.test_dir.rglob("*.js"):
+            os.utime(path, (old, old))
+        
+        self.assertEqual(self.registry.get_tests_for_file(self.test_dir / "server" / "db.js"),
+                         ["tests/backend/routes.test.js"])
+        self.assertEqual(self.registry.get_tests_for_file(self.test_dir / "server" / "lonely.js"),
+                         ["tests/backend/other.test.js"])
+        
+        # Solo se reparsea el archivo modificado
+        from surgery.importgraph import ImportGraph
+        routes = self.test_dir / "server" / "routes.js"
+        routes.write_text("// sin imports\n")
+        os.utime(routes, (old + 1, old + 1))
+        with mock.patch.object(ImportGraph, "_parse", autospec=True, side_effect=ImportGraph._parse) as parse:
+            self.assertEqual(self.registry.get_tests_for_file(self.test_dir / "server" / "db.js"), [])
+        self.assertEqual([c.args[1] for c in parse.call_args_list], [routes])
+    
+    def test_coverage_selects_tests_by_spliced_lines(self):
+        """Verifica selección por cobertura de las líneas empalmadas y descarte por hash distinto"""
+        (self.test_dir / "server").mkdir()
+        (self.test_dir / "tests" / "backend").mkdir(parents=True)
+        source_file = self.test_dir / "server" / "app.js"
+        source_file.write_text("".join(f"const v{i} = {i};\n" for i in range(1, 11)))
+        for name in ("a", "b"):
+            (self.test_dir / "tests" / "backend" / f"{name}.test.js").write_text("// test\n")
+        
+        def report(lines, uncovered=()):
+            statements = {str(n): {"start": {"line": n}, "end": {"line": n}} for n in lines + list(uncovered)}
+            counts = {str(n): (0 if n in uncovered else 1) for n in lines + list(uncovered)}
+            path = self.test_dir / f"report_{lines[0]}.json"
+            path.write_text(json.dumps({str(source_file): {"path": str(source_file), "statementMap": statements, "s": counts}}))
+            return path
+        
+        coverage = self.registry.coverage
+        self.assertEqual(coverage.ingest_istanbul("tests/backend/a.test.js", report([1, 2, 3], uncovered=[9])), 1)
+        coverage.ingest_istanbul("tests/backend/b.test.js", report([6, 7, 8]))
+        file_hash = text_digest(source_file)
+        
+        self.assertEqual(self.registry.get_tests_for_region(source_file, [(2, 2)], file_hash), ["tests/backend/a.test.js"])
+        self.assertEqual(self.registry.get_tests_for_region(source_file, [(3, 6)], file_hash),
+                         ["tests/backend/a.test.js", "tests/backend/b.test.js"])
+        
+        # Línea sin cobertura o archivo cambiado desde la ingesta: selección por archivo
+        by_file = self.registry.get_tests_for_file(source_file)
+        self.assertEqual(self.registry.get_tests_for_region(source_file, [(9, 9)], file_hash), by_file)
+        source_file.write_text("// refactor\n" + source_file.read_text())
+        self.assertEqual(self.registry.get_tests_for_region(source_file, [(2, 2)], text_digest(source_file)), by_file)
+        
+        # Reingerir solo b con el contenido nuevo no vuelve confiables las líneas de a (hash anterior)
+        coverage.ingest_istanbul("tests/backend/b.test.js", report([7, 8, 9]))
+        new_hash = text_digest(source_file)
+        self.assertEqual(self.registry.get_tests_for_region(source_file, [(3, 3)], new_hash), by_file)
+        self.assertEqual(self.registry.get_tests_for_region(source_file, [(8, 8)], new_hash), by_file)
+        coverage.ingest_istanbul("tests/backend/a.test.js", report([2, 3, 4]))
+        self.assertEqual(self.registry.get_tests_for_region(source_file, [(3, 3)], new_hash), ["tests/backend/a.test.js"])
+        coverage.close()
+    
+    def test_result_cache_skips_identical_content(self):
+        """Verifica que contenido idéntico reutilice el resultado y cualquier cambio lo invalide"""
+        (self.test_dir / "server").mkdir()
+        (self.test_dir / "tests" / "backend").mkdir(parents=True)
+        source_file = self.test_dir / "server" / "app.js"
+        helper = self.test_dir / "server" / "db.js"
+        source_file.write_text("const db = require('./db');\nmodule.exports = 1;\n")
+        helper.write_text("module.exports = {};\n")
+        (self.test_dir / "tests" / "backend" / "app.test.js").write_text("require('../../server/app');\n")
+        
+        runner = TestRunner(self.test_dir)
+        passed = TestResult(True, "ok", 0, 3, 0, 1.5)
+        with mock.patch.object(TestRunner, "_run_test_suite", return_value=passed) as run:
+            self.assertFalse(runner.run_tests_for_file(source_file).cached)
+            hit = runner.run_tests_for_file(source_file)
+            self.assertTrue(hit.cached)
+            self.assertEqual((hit.ok, hit.tests_run), (True, 3))
+            self.assertEqual(run.call_count, 1)
+            
+            # Una dependencia transitiva cambia: se ejecuta; volver al contenido anterior reutiliza
+            helper.write_text("module.exports = { pool: true };\n")
+            runner.run_tests_for_file(source_file)
+            self.assertEqual(run.call_count, 2)
+            helper.write_text("module.exports = {};\n")
+            self.assertTrue(runner.run_tests_for_file(source_file).cached)
+            
+            # La config del framework y los mocks por alias no se importan pero cuentan
+            (self.test_dir / "config").mkdir()
+            (self.test_dir / "config" / "jest.config.cjs").write_text("module.exports = {};\n")
+            runner.run_tests_for_file(source_file)
+            self.assertEqual(run.call_count, 3)
+            mocks = self.test_dir / "tests" / "frontend" / "mocks"
+            mocks.mkdir(parents=True)
+            (mocks / "leaflet.js").write_text("export default {};\n")
+            runner.run_tests_for_file(source_file)
+            self.assertEqual(run.call_count, 4)
+            self.assertTrue(runner.run_tests_for_file(source_file).cached)
+            
+            # Opt-out y TTL 0 ejecutan siempre
+            runner.run_tests_for_file(source_file, use_cache=False)
+            runner.results.ttl_seconds = 0
+            runner.run_tests_for_file(source_file)
+            self.assertEqual(run.call_count, 6)
+        
+        runner.results.max_entries = 1
+        runner.results.ttl_seconds = 3600
+        runner.results.put("otra", passed)
+        self.assertEqual(len(list(runner.results.cache_dir.glob("*.json"))), 1)
+    
+    def test_mixed_selection_runs_frameworks_concurrently(self):
+        """Verifica que una selección mixta corra cada framework en paralelo y agregue el resultado"""
+        runner = TestRunner(self.test_dir)
+        runner.max_parallel = 2
+        both_started = threading.Barrier(2, timeout=5)  # falla si los grupos corren en serie
+        
+        def jest(paths):
+            both_started.wait()
+            return TestResult(True, "jest ok", 0, 5, 0, 0.0)
+        
+        def playwright(paths):
+            both_started.wait()
+            return TestResult(False, "1 failed", 1, 2, 1, 0.0)
+        
+        with mock.patch.object(runner, "_run_jest", side_effect=jest) as run_jest, \
+             mock.patch.object(runner, "_run_playwright", side_effect=playwright) as run_e2e:
+            result = runner._run_test_suite(["tests/backend/app.test.js", "tests/e2e/geocoding.spec.ts"])
+        
+        run_jest.assert_called_once_with(["tests/backend/app.test.js"])
+        run_e2e.assert_called_once_with(["tests/e2e/geocoding.spec.ts"])
+        self.assertFalse(result.ok)
+        self.assertEqual((result.tests_run, result.tests_failed, result.exit_code), (7, 1, 1))
+        self.assertEqual(sorted(result.breakdown), ["jest", "playwright"])
+        self.assertTrue(result.breakdown["jest"]["ok"])
+        self.assertIn("playwright: 2 tests, 1 failed", result.summary())
+
+
+FAKE_WORKER = """
+import { createInterface } from 'node:readline';
+const [framework] = process.argv.slice(2);
+if (framework === 'vitest') process.exit(3);
+process.stdout.write(JSON.stringify({ ready: true }) + '\\n');
+createInterface({ input: process.stdin }).on('line', (line) => {
+  const { id, files } = JSON.parse(line);
+  const reply = { id, ok: true, tests_run: files.length, tests_failed: 0, output: String(process.pid) };
+  process.stdout.write(JSON.stringify(reply) + '\\n');
+});
+"""
+
+
+@unittest.skipUnless(shutil.which("node"), "requiere node")
+class TestTestDaemons(unittest.TestCase):
+    """Tests para los workers persistentes de Jest/Vitest"""
+    
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        for framework, config in FRAMEWORK_CONFIGS.items():
+            (self.test_dir / "node_modules" / framework).mkdir(parents=True)
+            (self.test_dir / "node_modules" / framework / "package.json").write_text("{}")
+            (self.test_dir / config).parent.mkdir(parents=True, exist_ok=True)
+            (self.test_dir / config).write_text("")
+        worker = self.test_dir / "fake-worker.mjs"
+        worker.write_text(FAKE_WORKER)
+        self.patch = mock.patch("surgery.testdaemon.WORKER_SCRIPT", worker)
+        self.patch.start()
+        self.runner = TestRunner(self.test_dir, daemons=True)
+    
+    def tearDown(self):
+        self.runner.close()
+        self.patch.stop()
+        shutil.rmtree(self.test_dir)
+    
+    def test_worker_is_reused_across_runs(self):
+        """Verifica que las corridas se despachen al mismo worker sin lanzar npm"""
+        with mock.patch("surgery.testing.subprocess.run") as cold:
+            first = self.runner._run_jest(["tests/backend/a.test.js"])
+            second = self.runner._run_jest(["tests/backend/a.test.js", "tests/backend/b.test.js"])
+        
+        cold.assert_not_called()
+        self.assertTrue(first.ok)
+        self.assertEqual(second.tests_run, 2)
+        self.assertEqual(first.output, second.output)  # mismo pid
+    
+    def test_unusable_worker_falls_back_to_cold_spawn(self):
+        """Verifica el spawn en frío cuando el worker no arranca, y que se desactive tras fallar"""
+        completed = subprocess.CompletedProcess([], 0, "Test Files  1 passed (1)", "")
+        with mock.patch("surgery.testing.subprocess.run", return_value=completed) as cold:
+            for _ in range(MAX_FAILURES + 1):
+                self.assertTrue(self.runner._run_vitest(["tests/frontend/a.test.jsx"]).ok)
+        
+        self.assertEqual(cold.call_count, MAX_FAILURES + 1)
+        self.assertFalse(self.runner._daemons["vitest"].available)
 
 
 class TestIntegration(unittest.TestCase):
@@ -0,0 +1,475 @@
+"""
+Test Suite para Code Surgeon - Runner
+Valida la ejecución de planes de cirugía de punta a punta (sin frameworks de test externos)
+"""
+import os
+import json
+import unittest
+import tempfile
+import shutil
+import sys
+from pathlib import Path
+from unittest import mock
+
+# Añadir code_surgeon al path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from surgery.runner import (Plan, execute, execute_many, SurgeryTransaction, SurgeonSession, recover_transactions,
+                           plans_from_job)
+from surgery.rollback import RollbackManager
+from surgery.testing import TestResult
+from surgery.shadow import ShadowWorkspace
+from surgery.tracing import to_chrome_trace
+
+
+class RunnerTestCase(unittest.TestCase):
+    """Proyecto temporal mínimo con un archivo server/app.js"""
+    
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp()).resolve()
+        (self.test_dir / "package.json").write_text('{"name": "test"}')
+        (self.test_dir / "server").mkdir()
+        self.target = self.test_dir / "server" / "app.js"
+        self.original = "".join(
+            f"app.post('/api/r{i}', (req, res) => {{\n  res.json({{ r: {i} }});\n}});\n" for i in range(10)
+        )
+        self.target.write_text(self.original)
+    
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+    
+    def fragment(self, name: str, content: str) -> str:
+        path = self.test_dir / name
+        path.write_text(content)
+        return str(path)
+    
+    def passing(self, ok: bool = True):
+        result = TestResult(ok, "", 0 if ok else 1, 1, 0 if ok else 1, 0.0)
+        return mock.patch("surgery.testing.TestRunner.run_tests_for_file", return_value=result)
+
+
+class TestExecuteMany(RunnerTestCase):
+    """Tests para la ejecución transaccional de varios hunks en un archivo"""
+    
+    def plans(self):
+        return [
+            Plan(str(self.target), "regex-block", r"/api/r2'", r"^\}\);", self.fragment("a.js", "// r2")),
+            Plan(str(self.target), "line-range", 26, 26, self.fragment("b.js", "res.json({ r: 'eight' });")),
+            Plan(str(self.target), "regex-block", r"/api/r5'", r"^\}\);", self.fragment("c.js", "// r5")),
+        ]
+    
+    def test_single_write_and_composite_record(self):
+        """Verifica un solo registro compuesto y un solo run de tests"""
+        with self.passing() as run_tests:
+            results = execute_many(self.plans())
+        
+        self.assertEqual(len(results), 1)
+        self.assertTrue(results[0]["ok"], results[0]["message"])
+        self.assertEqual(run_tests.call_count, 1)
+        content = self.target.read_text()
+        self.assertIn("// r2\n", content)
+        self.assertIn("// r5\n", content)
+        self.assertIn("  res.json({ r: 'eight' });\n", content)
+        history = RollbackManager(self.test_dir / "surgery").get_history(self.target)
+        self.assertEqual(len(history), 1)
+        self.assertEqual(history[0].mode, "multi-hunk")
+        # El diff compuesto coincide con difflib sobre el archivo completo
+        import difflib
+        expected = "".join(difflib.unified_diff(
+            self.original.splitlines(True), content.splitlines(True), str(self.target), str(self.target)))
+        self.assertEqual(results[0]["diff"], expected)
+    
+    def test_failed_tests_roll_back_every_hunk(self):
+        """Verifica rollback de todos los hunks si los tests fallan"""
+        with self.passing(False):
+            result = execute_many(self.plans())[0]
+        
+        self.assertFalse(result["ok"])
+        self.assertTrue(result["auto_rollback"])
+        self.assertEqual(self.target.read_text(), self.original)
+    
+    def test_job_blocks_apply_as_one_change(self):
+        """Verifica que un job con `blocks` aplique todos los bloques regex como un solo cambio"""
+        job = {
+            "file": str(self.target),
+            "blocks": [
+                {"start": r"/api/r2'", "end": r"^\}\);", "new_fragment_path": self.fragment("a.js", "// r2")},
+                {"start": r"/api/r5'", "end": r"^\}\);", "new_fragment_path": self.fragment("c.js", "// r5")},
+            ],
+        }
+        self.assertEqual([p.mode for p in plans_from_job(job)], ["regex-block", "regex-block"])
+        
+        with self.passing():
+            result = SurgeonSession(self.test_dir).execute_job(job)
+        
+        self.assertTrue(result["ok"], result["message"])
+        self.assertEqual(result["hunks"], 2)
+        history = RollbackManager(self.test_dir / "surgery").get_history(self.target)
+        self.assertEqual([r.mode for r in history], ["multi-hunk"])
+        with self.assertRaises(ValueError):
+            plans_from_job({**job, "shadow": True})
+    
+    def test_overlapping_hunks_touch_nothing(self):
+        """Verifica que un hunk inválido impida aplicar los demás"""
+        plans = self.plans() + [Plan(str(self.target), "line-range", 7, 8, self.fragment("d.js", "x"))]
+        
+        result = execute_many(plans)[0]
+        
+        self.assertFalse(result["ok"])
+        self.assertIn("Overlapping", result["message"])
+        self.assertEqual(self.target.read_text(), self.original)
+
+
+class TestSurgeryTransaction(RunnerTestCase):
+    """Tests para transacciones atómicas entre varios archivos"""
+    
+    def setUp(self):
+        super().setUp()
+        self.other = self.test_dir / "server" / "routes.js"
+        self.other.write_text("module.exports = {\n  a: 1,\n};\n")
+    
+    def transaction(self):
+        tx = SurgeryTransaction(project_root=self.test_dir)
+        tx.stage(Plan(str(self.target), "regex-block", r"/api/r2'", r"^\}\);", self.fragment("a.js", "// r2")))
+        tx.stage(Plan(str(self.other), "line-range", 2, 2, self.fragment("b.js", "b: 2,")))
+        return tx
+    
+    def union_tests(self, ok: bool = True):
+        result = TestResult(ok, "", 0 if ok else 1, 1, 0 if ok else 1, 0.0)
+        return mock.patch("surgery.testing.TestRunner.run_tests_for_files", return_value=result)
+    
+    def test_commit_runs_tests_once(self):
+        """Verifica que ambos archivos se apliquen con una sola corrida de tests"""
+        with self.union_tests() as run_tests:
+            result = self.transaction().commit()
+        
+        self.assertTrue(result["ok"], result["message"])
+        self.assertEqual(run_tests.call_count, 1)
+        self.assertEqual(set(run_tests.call_args[0][0]), {self.target, self.other})
+        self.assertIn("// r2\n", self.target.read_text())
+        self.assertEqual(self.other.read_text(), "module.exports = {\n  b: 2,\n};\n")
+        mgr = RollbackManager(self.test_dir / "surgery")
+        record = mgr.get_history(self.other)[0]
+        self.assertEqual(record.transaction_id, result["transaction_id"])
+        self.assertEqual(list((self.test_dir / "surgery" / "transactions").glob("*.json")), [])
+    
+    def test_failure_restores_every_file(self):
+        """Verifica que un fallo de tests restaure todos los archivos"""
+        with self.union_tests(False):
+            result = self.transaction().commit()
+        
+        self.assertFalse(result["ok"])
+        self.assertTrue(result["auto_rollback"])
+        self.assertEqual(self.target.read_text(), self.original)
+        self.assertEqual(self.other.read_text(), "module.exports = {\n  a: 1,\n};\n")
+        self.assertEqual(RollbackManager(self.test_dir / "surgery").get_history(self.other), [])
+    
+    def test_recover_interrupted_transaction(self):
+        """Verifica la recuperación de un journal huérfano tras un crash"""
+        import json
+        mgr = RollbackManager(self.test_dir / "surgery")
+        original_blob = mgr.blobs.put_file(self.other)
+        original_hash = mgr.digests.short(self.other)
+        self.other.write_text("module.exports = {\n  b: 2,\n};\n")
+        journal = {
+            "id": "crashed", "pid": 2 ** 22 + 12345, "state": "applying",
+            "files": [{"path": str(self.other), "original_hash": original_hash,
+                       "original_blob": original_blob, "new_hash": None, "record": None}]
+        }
+        tx_dir = self.test_dir / "surgery" / "transactions"
+        tx_dir.mkdir()
+        (tx_dir / "crashed.json").write_text(json.dumps(journal))
+        
+        with mock.patch("surgery.runner._journal_is_orphan", return_value=True):
+            report = recover_transactions(self.test_dir / "surgery")
+        
+        self.assertEqual(report[0]["files"][0]["status"], "restored")
+        self.assertEqual(self.other.read_text(), "module.exports = {\n  a: 1,\n};\n")
+        self.assertFalse((tx_dir / "crashed.json").exists())
+    
+    def test_session_recovers_dead_transactions_only(self):
+        """Verifica que recover() revierta journals de procesos muertos y respete los del propio proceso"""
+        mgr = RollbackManager(self.test_dir / "surgery")
+        original_hash = mgr.digests.short(self.other)
+        original_blob = mgr.blobs.put_file(self.other)
+        self.other.write_text("module.exports = { crashed: true };\n")
+        tx_dir = self.test_dir / "surgery" / "transactions"
+        tx_dir.mkdir()
+        for tx_id, pid in (("crashed", 2 ** 22 + 12345), ("live", os.getpid())):
+            journal = {
+                "id": tx_id, "pid": pid, "state": "applying",
+                "files": [{"path": str(self.other), "original_hash": original_hash,
+                           "original_blob": original_blob, "new_hash": None, "record": None}]
+            }
+            (tx_dir / f"{tx_id}.json").write_text(json.dumps(journal))
+        
+        session = SurgeonSession(self.test_dir)
+        report = session.recover(self.test_dir)
+        
+        self.assertEqual([(r["transaction"], r["status"]) for r in report], [("crashed", "restored")])
+        self.assertEqual(self.other.read_text(), "module.exports = {\n  a: 1,\n};\n")
+        self.assertTrue((tx_dir / "live.json").exists())
+
+
+class TestShadowWorkspace(RunnerTestCase):
+    """Tests para la validación en árbol sombra"""
+    
+    def plan(self):
+        return Plan(str(self.target), "line-range", 2, 2, self.fragment("a.js", "res.json({ r: 'zero' });"), shadow=True)
+    
+    def test_tree_layout(self):
+        """Verifica hardlinks, symlinks de node_modules y copias reales de bases de datos"""
+        (self.test_dir / "node_modules" / "pkg").mkdir(parents=True)
+        (self.test_dir / "server" / "data.db").write_bytes(b"sqlite")
+        
+        with ShadowWorkspace(self.test_dir) as shadow:
+            shadow_root = shadow.root
+            self.assertTrue((shadow.root / "node_modules").is_symlink())
+            # Hardlink, salvo que haya reflinks (clon propio) o no se puedan crear hardlinks
+            self.assertTrue(shadow.path_for(self.target).samefile(self.target) or shadow._can_reflink
+                            or not shadow._can_link)
+            self.assertFalse((shadow.root / "server" / "data.db").samefile(self.test_dir / "server" / "data.db"))
+        
+        self.assertFalse(shadow_root.exists())
+        self.assertTrue((self.test_dir / "node_modules" / "pkg").exists())
+    
+    def test_refresh_tracks_real_tree(self):
+        """Verifica que refresh() reutilice el árbol y solo rehaga lo que cambió"""
+        (self.test_dir / "backups").mkdir()
+        (self.test_dir / "backups" / "old.js").write_text("// backup\n")
+        helper = self.test_dir / "server" / "db.js"
+        helper.write_text("module.exports = {};\n")
+        
+        with ShadowWorkspace(self.test_dir) as shadow:
+            root = shadow.root
+            unchanged = (root / "package.json").stat().st_ino
+            self.assertTrue((root / "backups").is_symlink())
+            shadow.path_for(self.target).write_text("// empalme de una cirugía anterior\n")
+            replacement = self.test_dir / "server" / ".app.js.tmp"
+            replacement.write_text("// nuevo\n")
+            os.replace(replacement, self.target)
+            helper.unlink()
+            (self.test_dir / "server" / "routes").mkdir()
+            (self.test_dir / "server" / "routes" / "r.js").write_text("// r\n")
+            
+            self.assertEqual(shadow.refresh(), root)
+            self.assertEqual(shadow.path_for(self.target).read_text(), "// nuevo\n")
+            self.assertFalse((root / "server" / "db.js").exists())
+            self.assertEqual((root / "server" / "routes" / "r.js").read_text(), "// r\n")
+            self.assertEqual((root / "package.json").stat().st_ino, unchanged)
+    
+    def test_session_reuses_shadow_and_runner(self):
+        """Verifica que la sesión reutilice el árbol sombra, su TestRunner y el cache del proyecto"""
+        runners = []
+        
+        def run_tests(runner, file_path, *selection):
+            runners.append(runner)
+            return TestResult(True, "", 0, 1, 0, 0.0)
+        
+        session = SurgeonSession(self.test_dir)
+        with mock.patch("surgery.testing.TestRunner.run_tests_for_file", autospec=True, side_effect=run_tests):
+            self.assertTrue(session.execute(self.plan())["ok"])
+            plan = Plan(str(self.target), "line-range", 5, 5, self.fragment("b.js", "res.json({ r: 'one' });"),
+                        shadow=True)
+            self.assertTrue(session.execute(plan)["ok"])
+        
+        self.assertIs(runners[0], runners[1])
+        self.assertIs(runners[0].results, session.test_runner(self.test_dir).results)
+        shadow_root = runners[0].project_root
+        self.assertIn("{ r: 'one' }", (shadow_root / "server" / "app.js").read_text())
+        session.close()
+        self.assertFalse(shadow_root.exists())
+    
+    def test_tests_run_in_shadow_before_promotion(self):
+        """Verifica que los tests vean el cambio en el árbol sombra con el archivo real intacto"""
+        seen = {}
+        
+        def run_tests(runner, file_path, *selection):
+            seen["shadow"] = file_path.read_text()
+            seen["real"] = self.target.read_text()
+            return TestResult(True, "", 0, 1, 0, 0.0)
+        
+        with mock.patch("surgery.testing.TestRunner.run_tests_for_file", autospec=True, side_effect=run_tests):
+            result = execute(self.plan())
+        
+        self.assertTrue(result["ok"], result["message"])
+        self.assertEqual(seen["real"], self.original)
+        self.assertIn("res.json({ r: 'zero' });", seen["shadow"])
+        self.assertEqual(self.target.read_text(), self.original.replace("{ r: 0 }", "{ r: 'zero' }"))
+        history = RollbackManager(self.test_dir / "surgery").get_history(self.target)
+        self.assertEqual(len(history), 1)
+    
+    def test_failure_never_touches_real_file(self):
+        """Verifica que un fallo de tests no escriba el archivo real"""
+        mtime = self.target.stat().st_mtime_ns
+        
+        with self.passing(False):
+            result = execute(self.plan())
+        
+        self.assertFalse(result["ok"])
+        self.assertFalse(result["auto_rollback"])
+        self.assertEqual(self.target.stat().st_mtime_ns, mtime)
+        self.assertEqual(self.target.read_text(), self.original)
+
+
+class TestFullFileReplace(RunnerTestCase):
+    """Tests para el modo full-file-replace"""
+    
+    def test_replace_record_and_rollback(self):
+        """Verifica el reemplazo completo registrado con blobs y su rollback exacto"""
+        replacement = self.fragment("new_app.js", "app.listen(4000);\n")
+        plan = Plan(str(self.target), "full-file-replace", "", "", replacement)
+        
+        with self.passing():
+            result = execute(plan)
+        
+        self.assertTrue(result["ok"], result["message"])
+        self.assertEqual(self.target.read_text(), "app.listen(4000);\n")
+        self.assertIn("+app.listen(4000);\n", result["diff"])
+        mgr = RollbackManager(self.test_dir / "surgery")
+        record = mgr.get_history(self.target)[0]
+        self.assertEqual(record.mode, "full-file-replace")
+        self.assertTrue(record.original_blob and record.new_blob)
+        
+        success, _ = mgr.rollback_last(self.target)
+        self.assertTrue(success)
+        self.assertEqual(self.target.read_text(), self.original)
+    
+    def test_requires_fragment(self):
+        """Verifica que el modo exija el contenido nuevo"""
+        with self.assertRaises(ValueError):
+            execute(Plan(str(self.target), "full-file-replace", "", ""))
+
+
+class TestSurgeonSession(RunnerTestCase):
+    """Tests para la sesión de larga vida"""
+    
+    def test_context_resolved_once(self):
+        """Verifica que raíz, RollbackManager y TestRunner se reutilicen entre planes"""
+        with mock.patch("surgery.runner._find_project_root", return_value=self.test_dir) as find_root, \
+                mock.patch("surgery.runner.RollbackManager", wraps=RollbackManager) as make_mgr, \
+                self.passing():
+            with SurgeonSession() as session:
+                for line in (2, 5, 8):
+                    plan = Plan(str(self.target), "line-range", line, line, self.fragment("a.js", "res.json({});"))
+                    self.assertTrue(session.execute(plan)["ok"])
+                runner = session.test_runner(self.test_dir)
+        
+        self.assertEqual(find_root.call_count, 1)
+        self.assertEqual(make_mgr.call_count, 1)
+        self.assertIs(runner, session.test_runner(self.test_dir))
+        self.assertEqual(len(RollbackManager(self.test_dir / "surgery").get_history(self.target)), 3)
+    
+    def test_second_line_range_reuses_line_index(self):
+        """Verifica que el índice derivado del empalme quede bajo el archivo real y no bajo el staged"""
+        from surgery import lineindex
+        lineindex._cache.clear()
+        lineindex._unconfirmed.clear()
+        with self.passing(), SurgeonSession(self.test_dir) as session:
+            plan = Plan(str(self.target), "line-range", 2, 2, self.fragment("a.js", "res.json({ a: 1 });"))
+            self.assertTrue(session.execute(plan)["ok"])
+            self.assertEqual(list(lineindex._cache), [str(self.target)])
+            
+            plan = Plan(str(self.target), "line-range", 5, 5, self.fragment("b.js", "res.json({ b: 2 });"))
+            with mock.patch.object(lineindex.LineIndex, "build", side_effect=AssertionError("archivo reescaneado")):
+                self.assertTrue(session.execute(plan)["ok"])
+        
+        lines = self.target.read_text().splitlines()
+        self.assertEqual((lines[1].strip(), lines[4].strip()), ("res.json({ a: 1 });", "res.json({ b: 2 });"))
+    
+    def test_mapping_reloaded_on_change(self):
+        """Verifica que un cambio en test_mapping.json invalide el mapeo cacheado"""
+        import os
+        mapping = self.test_dir / "code_surgeon" / "test_mapping.json"
+        mapping.parent.mkdir()
+        mapping.write_text('{"server/app.js": ["tests/a.test.js"]}')
+        registry = SurgeonSession(self.test_dir).test_runner(self.test_dir).registry
+        self.assertEqual(registry.get_tests_for_file(self.target), ["tests/a.test.js"])
+        
+        mapping.write_text('{"server/app.js": ["tests/b.test.js"]}')
+        os.utime(mapping, ns=(mapping.stat().st_atime_ns, mapping.stat().st_mtime_ns + 1_000_000))
+        
+        self.assertEqual(registry.get_tests_for_file(self.target), ["tests/b.test.js"])
+
+
+class TestIntentJournal(RunnerTestCase):
+    """Tests para el journal de intenciones write-ahead"""
+    
+    def test_committed_intent_advances_checkpoint(self):
+        """Verifica que una cirugía completa no deje intenciones abiertas"""
+        plan = Plan(str(self.target), "line-range", 2, 2, self.fragment("a.js", "res.json({});"))
+        with self.passing():
+            self.assertTrue(execute(plan)["ok"])
+        
+        intents = RollbackManager(self.test_dir / "surgery").intents
+        self.assertEqual(intents.pending(), [])
+        self.assertEqual(int(intents.checkpoint_path.read_text()), intents.path.stat().st_size)
+        self.assertEqual(list(self.target.parent.glob(".*")), [])
+    
+    def test_crash_before_record_is_replayed(self):
+        """Verifica que un archivo modificado sin registro recupere su ChangeRecord al iniciar"""
+        plan = Plan(str(self.target), "line-range", 2, 2, self.fragment("a.js", "res.json({});"))
+        with self.passing(), mock.patch.object(RollbackManager, "record_change", side_effect=OSError("crash")):
+            result = execute(plan)
+        self.assertIn("rollback_warning", result)
+        modified = self.target.read_text()
+        self.assertNotEqual(modified, self.original)
+        
+        session = SurgeonSession(self.test_dir)
+        mgr = session.rollback_manager(self.test_dir)
+        self.assertEqual(session.recovered, [])  # abrir el manager no recupera
+        
+        self.assertEqual([r["status"] for r in session.recover(self.test_dir)], ["replayed"])
+        self.assertEqual(session.recover(self.test_dir), [])
+        self.assertEqual(mgr.intents.pending(), [])
+        success, _ = mgr.rollback_last(self.target)
+        self.assertTrue(success)
+        self.assertEqual(self.target.read_text(), self.original)
+    
+    def test_unwritten_intent_is_discarded(self):
+        """Verifica que una intención cuyo archivo conserva el original se descarte"""
+        mgr = RollbackManager(self.test_dir / "surgery")
+        intent_id = mgr.intents.begin(target=str(self.target), pre_hash=mgr.digests.short(self.target),
+                                      post_hash="0" * 12, original_blob=None, new_blob=None, mode="line-range",
+                                      start="2", end="2")
+        
+        # En curso en este proceso: la recuperación no la toca
+        self.assertEqual(RollbackManager(self.test_dir / "surgery").recover_intents(), [])
+        
+        mgr.intents.release(intent_id)  # la operación terminó sin confirmar (crash simulado)
+        report = RollbackManager(self.test_dir / "surgery").recover_intents()
+        
+        self.assertEqual([r["status"] for r in report], ["discarded"])
+        self.assertEqual(mgr.get_history(), [])
+        self.assertEqual(self.target.read_text(), self.original)
+
+
+class TestPhaseTiming(RunnerTestCase):
+    """Tests para la medición por fase y el trace JSONL"""
+    
+    def test_timings_and_chrome_trace(self):
+        """Verifica el bloque timings y su conversión a Chrome trace-event"""
+        trace = self.test_dir / "trace.jsonl"
+        plan = Plan(str(self.target), "line-range", 2, 2, self.fragment("a.js", "res.json({});"))
+        
+        with self.passing():
+            result = execute(plan, trace_path=trace)
+        
+        self.assertTrue(result["ok"], result["message"])
+        for phase in ("select", "splice", "record", "tests", "total"):
+            self.assertIn(phase, result["timings"])
+        self.assertGreaterEqual(result["timings"]["total"], result["timings"]["splice"])
+        
+        chrome = to_chrome_trace(trace)
+        names = [e["name"] for e in chrome["traceEvents"]]
+        self.assertEqual(names[0], "app.js")
+        self.assertIn("tests", names)
+        root = chrome["traceEvents"][0]
+        for event in chrome["traceEvents"][1:]:
+            self.assertGreaterEqual(event["ts"], root["ts"])
+            self.assertEqual(event["ph"], "X")
+        self.assertTrue(root["args"]["ok"])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
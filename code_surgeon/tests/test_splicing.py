@@ -0,0 +1,349 @@
+"""
+Test Suite para Code Surgeon - Selección y Empalme
+Valida los motores de selección de regiones y aplicación de fragmentos
+"""
+import unittest
+import tempfile
+import shutil
+import sys
+from pathlib import Path
+from unittest import mock
+
+# Añadir code_surgeon al path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from surgery.selectors import (locate_line_range, locate_regex_block, select_by_line_range, select_by_regex_block,
+                               select_spans, select_span_by_line_range, select_span_by_regex_block)
+from surgery.splicer import splice_byte_range, splice_span, replace_file, write_spliced
+from surgery.diffing import region_diff, patience_opcodes, file_diff
+from surgery.utils import read_text, slice_by_lines
+from surgery import lineindex
+
+
+class TestStreamingSplice(unittest.TestCase):
+    """Tests para el empalme por offsets de bytes"""
+    
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.target = self.test_dir / "target.py"
+        self.target.write_bytes(
+            b"def add(a, b):\n"
+            b"    # BEGIN:hotfix\n"
+            b"    return a + b\n"
+            b"    # END:hotfix\n"
+            b"\n"
+            b"def other():\n"
+            b"    print('untouched')\n"
+        )
+    
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+    
+    def test_locate_line_range(self):
+        """Verifica offsets de bytes para un rango de líneas"""
+        span = locate_line_range(self.target, 3, 3)
+        data = self.target.read_bytes()
+        
+        self.assertEqual(data[span.start_byte:span.end_byte], b"    return a + b\n")
+        with self.assertRaises(ValueError):
+            locate_line_range(self.target, 50, 60)
+    
+    def test_locate_regex_block(self):
+        """Verifica localización de bloques por marcadores"""
+        span = locate_regex_block(self.target, r"BEGIN:hotfix", r"END:hotfix")
+        
+        self.assertEqual((span.start_line, span.end_line), (2, 4))
+    
+    def test_splice_preserves_prefix_and_suffix(self):
+        """Verifica que solo la región cambie y el diff use numeración absoluta"""
+        span = locate_line_range(self.target, 3, 3)
+        res = splice_byte_range(self.target, span.start_byte, span.end_byte,
+                                "return int(a) + int(b)", start_line=span.start_line)
+        
+        self.assertTrue(res.ok)
+        lines = self.target.read_text().splitlines()
+        self.assertEqual(lines[2], "    return int(a) + int(b)")
+        self.assertEqual(lines[-1], "    print('untouched')")
+        self.assertEqual(len(lines), 7)
+        self.assertIn("@@ -1,6 +1,6 @@", res.diff)
+        self.assertIn("-    return a + b\n+    return int(a) + int(b)\n", res.diff)
+    
+    def test_splice_keeps_crlf(self):
+        """Verifica que se respeten los finales de línea CRLF"""
+        self.target.write_bytes(b"a\r\nb\r\nc\r\n")
+        span = locate_line_range(self.target, 2, 2)
+        res = splice_byte_range(self.target, span.start_byte, span.end_byte, "x\ny", start_line=2)
+        
+        self.assertTrue(res.ok)
+        self.assertEqual(self.target.read_bytes(), b"a\r\nx\r\ny\r\nc\r\n")
+
+
+
+class TestSpanSelection(unittest.TestCase):
+    """Tests para selecciones basadas en spans sobre un buffer compartido"""
+    
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.target = self.test_dir / "app.js"
+        self.target.write_text("".join(f"  line {i}\n" for i in range(1, 21)))
+    
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+    
+    def test_lazy_parts_match_legacy_selection(self):
+        """Verifica que pre/mid/post perezosos coincidan con Selection"""
+        span = select_span_by_line_range(self.target, 5, 8)
+        legacy = select_by_line_range(self.target, 5, 8)
+        
+        self.assertEqual((span.pre, span.mid, span.post), (legacy.pre, legacy.mid, legacy.post))
+        self.assertEqual(span.lines_before(2), ["  line 3", "  line 4"])
+        self.assertEqual(span.lines_after(2), ["  line 9", "  line 10"])
+        span.close()
+    
+    def test_splice_span(self):
+        """Verifica empalme leyendo solo la región desde el buffer"""
+        sel = select_span_by_regex_block(self.target, r"line 10$", r"line 11$")
+        
+        res = splice_span(self.target, sel, "replaced()")
+        
+        self.assertTrue(res.ok)
+        lines = self.target.read_text().splitlines()
+        self.assertEqual(lines[8:11], ["  line 9", "  replaced()", "  line 12"])
+        self.assertIn("@@ -7,8 +7,7 @@", res.diff)
+
+
+class TestMultiBlockSelector(unittest.TestCase):
+    """Tests para la selección de varios bloques en un solo recorrido"""
+    
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.target = self.test_dir / "app.js"
+        self.target.write_text(
+            "const app = express();\n"
+            "app.post('/api/a', (req, res) => {\n"
+            "  res.json({ a: 1 });\n"
+            "});\n"
+            "app.post('/api/b', (req, res) => {\n"
+            "  res.json({ b: 2 });\n"
+            "});\n"
+        )
+    
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+    
+    def test_matches_single_block_selector(self):
+        """Verifica equivalencia con select_by_regex_block por cada par"""
+        pairs = [(r"app\.post\('/api/b'", r"^\}\);"), (r"app\.post\('/api/a'", r"^\}\);")]
+        
+        selections = select_spans(self.target, [("regex-block", sp, ep) for sp, ep in pairs])
+        
+        for (sp, ep), sel in zip(pairs, selections):
+            single = select_by_regex_block(self.target, sp, ep)
+            self.assertEqual((sel.pre, sel.mid, sel.post, sel.start_line, sel.end_line),
+                             (single.pre, single.mid, single.post, single.start_line, single.end_line))
+        self.assertEqual([(s.start_line, s.end_line) for s in selections], [(5, 7), (2, 4)])
+        selections[0].close()
+    
+    def test_overlap_reported(self):
+        """Verifica que bloques solapados se reporten como error"""
+        pairs = [(r"app\.post\('/api/a'", r"b: 2"), (r"app\.post\('/api/b'", r"^\}\);")]
+        
+        with self.assertRaises(ValueError) as ctx:
+            select_spans(self.target, [("regex-block", sp, ep) for sp, ep in pairs])
+        self.assertIn("overlaps", str(ctx.exception))
+    
+    def test_missing_pattern_reported(self):
+        """Verifica error cuando un patrón no aparece"""
+        with self.assertRaises(ValueError) as ctx:
+            select_spans(self.target, [("regex-block", r"app\.delete", r"^\}\);")])
+        self.assertIn("Start pattern not found", str(ctx.exception))
+
+
+class TestLineIndex(unittest.TestCase):
+    """Tests para el índice persistente de offsets de línea"""
+    
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.cache_dir = self.test_dir / "cache"
+        self.target = self.test_dir / "app.js"
+        self.target.write_bytes(b"".join(f"line {i}\n".encode() for i in range(1, 101)))
+        lineindex._cache.clear()
+    
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+        lineindex._cache.clear()
+    
+    def _age(self, path: Path, seconds: int = 60):
+        """Envejece el mtime para que la firma sea confiable"""
+        import os, time
+        past = time.time() - seconds
+        os.utime(path, (past, past))
+    
+    def test_spans_match_line_boundaries(self):
+        """Verifica offsets de inicio/fin por línea"""
+        index = lineindex.LineIndex.build(self.target)
+        
+        self.assertEqual(index.line_count, 100)
+        start, end = index.span(10, 11)
+        self.assertEqual(self.target.read_bytes()[start:end], b"line 10\nline 11\n")
+    
+    def test_selection_matches_legacy_slicing(self):
+        """Verifica equivalencia con slice_by_lines"""
+        self.target.write_bytes(b"a\r\nb\r\nc\r\nd")
+        for s, e in [(1, 1), (2, 3), (3, 4), (4, 9)]:
+            sel = select_by_line_range(self.target, s, e)
+            self.assertEqual((sel.pre, sel.mid, sel.post), slice_by_lines(read_text(self.target), s, e))
+    
+    def test_span_path_numbers_exotic_lines_like_splitlines(self):
+        """Verifica que el empalme por spans numere FF y CR suelto igual que slice_by_lines"""
+        for data in (b"a\x0cb\nc\nd\n", b"a\rb\nc\nd\n"):
+            self.target.write_bytes(data)
+            legacy = slice_by_lines(read_text(self.target), 2, 3)
+            sel = select_span_by_line_range(self.target, 2, 3)
+            self.assertEqual(sel.mid, legacy[1])
+            (multi,) = select_spans(self.target, [("line-range", 2, 3)])
+            self.assertEqual(multi.mid_bytes, sel.mid_bytes)
+            multi.close()
+            
+            res = splice_span(self.target, sel, "x", keep_indent=False)
+            sel.close()
+            self.assertTrue(res.ok)
+            self.assertEqual(read_text(self.target).splitlines(), ["a", "x", "d"])
+            
+            # Región terminada en el separador no estándar: se conserva, no se une con la siguiente
+            sel = select_span_by_line_range(self.target, 1, 1)
+            self.assertTrue(splice_span(self.target, sel, "y", keep_indent=False).ok)
+            sel.close()
+            self.assertEqual(read_text(self.target).splitlines(), ["y", "x", "d"])
+    
+    def test_persisted_and_invalidated_by_signature(self):
+        """Verifica persistencia en disco e invalidación por firma"""
+        self._age(self.target)
+        first = lineindex.get_line_index(self.target, self.cache_dir)
+        lineindex._cache.clear()
+        
+        reloaded = lineindex.get_line_index(self.target, self.cache_dir)
+        self.assertEqual(list(reloaded.offsets), list(first.offsets))
+        self.assertEqual(len(list((self.cache_dir / "lineindex").glob("*.idx"))), 1)
+        
+        with open(self.target, "ab") as f:
+            f.write(b"line 101\n")
+        index = lineindex.get_line_index(self.target, self.cache_dir)
+        self.assertEqual(index.line_count, first.line_count + 1)
+    
+    def test_recent_files_are_not_cached(self):
+        """Verifica que archivos recién modificados no se cacheen (mtime ambiguo)"""
+        lineindex.get_line_index(self.target, self.cache_dir)
+        
+        self.assertFalse((self.cache_dir / "lineindex").exists())
+
+    
+    def test_own_splice_records_index_without_rescan(self):
+        """Verifica que tras un empalme propio el índice se derive del anterior sin reescanear"""
+        index = lineindex.get_line_index(self.target, self.cache_dir)
+        start, end = index.span(10, 12)
+        write_spliced(self.target, [(start, end, b"a\nb\n"), (0, index.span(1, 1)[1], b"")])
+        
+        with mock.patch.object(lineindex.LineIndex, "build", side_effect=AssertionError("archivo reescaneado")):
+            derived = lineindex.get_line_index(self.target, self.cache_dir)
+        self.assertEqual(list(derived.offsets), list(lineindex.LineIndex.build(self.target).offsets))
+        self.assertFalse((self.cache_dir / "lineindex").exists())
+    
+    def test_line_range_reads_only_requested_parts(self):
+        """Verifica que select_by_line_range lea mid con un seek y falle si el archivo cambió"""
+        sel = select_by_line_range(self.target, 50, 50)
+        with mock.patch("builtins.open", wraps=open) as opened:
+            self.assertEqual(sel.mid, "line 50")
+        self.assertEqual(opened.call_count, 1)
+        
+        with open(self.target, "ab") as f:
+            f.write(b"line 101\n")
+        with self.assertRaises(ValueError):
+            sel.post
+
+
+class TestRegionDiff(unittest.TestCase):
+    """Tests para diffs anclados a la región reemplazada"""
+    
+    def test_matches_whole_file_difflib(self):
+        """Verifica que el diff regional sea idéntico al de difflib sobre el archivo completo"""
+        import difflib
+        lines = [f"line {i}" for i in range(1, 201)]
+        new_mid = ["line 100", "changed", "line 102"]
+        updated = lines[:99] + new_mid + lines[102:]
+        expected = "".join(difflib.unified_diff(
+            [l + "\n" for l in lines], [l + "\n" for l in updated], fromfile="f", tofile="f"))
+        
+        diff = region_diff(lines[99:102], new_mid, 99, "f", "f",
+                           before=lines[96:99], after=lines[102:105])
+        
+        self.assertEqual(diff, expected)
+    
+    def test_patience_reconstructs_target(self):
+        """Verifica que los opcodes patience transformen a en b"""
+        a = [f"stmt{i % 7};" if i % 5 else f"unique{i}" for i in range(600)]
+        b = a[:100] + ["inserted"] * 3 + a[150:400] + [f"new{i}" for i in range(50)] + a[420:]
+        
+        rebuilt = []
+        for tag, i1, i2, j1, j2 in patience_opcodes(a, b):
+            rebuilt.extend(a[i1:i2] if tag == "equal" else b[j1:j2])
+        
+        self.assertEqual(rebuilt, b)
+        self.assertIn("@@ -", region_diff(a, b, 10, "f", "f", algorithm="patience"))
+    
+    def test_splice_span_diff_is_region_only(self):
+        """Verifica que splice_span numere el hunk con la línea absoluta"""
+        test_dir = Path(tempfile.mkdtemp())
+        try:
+            target = test_dir / "app.js"
+            target.write_text("".join(f"l{i}\n" for i in range(1, 51)))
+            sel = select_span_by_line_range(target, 20, 21)
+            
+            res = splice_span(target, sel, "replaced", keep_indent=False)
+            
+            self.assertTrue(res.ok)
+            self.assertIn("@@ -17,8 +17,7 @@", res.diff)
+            self.assertTrue(target.read_text().endswith("l50\n"))
+            self.assertEqual(target.read_text().splitlines()[19], "replaced")
+        finally:
+            shutil.rmtree(test_dir)
+    
+    def test_file_diff_matches_whole_file_difflib(self):
+        """Verifica que file_diff (prefijo/sufijo por bloques) coincida con difflib"""
+        import difflib
+        test_dir = Path(tempfile.mkdtemp())
+        try:
+            old = "".join(f"line {i}\n" for i in range(1, 3001))
+            new = old.replace("line 1500\n", "changed\nline 1500\n").replace("line 2900\n", "")
+            (test_dir / "old").write_text(old)
+            (test_dir / "new").write_text(new)
+            expected = "".join(difflib.unified_diff(old.splitlines(True), new.splitlines(True), "f", "f"))
+            
+            self.assertEqual(file_diff(test_dir / "old", test_dir / "new", "f", "f"), expected)
+            self.assertEqual(file_diff(test_dir / "old", test_dir / "old", "f", "f"), "")
+        finally:
+            shutil.rmtree(test_dir)
+    
+    def test_replace_file_streams_new_content(self):
+        """Verifica el reemplazo completo con diff y rename atómico"""
+        test_dir = Path(tempfile.mkdtemp())
+        try:
+            target = test_dir / "Header.jsx"
+            target.write_text("export default function Header() {\n  return null;\n}\n")
+            target.chmod(0o640)
+            replacement = test_dir / "patch.jsx"
+            replacement.write_text("export default function Header() {\n  return <header />;\n}\n")
+            
+            res = replace_file(target, replacement)
+            
+            self.assertTrue(res.ok)
+            self.assertEqual(target.read_text(), replacement.read_text())
+            self.assertEqual(target.stat().st_mode & 0o777, 0o640)
+            self.assertIn("-  return null;\n+  return <header />;\n", res.diff)
+            self.assertEqual(sorted(p.name for p in test_dir.iterdir()), ["Header.jsx", "Header.jsx.bak", "patch.jsx"])
+        finally:
+            shutil.rmtree(test_dir)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
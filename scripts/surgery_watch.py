@@ -1,7 +1,10 @@
-import time, json, subprocess, sys
+import time, json, subprocess, sys, traceback
 from pathlib import Path
 
 ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "code_surgeon"))
+
+from surgery.runner import SurgeonSession
 JOBS = ROOT / "surgery" / "jobs"
 APPLIED = ROOT / "surgery" / "applied"
 FAILED = ROOT / "surgery" / "failed"
@@ -10,19 +13,24 @@ FAILED.mkdir(parents=True, exist_ok=True)
 
 SURGEON = ROOT / "code_surgeon" / "bin" / "code-surgeon.py"
 
-def apply_job(job_path: Path):
-    job = json.loads(job_path.read_text(encoding="utf-8"))
-    args = [
-        sys.executable, str(SURGEON),
-        "--file", job["file"],
-        "--mode", job["mode"],
-        "--start", str(job["start"]),
-        "--end", str(job["end"]),
-        "--new-fragment", job["new_fragment_path"],
-        "--keep-indent"
-    ]
-    if job.get("post_cmd"):
-        args += ["--post-cmd", job["post_cmd"]]
+def apply_job(job_path: Path, session: SurgeonSession):
+    """Aplica un job en este mismo proceso reutilizando el contexto de la sesión"""
+    print(f"[JOB] Applying {job_path.name}")
+    try:
+        job = json.loads(job_path.read_text(encoding="utf-8"))
+        result = session.execute_job(job)
+        ok = result["ok"]
+        out = json.dumps(result, ensure_ascii=False, indent=2)
+    except Exception:
+        ok = False
+        out = traceback.format_exc()
+    (APPLIED if ok else FAILED).joinpath(job_path.name).write_text(out, encoding="utf-8")
+    job_path.unlink(missing_ok=True)
+    print(("[OK] " if ok else "[FAIL] ") + job_path.name)
+
+def apply_job_isolated(job_path: Path):
+    """Aplica un job lanzando el CLI en un proceso aparte (--isolated)"""
+    args = [sys.executable, str(SURGEON), "--job", str(job_path), "--keep-indent"]
     print(f"[JOB] Applying {job_path.name} ->", " ".join(args))
     p = subprocess.run(args, capture_output=True, text=True)
     out = (p.stdout or "") + (p.stderr or "")
@@ -32,15 +40,25 @@ def apply_job(job_path: Path):
     print(("[OK] " if ok else "[FAIL] ") + job_path.name)
 
 def main():
-    print("[watch] Watching", JOBS)
+    isolated = "--isolated" in sys.argv[1:]
+    print("[watch] Watching", JOBS, "(isolated)" if isolated else "")
     seen = set()
-    while True:
-        for j in JOBS.glob("*.json"):
-            if j.name in seen:  # process once
-                continue
-            seen.add(j.name)
-            apply_job(j)
-        time.sleep(0.75)
+    # Jest/Vitest quedan cargados entre jobs salvo con --cold-tests (o en modo --isolated)
+    warm = not isolated and "--cold-tests" not in sys.argv[1:]
+    with SurgeonSession(keep_indent=True, test_daemons=warm) as session:
+        # Intenciones de escritura abiertas por un crash anterior (solo la cola del journal)
+        for entry in session.recover(ROOT):
+            print(f"[recover] {entry['status']}: {entry['file']}")
+        while True:
+            for j in JOBS.glob("*.json"):
+                if j.name in seen:  # process once
+                    continue
+                seen.add(j.name)
+                if isolated:
+                    apply_job_isolated(j)
+                else:
+                    apply_job(j, session)
+            time.sleep(0.75)
 
 if __name__ == "__main__":
     main()